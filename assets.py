@@ -0,0 +1,198 @@
+"""
+File: assets.py
+Asynchronous loading of the asteroids game's textures and sounds.
+
+The manifest lists every resource the game uses: the background, the sprite
+atlas holding the image of every FlyingObject class (see atlas.py) and the
+sound of every world event, with what the first frame shows first. An
+AssetManager decodes them on a thread pool while the window is already
+drawing. Until a texture is resident the
+TextureCache hands out a placeholder of the same size (a faint outline, or
+for the background a solid fill of the window's clear colour), and the Mixer skips sounds that have not
+arrived yet, so the game plays from its first frame.
+
+    python assets.py --workers 1 4    # time loading the manifest
+    python assets.py --no-atlas       # ... with one texture per sprite
+"""
+import argparse
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import arcade
+
+from PIL import Image
+from PIL import ImageDraw
+
+from asteroidsFinal import BACKGROUND_IMAGE, FIRST_FRAME_IMAGES, HIT_SOUND, SHOOT_SOUND, TEXTURES
+from atlas import load_atlas
+from atlas import sprite_images
+from audio import ArcadeAudioBackend
+from audio import Mixer
+
+ASSET_TEXTURE = "texture"
+ASSET_SOUND = "sound"
+ASSET_ATLAS = "atlas"
+
+# manifest path of the sprite atlas
+SPRITE_ATLAS = "sprite_atlas"
+
+# threads decoding assets
+ASSET_WORKERS = 4
+
+# outline drawn on a placeholder
+PLACEHOLDER_COLOR = (255, 255, 255, 64)
+
+# images whose placeholder is one opaque pixel of this colour instead of an outline,
+# so the background layer still covers the whole screen (the Compositor does not
+# clear under it) and shows the clear colour until the stars arrive
+SOLID_PLACEHOLDERS = {BACKGROUND_IMAGE: arcade.color.SMOKY_BLACK}
+
+
+def build_manifest(sounds=(), atlas=True):
+    """
+    Lists every asset the game uses, starting with what the first frame shows
+    :param sounds: (mixer name, path) of each sound
+    :param atlas: load the sprites as one atlas rather than one texture each
+    Return: list of (ASSET_* kind, path, mixer name or the atlas's sprite paths or None)
+    """
+    sprites = sprite_images() if atlas else []
+    images = list(FIRST_FRAME_IMAGES)
+    for img in [BACKGROUND_IMAGE] + sprites:
+        if img not in images:
+            images.append(img)
+    manifest = []
+    for path in images:
+        if path not in sprites:
+            manifest.append((ASSET_TEXTURE, path, None))
+        elif (ASSET_ATLAS, SPRITE_ATLAS, tuple(sprites)) not in manifest:
+            #the atlas goes where the first sprite the first frame shows would have
+            manifest.append((ASSET_ATLAS, SPRITE_ATLAS, tuple(sprites)))
+    return manifest + [(ASSET_SOUND, path, name) for name, path in sounds]
+
+
+def make_placeholder(path):
+    """
+    Builds a texture to draw until the image at path is loaded: an outlined
+    ellipse of the image's size (only the file header is read), or an opaque
+    pixel for SOLID_PLACEHOLDERS
+    Return: arcade.Texture
+    """
+    if path in SOLID_PLACEHOLDERS:
+        image = Image.new("RGBA", (1, 1), tuple(SOLID_PLACEHOLDERS[path][:3]) + (255,))
+    else:
+        with Image.open(arcade.resources.resolve_resource_path(path)) as source:
+            width, height = source.size
+        image = Image.new("RGBA", (width, height))
+        ImageDraw.Draw(image).ellipse((0, 0, width - 1, height - 1), outline=PLACEHOLDER_COLOR, width=2)
+    return arcade.Texture("placeholder:" + path, image, hit_box_algorithm="None")
+
+
+class AssetManager():
+    """
+    Loads a manifest on a thread pool into a TextureCache and a Mixer.
+    start() returns at once; progress() says how far the pool has got.
+    """
+    def __init__(self, manifest, textures=TEXTURES, mixer=None, workers=ASSET_WORKERS, startup=None,
+                 cache_dir=None):
+        """
+        :param mixer: Mixer the sounds are loaded into; sounds are skipped without one
+        :param startup: StartupTimer each load is recorded in, if any
+        :param cache_dir: where the sprite atlas is cached, atlas.default_cache_dir() by default
+        """
+        self.manifest = list(manifest)
+        self.textures = textures
+        self.mixer = mixer
+        self.workers = workers
+        self.startup = startup
+        self.cache_dir = cache_dir
+        #the SpriteAtlas once it is loaded
+        self.atlas = None
+        self.loaded = 0
+        self.lock = threading.Lock()
+        self.futures = []
+
+    def start(self):
+        """
+        Puts a placeholder in for every texture not loaded yet and hands the
+        manifest to the thread pool
+        Return: self
+        """
+        for kind, path, name in self.manifest:
+            images = name if kind == ASSET_ATLAS else (path,) if kind == ASSET_TEXTURE else ()
+            for image in images:
+                if not self.textures.resident(image):
+                    self.textures.expect(image, make_placeholder(image))
+        executor = ThreadPoolExecutor(self.workers, thread_name_prefix="asset-loader")
+        self.futures = [executor.submit(self.load, kind, path, name) for kind, path, name in self.manifest]
+        executor.shutdown(wait=False)
+        return self
+
+    def load(self, kind, path, name):
+        """
+        Loads one asset. Runs on a pool thread.
+        """
+        began = time.perf_counter()
+        try:
+            if kind == ASSET_TEXTURE:
+                texture = self.textures.load(path)[0]
+                #work the hit box out here rather than when the first sprite is made
+                texture.hit_box_points
+            elif kind == ASSET_ATLAS:
+                self.atlas = load_atlas(name, self.cache_dir)
+                for image in name:
+                    self.textures.add(image, self.atlas.texture(image))[0].hit_box_points
+            elif self.mixer is not None:
+                self.mixer.load(name, path)
+        finally:
+            with self.lock:
+                self.loaded += 1
+                done = self.loaded == len(self.manifest)
+            if self.startup is not None:
+                self.startup.record("load " + path.rsplit("/", 1)[-1], time.perf_counter() - began)
+                if done:
+                    self.startup.mark("assets_resident")
+
+    def progress(self):
+        """
+        Return: tuple of (assets loaded, assets in the manifest)
+        """
+        return self.loaded, len(self.manifest)
+
+    def finished(self):
+        return self.loaded == len(self.manifest)
+
+    def wait(self, timeout=None):
+        """
+        Blocks until every asset has been loaded, raising the first error a load hit
+        """
+        for future in self.futures:
+            future.result(timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time loading every asset of the asteroids game")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, ASSET_WORKERS])
+    parser.add_argument("--no-atlas", action="store_true", help="load every sprite as a texture of its own")
+    parser.add_argument("--cache-dir", default=None, help="where the sprite atlas is cached")
+    args = parser.parse_args(argv)
+
+    manifest = build_manifest((("hit", HIT_SOUND), ("shoot", SHOOT_SOUND)), not args.no_atlas)
+    for workers in args.workers:
+        #a fresh cache and a fresh arcade texture cache each time
+        arcade.cleanup_texture_cache()
+        textures = type(TEXTURES)()
+        start = time.perf_counter()
+        manager = AssetManager(manifest, textures, Mixer(ArcadeAudioBackend()), workers,
+                               cache_dir=args.cache_dir).start()
+        started = time.perf_counter()
+        manager.wait()
+        finished = time.perf_counter()
+        print("{} workers: {} assets, start() returned after {:.1f} ms, all resident after {:.1f} ms".format(
+            workers, len(manifest), (started - start) * 1000, (finished - start) * 1000), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,27 @@ File: asteroids.py
 Original Author: Br. Burton
 Designed to be completed by others
 This program implements the asteroids game.
+
+Only the simulation lives here and arcade is never imported at the top, so
+a headless World starts quickly; the window is in game_window.py.
 """
-import arcade
+import time
+
+# start of the startup clock, taken before anything heavy is imported
+IMPORT_STARTED = time.perf_counter()
+
 import random
 import math
+import threading
+import numpy as np
 
 from abc import ABC
 from abc import abstractmethod
+from itertools import compress
+from itertools import repeat
+
+from profiler import NULL_PROFILER
+from profiler import StartupTimer
 
 # These are Global constants to use throughout the game
 SCREEN_WIDTH = 800
@@ -25,6 +39,12 @@ SHIP_RADIUS = 30
 
 INITIAL_ROCK_COUNT = 5
 
+# the simulation always advances in ticks of this length, whatever the frame rate
+TICKS_PER_SECOND = 60
+TICK_TIME = 1 / TICKS_PER_SECOND
+# most ticks run to catch up after one slow frame; the rest of the backlog is dropped
+MAX_CATCH_UP_TICKS = 8
+
 BIG_ROCK_SPIN = 1
 BIG_ROCK_SPEED = 1.5
 BIG_ROCK_RADIUS = 15
@@ -35,53 +55,848 @@ MEDIUM_ROCK_RADIUS = 5
 SMALL_ROCK_SPIN = 5
 SMALL_ROCK_RADIUS = 2
 
-class Point():
+SHIP_IMAGE = ":resources:images/space_shooter/playerShip1_orange.png"
+BULLET_IMAGE = ":resources:images/space_shooter/laserBlue01.png"
+BIG_ROCK_IMAGE = ":resources:images/space_shooter/meteorGrey_big1.png"
+MEDIUM_ROCK_IMAGE = ":resources:images/space_shooter/meteorGrey_med1.png"
+SMALL_ROCK_IMAGE = ":resources:images/space_shooter/meteorGrey_small1.png"
+BACKGROUND_IMAGE = ":resources:images/backgrounds/stars.png"
+
+HIT_SOUND = ":resources:sounds/explosion1.wav"
+SHOOT_SOUND = ":resources:sounds/laser2.wav"
+
+SPRITE_IMAGES = (SHIP_IMAGE, BULLET_IMAGE, BIG_ROCK_IMAGE, MEDIUM_ROCK_IMAGE, SMALL_ROCK_IMAGE)
+
+# what the first frame shows, so the asset loader queues these first
+FIRST_FRAME_IMAGES = (BACKGROUND_IMAGE, SHIP_IMAGE, BIG_ROCK_IMAGE)
+
+class TextureCache():
     """
-    this class initiates a location on x and y coordinates
+    Process-wide registry of loaded textures keyed by resource path, so
+    spawning a flying object never goes back to the texture loader. While an
+    asset loader is still working on a path it registered with expect(), the
+    placeholder is handed out instead of loading the texture on the spot.
+
+    Loader threads call add() while the game thread calls lookup(), so both
+    go through self.lock; a texture is only loaded on the spot when the path has
+    neither an entry nor a placeholder, and an entry added meanwhile wins.
     """
     def __init__(self):
-        self.x = 0.0
-        self.y = 0.0
-        
-class Velocity():
+        self.entries = {}
+        self.lock = threading.Lock()
+        #path -> (texture, width, height) to stand in until the real one is loaded
+        self.placeholders = {}
+        self.hits = 0
+        self.misses = 0
+        self.placeholder_hits = 0
+
+    def preload(self, paths):
+        """
+        Loads every texture in paths up front (e.g. before the first frame)
+        :param paths: iterable of resource paths
+        """
+        for path in paths:
+            if path not in self.entries:
+                self._load(path)
+
+    def get(self, path):
+        """
+        Returns the shared texture for path, loading it on a miss
+        Return: arcade.Texture
+        """
+        return self.lookup(path)[0]
+
+    def size(self, path):
+        """
+        Returns the (width, height) of the texture for path
+        Return: tuple
+        """
+        entry = self.lookup(path)
+        return entry[1], entry[2]
+
+    def lookup(self, path):
+        """
+        Returns the (texture, width, height) entry for path and counts the hit or miss
+        Return: tuple
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.hits += 1
+                return entry
+            placeholder = self.placeholders.get(path)
+            if placeholder is not None:
+                self.placeholder_hits += 1
+                return placeholder
+            self.misses += 1
+        return self._load(path)
+
+    def expect(self, path, placeholder):
+        """
+        Hands out placeholder for path until load(path) has finished
+        :param placeholder: texture to stand in for the real one
+        """
+        with self.lock:
+            if path not in self.entries:
+                self.placeholders[path] = (placeholder, placeholder.width, placeholder.height)
+
+    def load(self, path):
+        """
+        Loads the texture for path, replacing its placeholder. May run on a loader thread.
+        Return: tuple of (texture, width, height)
+        """
+        return self.add(path, self._load_texture(path))
+
+    def add(self, path, texture):
+        """
+        Registers texture as the one for path (e.g. one cut from a sprite
+        atlas), replacing its placeholder. May run on a loader thread.
+        Return: tuple of (texture, width, height)
+        """
+        entry = (texture, texture.width, texture.height)
+        with self.lock:
+            self.entries[path] = entry
+            self.placeholders.pop(path, None)
+        return entry
+
+    def resident(self, path):
+        """
+        Returns whether the real texture for path is loaded
+        """
+        return path in self.entries
+
+    def _load(self, path):
+        #loaded outside the lock; if a loader thread added path meanwhile, its entry is kept
+        texture = self._load_texture(path)
+        with self.lock:
+            return self.entries.setdefault(path, (texture, texture.width, texture.height))
+
+    def _load_texture(self, path):
+        import arcade
+        return arcade.load_texture(path)
+
+    def stats(self):
+        """
+        Returns the cache counters
+        Return: dict
+        """
+        with self.lock:
+            return {"textures": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "placeholder_hits": self.placeholder_hits}
+
+TEXTURES = TextureCache()
+
+def collision_cell_size():
     """
-    A class to set a random velocity of the ball
+    Returns the SpatialHash cell size for the radius constants as they are
+    now (batch.py --set may have changed them since import): no bullet/rock
+    or ship/rock pair can overlap from further apart than one cell
     """
-    def __init__(self):
-        self.dx = 0
-        self.dy = 0
+    return max(BIG_ROCK_RADIUS, MEDIUM_ROCK_RADIUS, SMALL_ROCK_RADIUS) + max(BULLET_RADIUS, SHIP_RADIUS)
+
+# offsets of the 3x3 block of cells SpatialHash.mark flags around a probe
+NEIGHBOUR_CELLS = tuple((offset_x, offset_y) for offset_x in (-1, 0, 1) for offset_y in (-1, 0, 1))
+
+class SpatialHash():
+    """
+    Uniform grid broadphase for collision checks, built from the store
+    columns with NumPy instead of one insert per object. mark() flags the
+    3x3 block of cells around the few probe points (bullets and ships) and
+    near() finds every rock in a flagged cell, so rocks far from every probe
+    are dropped before anything else. bucket() then sorts the remaining rocks
+    by cell and pairs() lists the rocks in the block around each probe, so a
+    bullet is only ever tested against its own neighbourhood.
+
+    Cells are keyed on the raw (unwrapped) coordinates. FlyingObject.wrap lets
+    objects sit slightly outside the screen and the overlap test does not look
+    across the screen edge, so neither does the grid. Anything further out
+    than one cell past the screen is clamped into that border cell, which can
+    only add candidates, never lose one.
+    """
+    def __init__(self, cell_size=None):
+        if cell_size is None:
+            cell_size = collision_cell_size()
+        self.cell_size = cell_size
+        #cells per axis; cell coordinates run from -1 to these, border cells included
+        self.columns = math.ceil(SCREEN_WIDTH / cell_size)
+        self.rows = math.ceil(SCREEN_HEIGHT / cell_size)
+        #cells are keyed column by column with two spare cells on every side,
+        #so the block around a border cell still has keys
+        self.stride = self.rows + 4
+        self.marked = np.zeros((self.columns + 4) * self.stride, dtype=bool)
+        self.neighbours = np.array([offset_x * self.stride + offset_y for offset_x, offset_y in NEIGHBOUR_CELLS])
+        #small keys let bucket() sort with a radix sort
+        self.key_type = np.int16 if self.marked.size <= np.iinfo(np.int16).max else np.intp
+        #bucketed points, sorted by cell, and where each cell's run starts and ends
+        self.order = np.zeros(0, dtype=np.intp)
+        self.starts = np.zeros(self.marked.size, dtype=np.intp)
+        self.ends = np.zeros(self.marked.size, dtype=np.intp)
+
+    def clear(self):
+        """
+        Forgets every probe, ready for the next tick
+        """
+        self.marked[:] = False
+
+    def keys(self, x, y):
+        """
+        Returns the cell key of every point
+        Return: NumPy int array
+        """
+        cell_x = np.floor(x / self.cell_size)
+        cell_y = np.floor(y / self.cell_size)
+        np.clip(cell_x, -1, self.columns, out=cell_x)
+        np.clip(cell_y, -1, self.rows, out=cell_y)
+        cell_x += 2
+        cell_x *= self.stride
+        cell_x += cell_y
+        cell_x += 2
+        return cell_x.astype(np.intp)
+
+    def mark(self, x, y):
+        """
+        Flags the 3x3 block of cells around every probe point (NumPy arrays)
+        """
+        self.marked[(self.keys(x, y)[:, None] + self.neighbours).ravel()] = True
+
+    def near(self, x, y):
+        """
+        Returns which points (NumPy arrays) lie in a cell flagged by mark()
+        Return: NumPy bool array
+        """
+        return self.marked[self.keys(x, y)]
+
+    def bucket(self, indices, x, y):
+        """
+        Sorts points into their cells, replacing the last bucketed set
+        :param indices: NumPy array naming each point, handed back by pairs()
+        :param x: NumPy array of x coordinates
+        :param y: NumPy array of y coordinates
+        """
+        keys = self.keys(x, y)
+        counts = np.bincount(keys, minlength=self.marked.size)
+        np.cumsum(counts, out=self.ends)
+        np.subtract(self.ends, counts, out=self.starts)
+        self.order = indices[np.argsort(keys.astype(self.key_type), kind="stable")]
+
+    def pairs(self, x, y):
+        """
+        Lists every bucketed point in the 3x3 block of cells around each probe point
+        Return: (probe positions, point indices) NumPy arrays, grouped by probe in order
+        """
+        cells = (self.keys(x, y)[:, None] + self.neighbours).ravel()
+        starts = self.starts[cells]
+        lengths = self.ends[cells] - starts
+        probes = np.repeat(np.repeat(np.arange(len(x)), len(self.neighbours)), lengths)
+        positions = np.arange(probes.size) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return probes, self.order[positions]
+
+# entity kinds stored in the EntityStore kind column
+KIND_OBJECT = 0
+KIND_SHIP = 1
+KIND_BULLET = 2
+KIND_ROCK = 3
+KIND_BIG_ROCK = 4
+KIND_MEDIUM_ROCK = 5
+KIND_SMALL_ROCK = 6
+
+ENTITY_CAPACITY = 256
+
+# names accepted by World.set_collision_backend
+COLLISION_BACKENDS = ("grid", "numpy", "scalar")
+
+# below this many asteroids flagging grid cells costs more than testing them all
+GRID_MIN_ROCKS = 256
+
+BULLET_POOL_CAPACITY = 256
+ROCK_POOL_CAPACITY = 1024
+
+# what an ObjectPool does when every object it may hand out is live
+POOL_POLICIES = ("grow", "drop", "recycle")
+
+# bits of World.controls, one per ship control that can be held down
+CONTROL_LEFT = 1
+CONTROL_RIGHT = 2
+CONTROL_THRUST = 4
+CONTROL_REVERSE = 8
+CONTROL_BRAKE = 16
+
+# events a World reports for the window to play sounds for
+EVENT_HIT = "hit"
+EVENT_SHOOT = "shoot"
+
+class EntityStore():
+    """
+    Structure-of-arrays storage for flying objects. Every object owns one row of
+    the x, y, dx, dy, angle, spin, radius, life, alive and kind columns, which
+    lets step() move the whole field with a handful of NumPy operations.
+    prev_x, prev_y and prev_angle hold the state before the last tick for
+    interpolated drawing; they are NaN for objects spawned since then.
+    order numbers rows in spawn order, which is also the order of the objects
+    in their game list, so a snapshot can rebuild the lists from the columns.
+
+    Rows are kept dense: release() moves the last row into the freed slot and
+    tells the moved object its new row. The EntityLists over the store learn
+    of the moves in one go, from remap_lists().
+    """
+    def __init__(self, capacity=ENTITY_CAPACITY):
+        self.count = 0
+        self.owners = []
+        self.next_order = 0
+        # ObjectPool per FlyingObject type, used by spawn() and discard()
+        self.pools = {}
+        # EntityLists whose rows remap_lists() keeps up to date
+        self.lists = []
+        # row -> the row its object had when the lists were last remapped, for rows moved since
+        self.moved = {}
+        self._allocate_columns(capacity)
+
+    def _allocate_columns(self, capacity):
+        old = getattr(self, "columns", None)
+        self.capacity = capacity
+        self.x = np.zeros(capacity)
+        self.y = np.zeros(capacity)
+        self.dx = np.zeros(capacity)
+        self.dy = np.zeros(capacity)
+        self.angle = np.zeros(capacity)
+        self.spin = np.zeros(capacity)
+        self.radius = np.zeros(capacity)
+        self.life = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.kind = np.zeros(capacity, dtype=np.int8)
+        self.prev_x = np.zeros(capacity)
+        self.prev_y = np.zeros(capacity)
+        self.prev_angle = np.zeros(capacity)
+        self.order = np.zeros(capacity, dtype=np.int64)
+        self.columns = (self.x, self.y, self.dx, self.dy, self.angle, self.spin,
+                        self.radius, self.life, self.alive, self.kind,
+                        self.prev_x, self.prev_y, self.prev_angle, self.order)
+        if old is not None:
+            for new_column, old_column in zip(self.columns, old):
+                new_column[:self.count] = old_column[:self.count]
+
+    def allocate(self, owner, kind):
+        """
+        Reserves a zeroed row for owner, growing the columns when they are full
+        Return: int row index
+        """
+        if self.count == self.capacity:
+            self._allocate_columns(self.capacity * 2)
+        row = self.count
+        self.order[row] = self.next_order
+        self.next_order += 1
+        self.reset_row(row, kind)
+        self.owners.append(owner)
+        self.count += 1
+        return row
+
+    def reset_row(self, row, kind):
+        """
+        Zeroes every column of a row but its spawn order and marks it alive.
+        The order is handed out once, by allocate(), so how often an object
+        is reset on its way into the game does not change the orders of the
+        objects spawned after it.
+        """
+        order = self.order[row]
+        for column in self.columns:
+            column[row] = 0
+        self.alive[row] = True
+        self.kind[row] = kind
+        self.order[row] = order
+        self.prev_x[row] = np.nan
+        self.prev_y[row] = np.nan
+        self.prev_angle[row] = np.nan
+
+    def save_previous(self):
+        """
+        Remembers the current positions and angles as the state before the next tick
+        """
+        n = self.count
+        self.prev_x[:n] = self.x[:n]
+        self.prev_y[:n] = self.y[:n]
+        self.prev_angle[:n] = self.angle[:n]
+
+    def interpolated(self, rows, alpha):
+        """
+        Blends the previous and current x, y and angle of rows. Objects that
+        wrapped around the screen or spawned during the last tick are not blended.
+        :param alpha: fraction of a tick elapsed since the last one, 0 to 1
+        Return: tuple of x, y and angle arrays
+        """
+        x = self.x[rows]
+        y = self.y[rows]
+        angle = self.angle[rows]
+        if alpha >= 1:
+            return x, y, angle
+        prev_x = self.prev_x[rows]
+        prev_y = self.prev_y[rows]
+        prev_angle = self.prev_angle[rows]
+        blend = ~(np.isnan(prev_x) | (np.abs(x - prev_x) > SCREEN_WIDTH / 2) |
+                  (np.abs(y - prev_y) > SCREEN_HEIGHT / 2))
+        x[blend] = prev_x[blend] + (x[blend] - prev_x[blend]) * alpha
+        y[blend] = prev_y[blend] + (y[blend] - prev_y[blend]) * alpha
+        angle[blend] = prev_angle[blend] + (angle[blend] - prev_angle[blend]) * alpha
+        return x, y, angle
+
+    def release(self, owner):
+        """
+        Frees the row owned by owner. The owner must not be used afterwards.
+        """
+        row = owner.row
+        last = self.count - 1
+        if row != last:
+            for column in self.columns:
+                column[row] = column[last]
+            moved = self.owners[last]
+            self.owners[row] = moved
+            moved.row = row
+            if self.lists:
+                self.moved[row] = self.moved.pop(last, last)
+        elif self.lists:
+            self.moved.pop(last, None)
+        self.owners.pop()
+        self.count = last
+        owner.row = -1
+
+    def remap_lists(self):
+        """
+        Renumbers the rows of every EntityList over the store for the rows
+        release() has moved since the last call
+        """
+        remap = np.arange(self.capacity)
+        remap[list(self.moved.values())] = list(self.moved.keys())
+        self.moved.clear()
+        for objects in self.lists:
+            objects.renumber(remap)
+
+    def step(self):
+        """
+        Advances every bullet and rock by one tick: wrap, move, spin and bullet
+        life, matching the advance() methods of the individual classes.
+        Objects of KIND_OBJECT/KIND_SHIP are left to their own advance().
+        """
+        n = self.count
+        kind = self.kind[:n]
+        moving = kind >= KIND_BULLET
+        x = self.x[:n]
+        y = self.y[:n]
+
+        x[moving & (x > SCREEN_WIDTH)] -= SCREEN_WIDTH
+        x[moving & (x < 0)] += SCREEN_WIDTH
+        y[moving & (y > SCREEN_HEIGHT)] -= SCREEN_HEIGHT
+        y[moving & (y < 0)] += SCREEN_HEIGHT
+
+        x[moving] += self.dx[:n][moving]
+        y[moving] += self.dy[:n][moving]
+        self.angle[:n][moving] += self.spin[:n][moving]
+
+        bullets = kind == KIND_BULLET
+        life = self.life[:n]
+        life[bullets] -= 1
+        self.alive[:n][bullets & (life <= 0)] = False
+
+    def spawn(self, cls, objects, *args):
+        """
+        Creates an object of cls in this store and appends it to objects, going
+        through the pool registered for cls in self.pools when there is one
+        :param objects: the game list the object belongs to (e.g. World.bullets)
+        Return: the object, or None when the pool dropped the request
+        """
+        pool = self.pools.get(cls)
+        if pool is None:
+            obj = cls(*args, store=self)
+            objects.append(obj)
+            return obj
+        return pool.spawn(objects, *args)
+
+    def discard(self, obj):
+        """
+        Frees the row of an object removed from the game, handing the object
+        back to its pool when it came from one
+        """
+        pool = self.pools.get(type(obj))
+        if pool is None:
+            self.release(obj)
+        else:
+            pool.release(obj)
+
+ENTITIES = EntityStore()
+
+# up to this many dead objects are deleted in place, more rebuild the whole list
+LIST_DELETE_LIMIT = 32
+
+class EntityList(list):
+    """
+    A game list of flying objects (World.asteroids, World.bullets) that also
+    keeps the entity store row of each object, in list order, as a NumPy
+    array. remove_dead and the collision checks index the columns with it
+    instead of gathering obj.row from every object on every tick.
+
+    append() adds the new object's row and the store renumbers the rows when
+    release() moves one; any other change to the list has them gathered
+    again by the next rows().
+    """
+    def __init__(self, store, objects=()):
+        super().__init__(objects)
+        self.store = store
+        self.row_buffer = np.zeros(max(len(self), 16), dtype=np.intp)
+        self.stale = True
+        store.lists.append(self)
+
+    def rows(self):
+        """
+        Returns the entity store row of every object, in list order
+        Return: NumPy array, only valid until the list or the store changes
+        """
+        if self.store.moved:
+            self.store.remap_lists()
+        count = len(self)
+        if self.stale:
+            self.reserve(count)
+            self.row_buffer[:count] = np.fromiter((obj.row for obj in self), dtype=np.intp, count=count)
+            self.stale = False
+        return self.row_buffer[:count]
+
+    def reserve(self, count):
+        """
+        Grows the row buffer to hold at least count rows
+        """
+        if count > len(self.row_buffer):
+            buffer = np.zeros(max(count, len(self.row_buffer) * 2), dtype=np.intp)
+            buffer[:len(self.row_buffer)] = self.row_buffer
+            self.row_buffer = buffer
+
+    def renumber(self, remap):
+        """
+        Maps every row through remap, called by EntityStore.remap_lists()
+        """
+        if not self.stale:
+            rows = self.row_buffer[:len(self)]
+            rows[:] = remap[rows]
+
+    def append(self, obj):
+        if not self.stale:
+            if self.store.moved:
+                self.store.remap_lists()
+            count = len(self)
+            self.reserve(count + 1)
+            self.row_buffer[count] = obj.row
+        super().append(obj)
+
+    def keep(self, flags):
+        """
+        Drops every object whose flag is False, keeping the order of the rest.
+        A few are deleted in place, which beats copying a long list; more than
+        LIST_DELETE_LIMIT are dropped in one pass.
+        :param flags: NumPy bool array, one per object in list order
+        """
+        dropped = np.flatnonzero(~flags)
+        if len(dropped) <= LIST_DELETE_LIMIT:
+            size = len(flags)
+            for index in dropped[::-1].tolist():
+                list.__delitem__(self, index)
+                if not self.stale:
+                    self.row_buffer[index:size - 1] = self.row_buffer[index + 1:size]
+                size -= 1
+            return
+        list.__setitem__(self, slice(None), compress(self, flags.tolist()))
+        if not self.stale:
+            kept = self.row_buffer[:len(flags)][flags]
+            self.row_buffer[:len(kept)] = kept
+
+    def changed(method):
+        """
+        Wraps a list method so calling it has the rows gathered again
+        """
+        def changed_method(self, *args):
+            self.stale = True
+            return method(self, *args)
+        changed_method.__name__ = method.__name__
+        return changed_method
+
+    __setitem__ = changed(list.__setitem__)
+    __delitem__ = changed(list.__delitem__)
+    __iadd__ = changed(list.__iadd__)
+    __imul__ = changed(list.__imul__)
+    extend = changed(list.extend)
+    insert = changed(list.insert)
+    pop = changed(list.pop)
+    remove = changed(list.remove)
+    clear = changed(list.clear)
+    sort = changed(list.sort)
+    reverse = changed(list.reverse)
+    del changed
+
+class ObjectPool():
+    """
+    Bounded free list of one FlyingObject type. Released objects are reset to
+    their spawn state when they are handed out again.
+
+    capacity bounds the number of live objects and the size of the free list.
+    When every object is live the policy decides: "grow" creates one anyway,
+    "drop" refuses the request and "recycle" reuses the oldest live object
+    in place (it keeps its slot in the game list).
+    """
+    def __init__(self, cls, store, capacity, policy="grow"):
+        if policy not in POOL_POLICIES:
+            raise ValueError("unknown pool policy {!r}, expected one of {}".format(policy, POOL_POLICIES))
+        self.cls = cls
+        self.store = store
+        self.capacity = capacity
+        self.policy = policy
+        self.free = []
+        # insertion ordered, so the first key is the oldest live object
+        self.live = {}
+        self.high_water = 0
+        self.created = 0
+        self.reused = 0
+        self.dropped = 0
+        self.recycled = 0
+
+    def acquire(self, *args):
+        """
+        Hands out an object reset with the spawn arguments of cls
+        Return: the object, or None when the "drop" policy refused the request
+        """
+        return self._acquire(args)[0]
+
+    def spawn(self, objects, *args):
+        """
+        Acquires an object and appends it to objects unless it was recycled from that list
+        Return: the object or None
+        """
+        obj, recycled = self._acquire(args)
+        if obj is not None and not recycled:
+            objects.append(obj)
+        return obj
+
+    def _acquire(self, args):
+        if len(self.live) >= self.capacity and self.policy != "grow":
+            if self.policy == "drop":
+                self.dropped += 1
+                return None, False
+            obj = next(iter(self.live))
+            del self.live[obj]
+            # it stays where it is in its game list, and reset keeps its spawn order
+            obj.reset(*args)
+            self.live[obj] = None
+            self.recycled += 1
+            return obj, True
+
+        if self.free:
+            obj = self.free.pop()
+            obj.row = self.store.allocate(obj, obj.kind)
+            obj.reset(*args)
+            self.reused += 1
+        else:
+            obj = self.cls(*args, store=self.store)
+            self.created += 1
+        self.live[obj] = None
+        if len(self.live) > self.high_water:
+            self.high_water = len(self.live)
+        return obj, False
+
+    def release(self, obj):
+        """
+        Takes a dead object back, freeing its entity store row
+        """
+        del self.live[obj]
+        self.store.release(obj)
+        if len(self.free) < self.capacity:
+            self.free.append(obj)
+
+    def stats(self):
+        """
+        Returns the pool counters
+        Return: dict
+        """
+        return {"live": len(self.live), "free": len(self.free), "high_water": self.high_water,
+                "created": self.created, "reused": self.reused, "dropped": self.dropped,
+                "recycled": self.recycled}
+
+def overlap_matrix(x1, y1, radius1, x2, y2, radius2):
+    """
+    Broadcasts the collision test used by World.check_collisions over two sets of objects
+    Return: boolean array of shape (len(x1), len(x2))
+    """
+    max_dist = radius1[:, None] + radius2[None, :]
+    return (np.abs(x2[None, :] - x1[:, None]) < max_dist) & (np.abs(y2[None, :] - y1[:, None]) < max_dist)
+
+def first_overlaps(count, bullets, indices):
+    """
+    Condenses bullet/asteroid overlap pairs for World.resolve_hits
+    :param count: number of bullets
+    :param bullets: NumPy array of bullet indices, ascending
+    :param indices: NumPy array of the index into asteroids each bullet overlaps
+    Return: (first, overlaps): NumPy array of each bullet's lowest overlapping
+        index (-1 for none), and a function returning one bullet's overlapping indices sorted
+    """
+    first = np.full(count, -1, dtype=np.intp)
+    starts = np.flatnonzero(np.diff(bullets, prepend=-1))
+    if starts.size:
+        first[bullets[starts]] = np.minimum.reduceat(indices, starts)
+
+    def overlaps(bullet):
+        start, end = np.searchsorted(bullets, (bullet, bullet + 1))
+        return np.sort(indices[start:end])
+    return first, overlaps
 
 class FlyingObject(ABC):
     """
     Base class for flying objects (bullets, rocks, ship) with applicable class methods
+    Position, velocity, angle, radius and alive live in a row of an EntityStore;
+    an instance only holds its store and row. What is the same for every
+    object of a type (kind, image, speed) is kept on the class.
     """
-    def __init__(self, img):
+    __slots__ = ("store", "row")
+
+    kind = KIND_OBJECT
+    img = None
+    speed = 0
+    direction = 0
+
+    def __init__(self, store=None):
         #initialize flying object
-        self.center = Point()
-        self.velocity = Velocity()
-        self.img = img
-        self.texture = arcade.load_texture(self.img)
-        self.width = self.texture.width
-        self.height = self.texture.height
+        self.store = store if store is not None else ENTITIES
+        self.row = self.store.allocate(self, self.kind)
+        FlyingObject.reset(self)
+
+    def reset(self):
+        """
+        Puts the object back into its spawn state so a pooled instance can be reused
+        """
+        self.store.reset_row(self.row, self.kind)
         self.radius = SHIP_RADIUS
-        self.angle = 0
-        self.speed = 0
-        self.direction = 0
-        self.alive = True
+
+    @classmethod
+    def adopt(cls, store, row):
+        """
+        Builds an object for a store row that already holds its state, such as
+        one restored from a snapshot, without allocating or resetting the row
+        Return: the object
+        """
+        obj = cls.__new__(cls)
+        obj.store = store
+        obj.row = row
+        return obj
+
+    @classmethod
+    def adopt_rows(cls, store, rows):
+        """
+        Builds an object for each of rows as adopt() does, creating them all in one go
+        :param rows: list of store rows
+        Return: list of the objects, one per row
+        """
+        objects = list(map(cls.__new__, repeat(cls, len(rows))))
+        for obj, row in zip(objects, rows):
+            obj.store = store
+            obj.row = row
+        return objects
+
+    @property
+    def center(self):
+        """
+        The object itself, as the x and y of its position were once a Point
+        """
+        return self
+
+    @property
+    def velocity(self):
+        """
+        The object itself, as the dx and dy of its velocity were once a Velocity
+        """
+        return self
+
+    @property
+    def x(self):
+        return self.store.x.item(self.row)
+
+    @x.setter
+    def x(self, value):
+        self.store.x[self.row] = value
+
+    @property
+    def y(self):
+        return self.store.y.item(self.row)
+
+    @y.setter
+    def y(self, value):
+        self.store.y[self.row] = value
+
+    @property
+    def dx(self):
+        return self.store.dx.item(self.row)
+
+    @dx.setter
+    def dx(self, value):
+        self.store.dx[self.row] = value
+
+    @property
+    def dy(self):
+        return self.store.dy.item(self.row)
+
+    @dy.setter
+    def dy(self, value):
+        self.store.dy[self.row] = value
+
+    @property
+    def texture(self):
+        return TEXTURES.get(self.img)
+
+    @property
+    def width(self):
+        return TEXTURES.size(self.img)[0]
+
+    @property
+    def height(self):
+        return TEXTURES.size(self.img)[1]
+
+    @property
+    def angle(self):
+        return self.store.angle.item(self.row)
+
+    @angle.setter
+    def angle(self, value):
+        self.store.angle[self.row] = value
+
+    @property
+    def spin(self):
+        return self.store.spin.item(self.row)
+
+    @spin.setter
+    def spin(self, value):
+        self.store.spin[self.row] = value
+
+    @property
+    def radius(self):
+        return self.store.radius.item(self.row)
+
+    @radius.setter
+    def radius(self, value):
+        self.store.radius[self.row] = value
+
+    @property
+    def alive(self):
+        return self.store.alive.item(self.row)
+
+    @alive.setter
+    def alive(self, value):
+        self.store.alive[self.row] = value
 
     def draw(self):
         """
         Flying Object draw method.  
         """
-        arcade.draw_texture_rectangle(self.center.x, self.center.y, self.width, self.height, self.texture, self.angle, 255)
+        import arcade
+        arcade.draw_texture_rectangle(self.x, self.y, self.width, self.height, self.texture, self.angle, 255)
 
     def advance(self):
         """
         Method to advance flying objects by the dx and dy velocity
         """
         self.wrap()
-        self.center.x += self.velocity.dx
-        self.center.y += self.velocity.dy
+        self.x += self.dx
+        self.y += self.dy
     
     def is_alive(self):
         """
@@ -94,22 +909,33 @@ class FlyingObject(ABC):
         """
         Method to wrap objects to the opposite side of the screen when they reach the edge
         """
-        if self.center.x > SCREEN_WIDTH:
-            self.center.x -= SCREEN_WIDTH
-        if self.center.x < 0:
-            self.center.x += SCREEN_WIDTH
-        if self.center.y > SCREEN_HEIGHT:
-            self.center.y -= SCREEN_HEIGHT
-        if self.center.y < 0:
-            self.center.y += SCREEN_HEIGHT
+        if self.x > SCREEN_WIDTH:
+            self.x -= SCREEN_WIDTH
+        if self.x < 0:
+            self.x += SCREEN_WIDTH
+        if self.y > SCREEN_HEIGHT:
+            self.y -= SCREEN_HEIGHT
+        if self.y < 0:
+            self.y += SCREEN_HEIGHT
 
 class Asteroid(FlyingObject):
     """
     Base asteroid class, which the asteroids are based off of.  
     *May not be needed 
     """
-    def __init__(self, img):
-        super().__init__(img)
+    __slots__ = ()
+
+    kind = KIND_ROCK
+
+    def __init__(self, store=None):
+        super().__init__(store)
+        self.radius = 0.0
+
+    def reset(self):
+        """
+        Puts the asteroid back into its spawn state
+        """
+        super().reset()
         self.radius = 0.0
 
 class SmallRock(Asteroid):
@@ -117,11 +943,27 @@ class SmallRock(Asteroid):
     Small Asteroid class, defines the properties of a small sized asteroid
     *not fully built out, inherates from asteroid class
     """
-    def __init__(self):
-        super().__init__(":resources:images/space_shooter/meteorGrey_small1.png")
+    __slots__ = ()
+
+    kind = KIND_SMALL_ROCK
+    img = SMALL_ROCK_IMAGE
+
+    def __init__(self, store=None):
+        super().__init__(store)
+        self.reset()
+
+    def reset(self):
+        """
+        Puts the small rock back into its spawn state
+        """
+        super().reset()
         self.radius = SMALL_ROCK_RADIUS
-        self.speed =  BIG_ROCK_SPIN
-        
+        self.spin = SMALL_ROCK_SPIN
+
+    @property
+    def speed(self):
+        return BIG_ROCK_SPIN
+
     def advance(self):
         """
         Method to make the the asteroids spin *adds to parent advance method
@@ -140,12 +982,28 @@ class MediumRock(Asteroid):
     Medium Asteroid class, defines the properties of a medium sized asteroid
     *not fully built out, inherates from asteroid class
     """
-    def __init__(self):
-        super().__init__(":resources:images/space_shooter/meteorGrey_med1.png")
+    __slots__ = ()
+
+    kind = KIND_MEDIUM_ROCK
+    img = MEDIUM_ROCK_IMAGE
+
+    def __init__(self, store=None):
+        super().__init__(store)
+        self.reset()
+
+    def reset(self):
+        """
+        Puts the medium rock back into its spawn state
+        """
+        super().reset()
         self.radius = MEDIUM_ROCK_RADIUS
-        self.speed = BIG_ROCK_SPEED
-        self.velocity.dx = math.cos(math.radians(self.direction)) * self.speed
-        self.velocity.dy = math.sin(math.radians(self.direction)) * self.speed
+        self.spin = MEDIUM_ROCK_SPIN
+        self.dx = math.cos(math.radians(self.direction)) * self.speed
+        self.dy = math.sin(math.radians(self.direction)) * self.speed
+
+    @property
+    def speed(self):
+        return BIG_ROCK_SPEED
 
     def advance(self):
         """
@@ -158,20 +1016,20 @@ class MediumRock(Asteroid):
         """
         Method which splits the asteroids apart depending on type when they are hit by bullet
         """
-        small = SmallRock()
-        small.center.x = self.center.x
-        small.center.y = self.center.y
-        small.velocity.dx = self.velocity.dx + 1.5
-        small.velocity.dy = self.velocity.dy + 1.5
-
-        small2 = SmallRock()
-        small2.center.x = self.center.x
-        small2.center.y = self.center.y
-        small2.velocity.dx = self.velocity.dx - 1.5
-        small2.velocity.dy = self.velocity.dy - 1.5
+        small = self.store.spawn(SmallRock, asteroids)
+        if small is not None:
+            small.x = self.x
+            small.y = self.y
+            small.dx = self.dx + 1.5
+            small.dy = self.dy + 1.5
+
+        small2 = self.store.spawn(SmallRock, asteroids)
+        if small2 is not None:
+            small2.x = self.x
+            small2.y = self.y
+            small2.dx = self.dx - 1.5
+            small2.dy = self.dy - 1.5
 
-        asteroids.append(small)
-        asteroids.append(small2)
         self.alive = False
 
 class LargeRock(Asteroid):
@@ -179,15 +1037,34 @@ class LargeRock(Asteroid):
     Large Asteroid class, defines the properties of a Large sized asteroid
     *not fully built out, inherates from asteroid class
     """
-    def __init__(self):
-        super().__init__(":resources:images/space_shooter/meteorGrey_big1.png")
+    __slots__ = ()
+
+    kind = KIND_BIG_ROCK
+    img = BIG_ROCK_IMAGE
+
+    def __init__(self, store=None, rng=None):
+        super().__init__(store)
+        self.reset(rng)
+
+    def reset(self, rng=None):
+        """
+        Puts the large rock back into its spawn state at a random position
+        :param rng: random.Random to draw the position from, the random module by default
+        """
+        if rng is None:
+            rng = random
+        super().reset()
         self.radius = BIG_ROCK_RADIUS
-        self.center.x = random.randint(1, 50)
-        self.center.y = random.randint(1, 150)
-        self.direction = random.randint(1, 50)
-        self.speed = BIG_ROCK_SPEED
-        self.velocity.dx = math.cos(math.radians(self.direction)) * self.speed
-        self.velocity.dy = math.sin(math.radians(self.direction)) * self.speed
+        self.spin = BIG_ROCK_SPIN
+        self.x = rng.randint(1, 50)
+        self.y = rng.randint(1, 150)
+        direction = rng.randint(1, 50)
+        self.dx = math.cos(math.radians(direction)) * self.speed
+        self.dy = math.sin(math.radians(direction)) * self.speed
+
+    @property
+    def speed(self):
+        return BIG_ROCK_SPEED
 
     def advance(self):
         """
@@ -200,24 +1077,24 @@ class LargeRock(Asteroid):
         """
         Method which splits the asteroids apart depending on type when they are hit by bullet
         """
-        med1 = MediumRock()
-        med1.center.x = self.center.x
-        med1.center.y = self.center.y
-        med1.velocity.dy = self.velocity.dy + 2
-
-        med2 = MediumRock()
-        med2.center.x = self.center.x
-        med2.center.y = self.center.y
-        med2.velocity.dy = self.velocity.dy - 2
-
-        small = SmallRock()
-        small.center.x = self.center.x
-        small.center.y = self.center.y
-        small.velocity.dy = self.velocity.dy + 5
+        med1 = self.store.spawn(MediumRock, asteroids)
+        if med1 is not None:
+            med1.x = self.x
+            med1.y = self.y
+            med1.dy = self.dy + 2
+
+        med2 = self.store.spawn(MediumRock, asteroids)
+        if med2 is not None:
+            med2.x = self.x
+            med2.y = self.y
+            med2.dy = self.dy - 2
+
+        small = self.store.spawn(SmallRock, asteroids)
+        if small is not None:
+            small.x = self.x
+            small.y = self.y
+            small.dy = self.dy + 5
 
-        asteroids.append(med1)
-        asteroids.append(med2)
-        asteroids.append(small)
         self.alive = False
 
 class Bullet(FlyingObject):
@@ -225,14 +1102,37 @@ class Bullet(FlyingObject):
     Bullet class which inherits from the FlyingObject class
     *not fully built out 
     """
-    def __init__(self, ship_angle, ship_x, ship_y):
-        super().__init__(":resources:images/space_shooter/laserBlue01.png")
+    __slots__ = ()
+
+    kind = KIND_BULLET
+    img = BULLET_IMAGE
+
+    def __init__(self, ship_angle, ship_x, ship_y, store=None):
+        super().__init__(store)
+        self.reset(ship_angle, ship_x, ship_y)
+
+    def reset(self, ship_angle, ship_x, ship_y):
+        """
+        Puts the bullet back into its spawn state at the ship
+        """
+        super().reset()
         self.radius = BULLET_RADIUS
         self.life = BULLET_LIFE
-        self.speed = BULLET_SPEED
         self.angle = ship_angle + 90
-        self.center.x = ship_x
-        self.center.y = ship_y
+        self.x = ship_x
+        self.y = ship_y
+
+    @property
+    def speed(self):
+        return BULLET_SPEED
+
+    @property
+    def life(self):
+        return self.store.life.item(self.row)
+
+    @life.setter
+    def life(self, value):
+        self.store.life[self.row] = value
 
     def advance(self):
         """
@@ -247,18 +1147,30 @@ class Bullet(FlyingObject):
         """
         Sets the velocity and angle of the bullet when it is fired.
         """
-        self.velocity.dx -= math.sin(math.radians(self.angle - 90)) * BULLET_SPEED
-        self.velocity.dy += math.cos(math.radians(self.angle - 90)) * BULLET_SPEED
+        self.dx -= math.sin(math.radians(self.angle - 90)) * BULLET_SPEED
+        self.dy += math.cos(math.radians(self.angle - 90)) * BULLET_SPEED
 
 class Ship(FlyingObject):
     """
     Ship class, defines the player ship and needed methods
     """
-    def __init__(self):
-        super().__init__(":resources:images/space_shooter/playerShip1_orange.png")
+    __slots__ = ()
+
+    kind = KIND_SHIP
+    img = SHIP_IMAGE
+
+    def __init__(self, store=None):
+        super().__init__(store)
+        self.reset()
+
+    def reset(self):
+        """
+        Puts the ship back into its spawn state in the middle of the screen
+        """
+        super().reset()
         self.angle = 1
-        self.center.x  = (SCREEN_WIDTH/2)
-        self.center.y = (SCREEN_HEIGHT/2)
+        self.x  = (SCREEN_WIDTH/2)
+        self.y = (SCREEN_HEIGHT/2)
         self.radius = SHIP_RADIUS
     
     def left(self):
@@ -277,193 +1189,422 @@ class Ship(FlyingObject):
         """
         Method to move the ship forward
         """
-        self.velocity.dx -= math.sin(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
-        self.velocity.dy += math.cos(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
+        self.dx -= math.sin(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
+        self.dy += math.cos(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
 
     def neg_Thrust(self):
         """
         Method to move the ship backwards
         """
-        self.velocity.dx += math.sin(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
-        self.velocity.dy -= math.cos(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
+        self.dx += math.sin(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
+        self.dy -= math.cos(math.radians(self.angle)) * SHIP_THRUST_AMOUNT
 
     def brake(self):
-        self.velocity.dx = 0
-        self.velocity.dy = 0
+        self.dx = 0
+        self.dy = 0
         
 
-class Game(arcade.Window):
+class World():
     """
-    This class handles all the game callbacks and interaction
-    This class will then call the appropriate functions of
-    each of the above classes.
-    You are welcome to modify anything in this class.
+    The asteroids simulation: the ship, asteroids, bullets and score together with
+    the update, collision and control logic. It has no window or audio, so it can
+    run headless; Game draws it and feeds it input. Sounds are reported
+    as events (EVENT_HIT, EVENT_SHOOT) for whoever is listening.
     """
 
-    def __init__(self, width, height):
+    def __init__(self, seed=None, profiler=None):
         """
         Sets up the initial conditions of the game
-        :param width: Screen width
-        :param height: Screen height
+        :param seed: seed for the world's random numbers; the same seed and
+        inputs always play out the same game
+        :param profiler: FrameProfiler timing the update phases, none by default
         """
-        super().__init__(width, height)
-        arcade.set_background_color(arcade.color.SMOKY_BLACK)
-        self.background = arcade.load_texture(":resources:images/backgrounds/stars.png")
+        self.seed = seed
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+        self.rng = random.Random(seed)
         self.score = 0
-        self.held_keys = set()
+        self.ticks = 0
+
+        #bitmask of the CONTROL_* controls currently held down
+        self.controls = 0
+
+        #EVENT_* names since the last drain_events()
+        self.events = []
 
-        self.hit_sound = arcade.load_sound(":resources:sounds/explosion1.wav")
-        self.shoot_sound = arcade.load_sound(":resources:sounds/laser2.wav")
+        #every flying object in this world keeps its state in one entity store
+        self.store = EntityStore()
+        self.ship = Ship(self.store)
 
-        self.ship = Ship()
+        #recycle bullets and rock fragments instead of allocating new ones
+        self.store.pools[Bullet] = ObjectPool(Bullet, self.store, BULLET_POOL_CAPACITY)
+        self.store.pools[MediumRock] = ObjectPool(MediumRock, self.store, ROCK_POOL_CAPACITY)
+        self.store.pools[SmallRock] = ObjectPool(SmallRock, self.store, ROCK_POOL_CAPACITY)
 
         #create asteroid array and create initial asteroids
-        self.asteroids = []
+        self.asteroids = EntityList(self.store)
         for i in range(INITIAL_ROCK_COUNT):
-            bigAst = LargeRock()
+            bigAst = LargeRock(self.store, self.rng)
             self.asteroids.append(bigAst)
 
         #create bullets array
-        self.bullets = []
+        self.bullets = EntityList(self.store)
 
-    def draw_score(self):
+        #broadphase grid rebuilt on every collision check, the indices into
+        #asteroids of the rocks it found near a bullet or the ship, and how
+        #many asteroids there were then (any later ones are fresh fragments)
+        self.grid = SpatialHash()
+        self.nearby = np.zeros(0, dtype=np.intp)
+        self.nearby_count = 0
+        self.collision_backend = "grid"
+
+        #how many (bullets, asteroids) the last remove_notAliveObject pass reclaimed
+        self.reclaimed = (0, 0)
+
+    def step(self, controls, fire=False):
         """
-        Puts the current score on the screen as well as the current shot count
+        Applies one tick of input and advances the world by that tick
+        :param controls: bitmask of CONTROL_* held during the tick
+        :param fire: how many bullets were fired before the tick (True for one)
         """
-        score_text = "Score: {}".format(self.score)
-        start_x = 10
-        start_y = SCREEN_HEIGHT - 20
-        arcade.draw_text(score_text, start_x=start_x, start_y=start_y, font_size=12, color=arcade.color.WHITE)    
+        self.controls = controls
+        for shot in range(int(fire)):
+            self.fire()
+        self.update()
 
-    def on_draw(self):
+    def update(self):
         """
-        Called automatically by the arcade framework.
-        Handles the responsibility of drawing all elements.
+        Advances the world by one tick
         """
+        profiler = self.profiler
+        self.store.save_previous()
+        self.ticks += 1
+        with profiler.phase("check_keys"):
+            self.check_keys()
 
-        # clear the screen to begin drawing
-        arcade.start_render()
-        self.draw_score()
-        arcade.draw_lrwh_rectangle_textured(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT, self.background)
+        # advances every asteroid and bullet at once
+        with profiler.phase("advance"):
+            self.store.step()
 
-        for asteroid in self.asteroids:
-            asteroid.draw()
+        with profiler.phase("remove_notAliveObject"):
+            self.remove_notAliveObject()
+        with profiler.phase("check_collisions"):
+            self.check_collisions()
 
-        self.ship.draw()
+        with profiler.phase("ship_advance"):
+            self.ship.advance() 
 
-        for bullet in self.bullets:
-            bullet.draw()
+    def check_keys(self):
+        """
+        Applies the controls that are being held down to the ship
+        """
+        controls = self.controls
+        if controls & CONTROL_LEFT:
+            self.ship.left()
 
-        if not self.ship.alive:
-            arcade.draw_text("You hit an asteroid...Better luck next time!", 250, 300, font_size=15, color=arcade.color.WHITE) 
+        if controls & CONTROL_RIGHT:
+            self.ship.right()
+
+        if controls & CONTROL_THRUST:
+            self.ship.thrust()
+
+        if controls & CONTROL_REVERSE:
+            self.ship.neg_Thrust()
+
+        if controls & CONTROL_BRAKE:
+            self.ship.brake()
+
+    def fire(self):
+        """
+        Fires a bullet from the ship
+        Return: the bullet, or None when the bullet pool dropped it
+        """
+        bullet = self.store.spawn(Bullet, self.bullets, self.ship.angle, self.ship.x, self.ship.y)
+        if bullet is not None:
+            bullet.fire()
+            self.events.append(EVENT_SHOOT)
+        return bullet
 
-        if len(self.asteroids) == 0:
-            arcade.draw_text("You Win!", 300, 300, font_size=25, color=arcade.color.WHITE) 
+    def drain_events(self):
+        """
+        Returns the events reported since the last call and clears them
+        Return: list
+        """
+        events = self.events
+        self.events = []
+        return events
 
     def remove_notAliveObject(self):
         """
         Method to remove objects that are no longer alive
+        Return: tuple of (bullets reclaimed, asteroids reclaimed)
         """
-        for bullet in self.bullets:
-            if not bullet.alive:
-                self.bullets.remove(bullet)
+        self.reclaimed = (self.remove_dead(self.bullets), self.remove_dead(self.asteroids))
+        return self.reclaimed
 
-        for asteroid in self.asteroids:
-            if not asteroid.alive:
-                self.asteroids.remove(asteroid)
+    def remove_dead(self, objects):
+        """
+        Compacts an EntityList in place in a single pass and frees the entity
+        store rows of the dead objects
+        Return: number of objects removed
+        """
+        flags = self.store.alive[objects.rows()]
+        removed = len(objects) - int(np.count_nonzero(flags))
+        if removed:
+            for index in np.flatnonzero(~flags).tolist():
+                self.store.discard(objects[index])
+            objects.keep(flags)
+        return removed
     
+    def hit_asteroid(self, bullet, asteroid):
+        """
+        Breaks apart an asteroid that was hit by a bullet and scores it
+        """
+        asteroid.break_apart(self.asteroids)
+        bullet.alive = False
+        asteroid.alive = False
+        self.events.append(EVENT_HIT)
+        self.score += 1
+
+    def set_collision_backend(self, name):
+        """
+        Selects which implementation check_collisions runs, so they can be compared at runtime
+        :param name: one of COLLISION_BACKENDS
+        """
+        if name not in COLLISION_BACKENDS:
+            raise ValueError("unknown collision backend {!r}, expected one of {}".format(name, COLLISION_BACKENDS))
+        self.collision_backend = name
+
     def check_collisions(self):
         """
         Method to check for collisions with ship, bullets and asteroids
+        using the selected collision backend
+        """
+        if self.collision_backend == "grid":
+            self.check_collisions_grid()
+        elif self.collision_backend == "numpy":
+            self.check_collisions_numpy()
+        else:
+            self.check_collisions_scalar()
+
+    def check_collisions_grid(self):
+        """
+        Uses the spatial hash so each bullet is only tested against the
+        asteroids in the cells around it, then tests the ship against the
+        asteroids the grid found near it
+        """
+        self.resolve_hits(self.grid_overlaps)
+        self.nearby = np.concatenate((self.nearby, np.arange(self.nearby_count, len(self.asteroids))))
+        if self.ship.alive and self.ship_overlaps(self.ship, self.nearby):
+            self.ship.alive = False
+
+    def grid_overlaps(self):
+        """
+        Finds the bullet/asteroid overlaps through the spatial hash: the cells
+        next to every live bullet and collision_probes() point are flagged, the
+        live asteroids in them bucketed by cell from the store columns, and
+        each bullet tested against the asteroids in its own 3x3 block only.
+        The flagged asteroids are kept in self.nearby for the ship checks. A
+        field of fewer than GRID_MIN_ROCKS asteroids skips the grid.
+        Return: (first, overlaps) as from first_overlaps
+        """
+        store = self.store
+        rock_rows = self.asteroids.rows()
+        bullet_rows = self.bullets.rows()
+        self.nearby_count = len(rock_rows)
+        if len(rock_rows) < GRID_MIN_ROCKS:
+            self.nearby = np.arange(len(rock_rows))
+            return self.numpy_overlaps()
+
+        grid = self.grid
+        grid.clear()
+        live = np.flatnonzero(store.alive[bullet_rows])
+        live_rows = bullet_rows[live]
+        bullet_x = store.x[live_rows]
+        bullet_y = store.y[live_rows]
+        probes = self.collision_probes()
+        grid.mark(np.concatenate((bullet_x, [x for x, y in probes])),
+                  np.concatenate((bullet_y, [y for x, y in probes])))
+        self.nearby = np.flatnonzero(grid.near(store.x[rock_rows], store.y[rock_rows]))
+
+        candidates = self.nearby[store.alive[rock_rows[self.nearby]]]
+        candidate_rows = rock_rows[candidates]
+        grid.bucket(candidates, store.x[candidate_rows], store.y[candidate_rows])
+        probe, index = grid.pairs(bullet_x, bullet_y)
+        rows = rock_rows[index]
+        probe_rows = live_rows[probe]
+        max_dist = store.radius[rows] + store.radius[probe_rows]
+        overlap = (np.abs(store.x[rows] - store.x[probe_rows]) < max_dist) & \
+                  (np.abs(store.y[rows] - store.y[probe_rows]) < max_dist)
+        return first_overlaps(len(bullet_rows), live[probe[overlap]], index[overlap])
+
+    def collision_probes(self):
+        """
+        Returns the points besides the bullets whose nearby asteroids
+        grid_overlaps gathers into self.nearby: the ship, while it is alive
+        Return: list of (x, y)
+        """
+        ship = self.ship
+        return [(ship.x, ship.y)] if ship.alive else []
+
+    def check_collisions_numpy(self):
+        """
+        Computes every bullet/asteroid overlap in one broadcast over the entity
+        store columns and resolves them with resolve_hits, then tests the ship
+        against every asteroid
+        """
+        self.resolve_hits(self.numpy_overlaps)
+        if self.ship.alive and self.ship_overlaps(self.ship, np.arange(len(self.asteroids))):
+            self.ship.alive = False
+
+    def numpy_overlaps(self):
+        """
+        Finds the overlaps of every live bullet with every live asteroid in one broadcast
+        Return: (first, overlaps) as from first_overlaps
+        """
+        store = self.store
+        rock_rows = self.asteroids.rows()
+        bullet_rows = self.bullets.rows()
+        hits = overlap_matrix(store.x[bullet_rows], store.y[bullet_rows], store.radius[bullet_rows],
+                              store.x[rock_rows], store.y[rock_rows], store.radius[rock_rows])
+        hits &= store.alive[bullet_rows][:, None]
+        hits &= store.alive[rock_rows]
+        return first_overlaps(len(bullet_rows), *np.nonzero(hits))
+
+    def resolve_hits(self, find):
+        """
+        Walks the bullets in order so each one hits the first overlapping
+        asteroid still alive, the same as check_collisions_scalar, using the
+        overlaps find computed in bulk. Only a bullet whose first overlap was
+        already hit this tick looks further, and fragments from break_apart are
+        tested against the remaining bullets as they appear. A fragment pool
+        with the "recycle" policy moves a live asteroid instead, so after such a
+        hit the overlaps are found again for the remaining bullets.
+        :param find: method returning (first, overlaps) as from first_overlaps
+        """
+        store = self.store
+        bullets = self.bullets
+        asteroids = self.asteroids
+        pools = store.pools.values()
+        first, overlaps = find()
+        first = first.tolist()
+        rows = asteroids.rows()
+        #indices of the fragments each later bullet overlaps, in list order
+        fragments = {}
+        for index in range(len(first)):
+            hit = first[index]
+            if hit >= 0 and not store.alive[rows[hit]]:
+                hit = next((i for i in overlaps(index).tolist() if store.alive[rows[i]]), -1)
+            if hit < 0 and index in fragments:
+                hit = next((i for i in fragments.pop(index) if store.alive[rows[i]]), -1)
+            if hit < 0:
+                continue
+
+            count = len(asteroids)
+            recycled = sum(pool.recycled for pool in pools)
+            self.hit_asteroid(bullets[index], asteroids[hit])
+            if sum(pool.recycled for pool in pools) != recycled:
+                first, overlaps = find()
+                first = first.tolist()
+                rows = asteroids.rows()
+                fragments = {}
+            elif len(asteroids) > count:
+                rows = asteroids.rows()
+                later_rows = bullets.rows()[index + 1:]
+                fragment_rows = rows[count:]
+                block = overlap_matrix(store.x[later_rows], store.y[later_rows], store.radius[later_rows],
+                                       store.x[fragment_rows], store.y[fragment_rows], store.radius[fragment_rows])
+                block &= store.alive[later_rows][:, None]
+                later, fragment = np.nonzero(block)
+                for bullet, fragment in zip((later + index + 1).tolist(), (fragment + count).tolist()):
+                    fragments.setdefault(bullet, []).append(fragment)
+
+    def ship_overlaps(self, ship, candidates):
+        """
+        Returns whether ship overlaps a live asteroid among the candidate indices into self.asteroids
+        """
+        store = self.store
+        rows = self.asteroids.rows()[candidates]
+        hits = overlap_matrix(np.array([ship.x]), np.array([ship.y]), np.array([ship.radius]),
+                              store.x[rows], store.y[rows], store.radius[rows])
+        return bool((hits[0] & store.alive[rows]).any())
+
+    def check_collisions_scalar(self):
+        """
+        Reference version of check_collisions that tests every bullet against every asteroid
         """
         for bullet in self.bullets:
             for asteroid in self.asteroids:
                 if bullet.alive and asteroid.alive:
-                    distance_x = abs(asteroid.center.x - bullet.center.x)
-                    distance_y = abs(asteroid.center.y - bullet.center.y)
+                    distance_x = abs(asteroid.x - bullet.x)
+                    distance_y = abs(asteroid.y - bullet.y)
                     max_dist = asteroid.radius + bullet.radius
                     if distance_x < max_dist and distance_y < max_dist:
-                        asteroid.break_apart(self.asteroids)
-                        bullet.alive = False
-                        asteroid.alive = False
-                        arcade.play_sound(self.hit_sound)
-                        self.score += 1
+                        self.hit_asteroid(bullet, asteroid)
 
         for asteroid in self.asteroids:
             if self.ship.alive and asteroid.alive:
-                distance_x = abs(asteroid.center.x - self.ship.center.x)
-                distance_y = abs(asteroid.center.y - self.ship.center.y)
+                distance_x = abs(asteroid.x - self.ship.x)
+                distance_y = abs(asteroid.y - self.ship.y)
                 max_dist = asteroid.radius + self.ship.radius
                 if distance_x < max_dist and distance_y < max_dist:
                     self.ship.alive = False
 
+class FixedStepClock():
+    """
+    Turns variable frame times into a whole number of fixed-length simulation
+    ticks. The time left over is kept for the next frame and, as alpha, tells
+    the renderer how far to interpolate between the last two ticks.
+    """
+    def __init__(self, tick_time=TICK_TIME, max_ticks=MAX_CATCH_UP_TICKS):
+        self.tick_time = tick_time
+        self.max_ticks = max_ticks
+        self.accumulator = 0.0
 
-    def update(self, delta_time):
+    def advance(self, delta_time):
         """
-        Update each object in the game.
-        :param delta_time: tells us how much time has actually elapsed
+        Adds a frame's elapsed time
+        Return: number of ticks to simulate this frame
         """
-        self.check_keys()
-
-        for asteroid in self.asteroids:
-            asteroid.advance()
-
-        for bullet in self.bullets:
-            bullet.advance()
-
-        self.remove_notAliveObject()
-        self.check_collisions()
-
-        self.ship.advance() 
-
-    def check_keys(self):
+        self.accumulator += delta_time
+        ticks = int(self.accumulator / self.tick_time)
+        if ticks > self.max_ticks:
+            ticks = self.max_ticks
+            self.accumulator = 0.0
+        else:
+            self.accumulator -= ticks * self.tick_time
+        return ticks
+
+    @property
+    def alpha(self):
         """
-        This function checks for keys that are being held down.
-        You will need to put your own method calls in here.
-        **expanded to include WASD
+        Fraction of a tick elapsed since the last simulated one
         """
-        if arcade.key.LEFT in self.held_keys or arcade.key.A in self.held_keys:
-            self.ship.left()
+        return min(self.accumulator / self.tick_time, 1.0)
 
-        if arcade.key.RIGHT in self.held_keys or arcade.key.D in self.held_keys:
-            self.ship.right()
 
-        if arcade.key.UP in self.held_keys or arcade.key.W in self.held_keys:
-            self.ship.thrust()
+# names that live in game_window.py but are still reachable from here
+WINDOW_NAMES = ("Game", "SpriteRenderer", "HudText", "StaticLayer", "Compositor", "KEY_CONTROLS", "controls_for")
 
-        if arcade.key.DOWN in self.held_keys or arcade.key.S in self.held_keys:
-            self.ship.neg_Thrust()
-
-        if arcade.key.LSHIFT in self.held_keys:
-            self.ship.brake()
-
-        # Machine gun mode...
-        #if arcade.key.SPACE in self.held_keys:
-        #    pass
-
-
-    def on_key_press(self, key: int, modifiers: int):
-        """
-        Puts the current key in the set of keys that are being held.
-        You will need to add things here to handle firing the bullet.
-        """
-        if self.ship.alive:
-            self.held_keys.add(key)
-
-            if key == arcade.key.SPACE:
-                bullet = Bullet(self.ship.angle, self.ship.center.x, self.ship.center.y)
-                self.bullets.append(bullet)
-                bullet.fire()
-                arcade.play_sound(self.shoot_sound)
+def __getattr__(name):
+    """
+    Imports the window code (and arcade with it) the first time one of its names is used
+    """
+    if name in WINDOW_NAMES:
+        import game_window
+        return getattr(game_window, name)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
-    def on_key_release(self, key: int, modifiers: int):
-        """
-        Removes the current key from the set of held keys.
-        """
-        if key in self.held_keys:
-            self.held_keys.remove(key)
+def main(argv=None):
+    """
+    Creates the game and starts it going. arcade is only imported here, once
+    a window is actually wanted.
+    """
+    startup = StartupTimer(IMPORT_STARTED)
+    startup.mark("import_core")
+    with startup.stage("import_window"):
+        import game_window
+    game_window.main(argv, startup)
 
 
-# Creates the game and starts it going
-window = Game(SCREEN_WIDTH, SCREEN_HEIGHT)
-arcade.run()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+File: atlas.py
+Packs the image of every FlyingObject class into one sprite atlas.
+
+The atlas is a single RGBA image with every sprite on a shelf of its own
+height band, a transparent border around each, and a lookup table giving the
+pixel rectangle and the UV coordinates of every sprite. Packing means
+decoding every PNG, so the result is cached on disk under a hash of the
+source images: the cache file is the lookup table followed by the raw
+pixels, and later launches memory-map it instead of decoding and packing
+again. The sprites' textures are cut from the one image, so every entity
+shares the same pixels.
+
+    python atlas.py                   # time packing against mapping the cache
+"""
+import argparse
+import hashlib
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+import arcade
+
+from PIL import Image
+
+from asteroidsFinal import FlyingObject
+
+MAGIC = b"ASTA"
+ATLAS_VERSION = 1
+
+# magic, version, sprite count, content key, width, height
+HEADER = struct.Struct("<4sHH32sII")
+
+# x, y, width, height and the length of the resource path that follows
+REGION = struct.Struct("<HHHHH")
+
+# pixels are stored from this boundary on, so the mapped image starts aligned
+PIXEL_ALIGNMENT = 16
+
+# transparent pixels kept around every sprite, so filtering never reads a neighbour
+ATLAS_PADDING = 1
+
+# file name of the cached atlas, by the start of its content key
+CACHE_NAME = "sprites-{}.atlas"
+
+
+def sprite_images(cls=FlyingObject):
+    """
+    Returns the image of every subclass of cls that has one, in class order
+    Return: list of resource paths
+    """
+    images = []
+    for subclass in cls.__subclasses__():
+        for img in [subclass.img] + sprite_images(subclass):
+            if img is not None and img not in images:
+                images.append(img)
+    return images
+
+
+def default_cache_dir():
+    """
+    Returns the directory atlases are cached in: asteroids/ under the user's cache directory
+    """
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "asteroids")
+
+
+def content_key(paths):
+    """
+    Hashes the atlas format and the name and bytes of every source image, so
+    any change to a sprite, or to how they are packed, gives a new key
+    Return: 32 byte digest
+    """
+    digest = hashlib.sha256(struct.pack("<HH", ATLAS_VERSION, ATLAS_PADDING))
+    for path in paths:
+        with open(arcade.resources.resolve_resource_path(path), "rb") as source:
+            data = source.read()
+        name = path.encode("utf-8")
+        digest.update(struct.pack("<HI", len(name), len(data)))
+        digest.update(name)
+        digest.update(data)
+    return digest.digest()
+
+
+def next_power_of_two(value):
+    return 1 << max(0, math.ceil(math.log2(max(1, value))))
+
+
+def pack(sizes, padding=ATLAS_PADDING):
+    """
+    Shelf-packs rectangles: tallest first, left to right along a shelf as wide
+    as a square of their total area, a new shelf when one is full
+    :param sizes: list of (width, height)
+    Return: tuple of (atlas width, atlas height, list of (x, y) for each size)
+    """
+    area = sum((width + 2 * padding) * (height + 2 * padding) for width, height in sizes)
+    widest = max((width + 2 * padding for width, height in sizes), default=1)
+    atlas_width = next_power_of_two(max(widest, math.sqrt(area)))
+    places = [None] * len(sizes)
+    x = y = shelf = 0
+    for index in sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0])):
+        width, height = sizes[index]
+        if x + width + 2 * padding > atlas_width:
+            y += shelf
+            x = shelf = 0
+        places[index] = (x + padding, y + padding)
+        x += width + 2 * padding
+        shelf = max(shelf, height + 2 * padding)
+    return atlas_width, next_power_of_two(y + shelf), places
+
+
+class SpriteAtlas():
+    """
+    One image holding several sprites, with the pixel rectangle and the UV
+    coordinates of each. UVs run left to right and bottom to top, as GL
+    samples them.
+    """
+    def __init__(self, image, regions, key, mapping=None):
+        """
+        :param regions: dict of resource path -> (x, y, width, height) in image pixels, top down
+        :param key: content key of the images it was packed from
+        :param mapping: mmap the image's pixels live in, if it was loaded from the cache
+        """
+        self.image = image
+        self.regions = regions
+        self.key = key
+        self.mapping = mapping
+        width, height = image.size
+        self.uvs = {}
+        for path, (x, y, w, h) in regions.items():
+            self.uvs[path] = (x / width, (height - y - h) / height, (x + w) / width, (height - y) / height)
+
+    def crop(self, path):
+        """
+        Returns a copy of the pixels of the sprite for path
+        Return: PIL image
+        """
+        x, y, width, height = self.regions[path]
+        return self.image.crop((x, y, x + width, y + height))
+
+    def texture(self, path):
+        """
+        Makes the arcade texture of the sprite for path from the atlas pixels
+        Return: arcade.Texture
+        """
+        return arcade.Texture("atlas:" + path, self.crop(path))
+
+    def fill(self):
+        """
+        Returns the share of the atlas covered by sprites
+        """
+        width, height = self.image.size
+        return sum(w * h for x, y, w, h in self.regions.values()) / (width * height)
+
+    def close(self):
+        """
+        Releases the mapped cache file, if any. The atlas can not be used afterwards.
+        """
+        self.image = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+
+def build_atlas(paths, key=None):
+    """
+    Decodes every image in paths and packs them into a new atlas
+    Return: SpriteAtlas
+    """
+    images = []
+    for path in paths:
+        with Image.open(arcade.resources.resolve_resource_path(path)) as source:
+            images.append(source.convert("RGBA"))
+    width, height, places = pack([image.size for image in images])
+    sheet = Image.new("RGBA", (width, height))
+    regions = {}
+    for path, image, (x, y) in zip(paths, images, places):
+        sheet.paste(image, (x, y))
+        regions[path] = (x, y) + image.size
+    return SpriteAtlas(sheet, regions, key if key is not None else content_key(paths))
+
+
+def save_atlas(atlas, filename):
+    """
+    Writes atlas to filename: the header and lookup table, then the raw pixels.
+    The file is written next to filename and renamed over it, so a reader never
+    maps half of one.
+    """
+    width, height = atlas.image.size
+    parts = [HEADER.pack(MAGIC, ATLAS_VERSION, len(atlas.regions), atlas.key, width, height)]
+    for path, (x, y, w, h) in atlas.regions.items():
+        name = path.encode("utf-8")
+        parts.append(REGION.pack(x, y, w, h, len(name)))
+        parts.append(name)
+    size = sum(len(part) for part in parts)
+    parts.append(bytes(-size % PIXEL_ALIGNMENT))
+    parts.append(atlas.image.tobytes())
+    directory = os.path.dirname(filename)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    partial = "{}.{}.tmp".format(filename, os.getpid())
+    with open(partial, "wb") as output:
+        output.write(b"".join(parts))
+    os.replace(partial, filename)
+
+
+def map_atlas(filename, key=None):
+    """
+    Memory-maps an atlas written by save_atlas(); its pixels are read from
+    the page cache rather than copied
+    :param key: content key the atlas must have been packed from, if any
+    Return: SpriteAtlas, or None when the file is missing, stale or not an atlas
+    """
+    try:
+        with open(filename, "rb") as source:
+            mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        magic, version, count, saved_key, width, height = HEADER.unpack_from(mapping)
+        if magic != MAGIC or version != ATLAS_VERSION or (key is not None and saved_key != key):
+            raise ValueError("stale atlas")
+        offset = HEADER.size
+        regions = {}
+        for index in range(count):
+            x, y, w, h, length = REGION.unpack_from(mapping, offset)
+            offset += REGION.size
+            regions[mapping[offset:offset + length].decode("utf-8")] = (x, y, w, h)
+            offset += length
+        offset += -offset % PIXEL_ALIGNMENT
+        if len(mapping) != offset + width * height * 4:
+            raise ValueError("truncated atlas")
+        image = Image.frombuffer("RGBA", (width, height), memoryview(mapping)[offset:], "raw", "RGBA", 0, 1)
+    except (struct.error, ValueError, UnicodeDecodeError):
+        mapping.close()
+        return None
+    return SpriteAtlas(image, regions, saved_key, mapping)
+
+
+def load_atlas(paths=None, cache_dir=None):
+    """
+    Returns the atlas of paths, mapped from the cache when it holds one packed
+    from the same images, otherwise packed now and cached for the next launch.
+    A cache that can not be written only costs the next launch a repack.
+    :param paths: resource paths to pack, every FlyingObject image by default
+    :param cache_dir: directory of the cache files, default_cache_dir() by default
+    Return: SpriteAtlas
+    """
+    paths = sprite_images() if paths is None else list(paths)
+    key = content_key(paths)
+    filename = os.path.join(cache_dir or default_cache_dir(), CACHE_NAME.format(key.hex()[:16]))
+    atlas = map_atlas(filename, key)
+    if atlas is not None and set(atlas.regions) == set(paths):
+        return atlas
+    atlas = build_atlas(paths, key)
+    try:
+        save_atlas(atlas, filename)
+    except OSError as error:
+        print("could not cache the sprite atlas: {}".format(error), file=sys.stderr)
+    return atlas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack the asteroids sprites into an atlas and time the cache")
+    parser.add_argument("--cache-dir", default=None, help="where the atlas is cached (default: {})".format(
+        default_cache_dir()))
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    paths = sprite_images()
+    filename = os.path.join(args.cache_dir or default_cache_dir(), CACHE_NAME.format(content_key(paths).hex()[:16]))
+    timings = {}
+    for name, function in (("hash", lambda: content_key(paths)), ("pack", lambda: build_atlas(paths)),
+                           ("load", lambda: load_atlas(paths, args.cache_dir)),
+                           ("map", lambda: map_atlas(filename))):
+        best = None
+        for repeat in range(args.repeats):
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+            if isinstance(result, SpriteAtlas):
+                atlas = result
+        timings[name] = best
+        if name == "pack":
+            packed = atlas
+
+    width, height = atlas.image.size
+    assert atlas.image.tobytes() == packed.image.tobytes(), "mapped atlas differs from a fresh pack"
+    print("{} sprites in {}x{} ({:.0%} filled), cached as {}".format(
+        len(atlas.regions), width, height, atlas.fill(), filename), file=sys.stderr)
+    for path, (u0, v0, u1, v1) in atlas.uvs.items():
+        print("  {:48} uv ({:.4f}, {:.4f}) - ({:.4f}, {:.4f})".format(path, u0, v0, u1, v1), file=sys.stderr)
+    print("hash {:.2f} ms, decode and pack {:.2f} ms, load from cache {:.2f} ms (map alone {:.3f} ms)".format(
+        timings["hash"] * 1000, timings["pack"] * 1000, timings["load"] * 1000, timings["map"] * 1000),
+        file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+File: audio.py
+Sound mixing for the asteroids game.
+
+The game asks the Mixer for a sound by name whenever something happens
+(a shot, a hit). The mixer merges requests for the same sound made within
+one tick into a single, louder play, keeps at most a few voices per sound
+and reuses their players instead of starting a new one every time.
+"""
+import math
+
+from collections import deque
+
+MAX_VOICES_PER_SOUND = 4
+
+# volume of one trigger; merged triggers get louder up to MAX_SOUND_VOLUME
+SOUND_VOLUME = 0.6
+MAX_SOUND_VOLUME = 1.0
+
+
+class NullAudioBackend():
+    """
+    Backend that plays nothing, for headless runs. It only counts plays.
+    """
+    def __init__(self):
+        self.plays = 0
+
+    def load(self, path):
+        return path
+
+    def play(self, sound, volume):
+        self.plays += 1
+        return None
+
+    def is_playing(self, sound, player):
+        return False
+
+    def restart(self, sound, player, volume):
+        self.plays += 1
+
+
+class ArcadeAudioBackend():
+    """
+    Backend playing sounds through arcade (pyglet media players)
+    """
+    def load(self, path):
+        import arcade
+        return arcade.load_sound(path)
+
+    def play(self, sound, volume):
+        """
+        Starts a new player for sound
+        Return: the pyglet player
+        """
+        return sound.play(volume=volume)
+
+    def is_playing(self, sound, player):
+        return sound.is_playing(player)
+
+    def restart(self, sound, player, volume):
+        """
+        Plays sound again on an existing player, from the start
+        """
+        player.volume = volume
+        if player.playing:
+            player.seek(0.0)
+        else:
+            player.queue(sound.source)
+            player.play()
+
+
+class Mixer():
+    """
+    Plays named sounds through a backend with per-sound voice limits
+    """
+    def __init__(self, backend, max_voices=MAX_VOICES_PER_SOUND):
+        self.backend = backend
+        self.max_voices = max_voices
+        self.sounds = {}
+        self.voices = {}
+        self.pending = {}
+        self.plays = 0
+        self.merged = 0
+        self.stolen = 0
+
+    def load(self, name, path):
+        """
+        Loads the sound at path under name. May run on another thread while
+        the game plays; the sound is only usable once it is fully loaded.
+        """
+        sound = self.backend.load(path)
+        self.voices[name] = deque()
+        self.sounds[name] = sound
+
+    def trigger(self, name):
+        """
+        Asks for a sound to be played at the next flush()
+        """
+        self.pending[name] = self.pending.get(name, 0) + 1
+
+    def flush(self):
+        """
+        Plays every sound triggered since the last flush, once per sound, louder
+        the more times it was triggered. Sounds not loaded yet are dropped.
+        Call once per tick.
+        """
+        if not self.pending:
+            return
+        for name, count in self.pending.items():
+            if name not in self.sounds:
+                continue
+            volume = min(MAX_SOUND_VOLUME, SOUND_VOLUME * math.sqrt(count))
+            self.merged += count - 1
+            self.play(name, volume)
+        self.pending.clear()
+
+    def play(self, name, volume=SOUND_VOLUME):
+        """
+        Plays a sound now, reusing an idle voice if there is one and otherwise
+        starting a new voice or, at the limit, restarting the oldest one
+        """
+        sound = self.sounds[name]
+        voices = self.voices[name]
+        backend = self.backend
+        self.plays += 1
+        for player in voices:
+            if not backend.is_playing(sound, player):
+                backend.restart(sound, player, volume)
+                return
+        if len(voices) < self.max_voices:
+            player = backend.play(sound, volume)
+            if player is not None:
+                voices.append(player)
+            return
+        player = voices.popleft()
+        backend.restart(sound, player, volume)
+        voices.append(player)
+        self.stolen += 1
+
+    def stats(self):
+        """
+        Returns the mixer counters
+        Return: dict
+        """
+        return {"plays": self.plays, "merged": self.merged, "stolen": self.stolen,
+                "voices": {name: len(voices) for name, voices in list(self.voices.items())}}
@@ -0,0 +1,268 @@
+"""
+File: batch.py
+Runs many seeded headless asteroids games in parallel, for balance testing.
+
+Each game is an asteroidsFinal.World driven by a bot policy for up to a
+number of ticks. Games are handed out in chunks to a ProcessPoolExecutor and
+every chunk comes back as packed RESULT records, which are printed as JSON
+lines as they arrive. Module constants such as BIG_ROCK_SPEED or BULLET_LIFE
+can be overridden, and a sweep runs every combination of the given values:
+
+    python batch.py --games 200 --policy aim --set BIG_ROCK_SPEED=1.5,2,3 --set BULLET_LIFE=40,60
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import struct
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import as_completed
+
+import asteroidsFinal
+
+# game index, seed, score, ticks survived, rocks destroyed, shots fired, outcome
+RESULT = struct.Struct("<IqIIIIB")
+
+OUTCOMES = ("timeout", "lost", "won")
+
+DEFAULT_TICKS = 3600
+DEFAULT_CHUNK = 8
+
+# bot policies fire at most once every this many ticks
+FIRE_COOLDOWN = 10
+
+
+def idle_policy(world, rng):
+    """
+    Never touches the controls
+    Return: (controls, fire)
+    """
+    return 0, False
+
+
+def random_policy(world, rng):
+    """
+    Mashes random controls and fires now and then
+    Return: (controls, fire)
+    """
+    controls = rng.choice((0, asteroidsFinal.CONTROL_LEFT, asteroidsFinal.CONTROL_RIGHT, asteroidsFinal.CONTROL_THRUST))
+    return controls, rng.random() < 1 / FIRE_COOLDOWN
+
+
+def spin_policy(world, rng):
+    """
+    Turns left on the spot and fires on a fixed beat
+    Return: (controls, fire)
+    """
+    return asteroidsFinal.CONTROL_LEFT, world.ticks % FIRE_COOLDOWN == 0
+
+
+def aim_policy(world, rng):
+    """
+    Turns towards the nearest rock (across the screen edges too) and fires
+    once it is roughly lined up
+    Return: (controls, fire)
+    """
+    ship = world.ship
+    x = ship.center.x
+    y = ship.center.y
+    nearest = None
+    for asteroid in world.asteroids:
+        dx = (asteroid.center.x - x + asteroidsFinal.SCREEN_WIDTH / 2) % asteroidsFinal.SCREEN_WIDTH - asteroidsFinal.SCREEN_WIDTH / 2
+        dy = (asteroid.center.y - y + asteroidsFinal.SCREEN_HEIGHT / 2) % asteroidsFinal.SCREEN_HEIGHT - asteroidsFinal.SCREEN_HEIGHT / 2
+        distance = dx * dx + dy * dy
+        if nearest is None or distance < nearest[0]:
+            nearest = (distance, dx, dy)
+    if nearest is None:
+        return 0, False
+
+    # the ship points 90 degrees round from its angle, see Bullet.reset
+    wanted = math.degrees(math.atan2(nearest[2], nearest[1])) - 90
+    turn = (wanted - ship.angle + 180) % 360 - 180
+    controls = 0
+    if turn > asteroidsFinal.SHIP_TURN_AMOUNT / 2:
+        controls = asteroidsFinal.CONTROL_LEFT
+    elif turn < -asteroidsFinal.SHIP_TURN_AMOUNT / 2:
+        controls = asteroidsFinal.CONTROL_RIGHT
+    return controls, abs(turn) < 10 and world.ticks % FIRE_COOLDOWN == 0
+
+
+POLICIES = {
+    "idle": idle_policy,
+    "random": random_policy,
+    "spin": spin_policy,
+    "aim": aim_policy,
+}
+
+
+def parse_override(text):
+    """
+    Parses NAME=value[,value...] into a name and a list of numbers
+    Return: (name, list)
+    """
+    name, sep, values = text.partition("=")
+    if not sep or not values:
+        raise ValueError("expected NAME=value[,value...], got {!r}".format(text))
+    check_constant(name)
+    return name, [json.loads(value) for value in values.split(",")]
+
+
+def check_constant(name):
+    """
+    Raises ValueError unless name is a numeric constant of asteroidsFinal
+    """
+    value = getattr(asteroidsFinal, name, None)
+    if not name.isupper() or isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError("{!r} is not a numeric asteroidsFinal constant".format(name))
+
+
+def configurations(overrides):
+    """
+    Expands {name: [values]} into one dict per combination of values
+    Return: list of dicts
+    """
+    names = sorted(overrides)
+    return [dict(zip(names, values)) for values in itertools.product(*(overrides[name] for name in names))]
+
+
+def play(seed, policy, max_ticks):
+    """
+    Plays one game in this process until the ship dies, every rock is gone
+    or max_ticks ticks have passed
+    Return: (score, ticks survived, rocks destroyed, shots fired, outcome index)
+    """
+    world = asteroidsFinal.World(seed)
+    rng = random.Random(seed)
+    decide = POLICIES[policy]
+    rocks_destroyed = 0
+    shots = 0
+    outcome = 0
+    while world.ticks < max_ticks:
+        controls, fire = decide(world, rng)
+        world.step(controls, fire)
+        for event in world.drain_events():
+            if event == asteroidsFinal.EVENT_HIT:
+                rocks_destroyed += 1
+            elif event == asteroidsFinal.EVENT_SHOOT:
+                shots += 1
+        if not world.ship.alive:
+            outcome = 1
+            break
+        if not world.asteroids:
+            outcome = 2
+            break
+    return world.score, world.ticks, rocks_destroyed, shots, outcome
+
+
+def run_chunk(games, policy, max_ticks, overrides):
+    """
+    Worker entry point: plays each (index, seed) game with the constants
+    overridden for the duration of the chunk
+    Return: bytes, one RESULT record per game
+    """
+    saved = {name: getattr(asteroidsFinal, name) for name in overrides}
+    try:
+        for name, value in overrides.items():
+            setattr(asteroidsFinal, name, value)
+        output = bytearray()
+        for index, seed in games:
+            output += RESULT.pack(index, seed, *play(seed, policy, max_ticks))
+        return bytes(output)
+    finally:
+        for name, value in saved.items():
+            setattr(asteroidsFinal, name, value)
+
+
+def decode(blob):
+    """
+    Unpacks the RESULT records of a chunk
+    Return: list of dicts
+    """
+    return [{"game": index, "seed": seed, "score": score, "ticks": ticks, "rocks_destroyed": rocks,
+             "shots": shots, "outcome": OUTCOMES[outcome]}
+            for index, seed, score, ticks, rocks, shots, outcome in RESULT.iter_unpack(blob)]
+
+
+def run_batch(games, policy="aim", configs=({},), max_ticks=DEFAULT_TICKS, seed=0, workers=None,
+              chunk=DEFAULT_CHUNK):
+    """
+    Plays games seeded games for every configuration across worker processes
+    and yields each result as soon as its chunk comes back. Game i of every
+    configuration uses seed + i, so configurations are compared on the same fields.
+    :param configs: list of {constant name: value} overrides
+    Return: generator of result dicts, with the configuration under "config"
+    """
+    if policy not in POLICIES:
+        raise ValueError("unknown policy {!r}, expected one of {}".format(policy, tuple(POLICIES)))
+    for config in configs:
+        for name in config:
+            check_constant(name)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {}
+        for number, config in enumerate(configs):
+            for start in range(0, games, chunk):
+                batch = [(number * games + i, seed + i) for i in range(start, min(start + chunk, games))]
+                futures[executor.submit(run_chunk, batch, policy, max_ticks, config)] = config
+        for future in as_completed(futures):
+            for result in decode(future.result()):
+                result["config"] = futures[future]
+                yield result
+
+
+def summarise(results):
+    """
+    Averages the results of each configuration
+    Return: list of dicts, one per configuration
+    """
+    groups = {}
+    for result in results:
+        groups.setdefault(json.dumps(result["config"], sort_keys=True), []).append(result)
+    summary = []
+    for key, group in groups.items():
+        count = len(group)
+        summary.append({
+            "config": json.loads(key),
+            "games": count,
+            "mean_score": sum(result["score"] for result in group) / count,
+            "mean_ticks": sum(result["ticks"] for result in group) / count,
+            "mean_rocks_destroyed": sum(result["rocks_destroyed"] for result in group) / count,
+            "won": sum(result["outcome"] == "won" for result in group) / count,
+            "lost": sum(result["outcome"] == "lost" for result in group) / count,
+        })
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Play seeded headless asteroids games in parallel")
+    parser.add_argument("--games", type=int, default=100, help="games per configuration")
+    parser.add_argument("--policy", default="aim", choices=list(POLICIES))
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS, help="longest a game may run")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="games handed to a worker at a time")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUES",
+                        help="override a constant, e.g. BULLET_LIFE=40,60 (repeat to sweep several)")
+    args = parser.parse_args(argv)
+
+    try:
+        overrides = dict(parse_override(text) for text in args.set)
+    except ValueError as error:
+        parser.error(str(error))
+
+    results = []
+    for result in run_batch(args.games, args.policy, configurations(overrides), args.ticks, args.seed,
+                            args.workers, args.chunk):
+        results.append(result)
+        print(json.dumps(result))
+    for row in summarise(results):
+        print("{config} games {games}  score {mean_score:.1f}  ticks {mean_ticks:.0f}  "
+              "won {won:.0%}  lost {lost:.0%}".format(**row), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,462 @@
+"""
+File: benchmark.py
+Headless simulation benchmarks for asteroids01.py, asteroids02.py,
+asteroids03.py and asteroidsFinal.py.
+
+Each scenario sets up a field, then runs ticks through the version's
+advance, check_collisions and remove_notAliveObject logic (whatever that
+version has) and reports ticks/sec, p50/p99 tick latency and allocations
+per tick (traced on every ALLOC_SAMPLE_TICKS-th tick, which is left out of
+the timings) as JSON, so runs can be diffed between commits and backends.
+--memory also measures the memory each version takes per rock.
+
+    python benchmark.py --scenarios idle sustained_fire --output bench.json
+    python benchmark.py --scenarios --memory 50000
+    python benchmark.py --versions asteroidsFinal --scenarios rocks_10k --budget-ms 16.7
+    python benchmark.py --scenarios split_cascade sustained_fire --ticks 200 --seed 0 --check-backends
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+import types
+
+import asteroidsFinal
+
+VERSIONS = ("asteroids01", "asteroids02", "asteroids03", "asteroidsFinal")
+
+ROCK_SIZES = ("large", "medium", "small")
+
+# one frame at 60 FPS, the budget --budget-ms checks ticks against by default
+FRAME_BUDGET_MS = 1000 / 60
+
+# rock pool size for --check-backends, small enough that every pool policy kicks in
+CHECK_POOL_CAPACITY = 20
+
+# every this many ticks, one runs under tracemalloc instead of being timed
+ALLOC_SAMPLE_TICKS = 10
+
+
+def load_legacy(name):
+    """
+    Loads one of the older asteroids scripts without opening its window.
+    Those scripts create the window and call arcade.run() at the bottom, so
+    the source is compiled without those two statements.
+    Return: module
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), name + ".py")
+    with open(path) as source_file:
+        source = source_file.read()
+    source = source.replace("window = Game(SCREEN_WIDTH, SCREEN_HEIGHT)", "")
+    source = source.replace("arcade.run()", "")
+    module = types.ModuleType(name)
+    module.__file__ = path
+    exec(compile(source, path, "exec"), module.__dict__)
+    return module
+
+
+class LegacyHarness():
+    """
+    Drives the Game logic of an older version without its window. The Game
+    methods are copied onto a plain class, so update(), check_collisions()
+    and remove_notAliveObject() run exactly as written in that version.
+    """
+    def __init__(self, module, seed):
+        random.seed(seed)
+        self.module = module
+        methods = {name: value for name, value in vars(module.Game).items()
+                   if isinstance(value, types.FunctionType) and name != "__init__"}
+        self.game = type("HeadlessGame", (), methods)()
+        game = self.game
+        game.held_keys = set()
+        game.score = 0
+        game.ship = module.Ship()
+        game.asteroids = [module.LargeRock() for i in range(module.INITIAL_ROCK_COUNT)]
+        game.bullets = []
+        # asteroids01 only has a placeholder Bullet that cannot be aimed
+        self.can_fire = module.Bullet.__init__.__code__.co_argcount == 4
+
+    def add_rock(self, size, x, y, dx, dy):
+        cls = {"large": self.module.LargeRock, "medium": self.module.MediumRock,
+               "small": self.module.SmallRock}[size]
+        rock = cls()
+        rock.center.x = x
+        rock.center.y = y
+        rock.velocity.dx = dx
+        rock.velocity.dy = dy
+        self.game.asteroids.append(rock)
+
+    def fire(self, angle, x, y):
+        bullet = self.module.Bullet(angle, x, y)
+        bullet.fire()
+        self.game.bullets.append(bullet)
+
+    def rocks(self):
+        return self.game.asteroids
+
+    def tick(self):
+        self.game.update(asteroidsFinal.TICK_TIME)
+
+    def counts(self):
+        return len(self.game.asteroids), len(getattr(self.game, "bullets", ()))
+
+
+class WorldHarness():
+    """
+    Drives an asteroidsFinal.World with the chosen collision backend
+    """
+    def __init__(self, module, seed, backend):
+        self.module = module
+        self.world = module.World(seed)
+        self.world.set_collision_backend(backend)
+        self.can_fire = True
+
+    def add_rock(self, size, x, y, dx, dy):
+        cls = {"large": self.module.LargeRock, "medium": self.module.MediumRock,
+               "small": self.module.SmallRock}[size]
+        rock = self.world.store.spawn(cls, self.world.asteroids)
+        if rock is None:
+            # the pool's "drop" policy refused it
+            return
+        rock.center.x = x
+        rock.center.y = y
+        rock.velocity.dx = dx
+        rock.velocity.dy = dy
+
+    def fire(self, angle, x, y):
+        bullet = self.world.store.spawn(self.module.Bullet, self.world.bullets, angle, x, y)
+        if bullet is None:
+            # the pool's "drop" policy refused it
+            return
+        bullet.fire()
+
+    def rocks(self):
+        return self.world.asteroids
+
+    def tick(self):
+        self.world.update()
+        self.world.events.clear()
+
+    def counts(self):
+        return len(self.world.asteroids), len(self.world.bullets)
+
+
+def add_random_rocks(harness, rng, count):
+    """
+    Scatters count rocks of random sizes over the screen with random headings
+    """
+    for i in range(count):
+        direction = math.radians(rng.uniform(0, 360))
+        harness.add_rock(rng.choice(ROCK_SIZES),
+                         rng.uniform(0, asteroidsFinal.SCREEN_WIDTH),
+                         rng.uniform(0, asteroidsFinal.SCREEN_HEIGHT),
+                         math.cos(direction) * asteroidsFinal.BIG_ROCK_SPEED,
+                         math.sin(direction) * asteroidsFinal.BIG_ROCK_SPEED)
+
+
+def fire_from_center(harness, rng, shots):
+    """
+    Fires shots bullets from the middle of the screen in random directions
+    """
+    for i in range(shots):
+        harness.fire(rng.uniform(0, 360), asteroidsFinal.SCREEN_WIDTH / 2, asteroidsFinal.SCREEN_HEIGHT / 2)
+
+
+def fire_at_rocks(harness, rng, shots):
+    """
+    Fires shots bullets straight onto randomly chosen rocks so they split
+    """
+    rocks = harness.rocks()
+    for i in range(min(shots, len(rocks))):
+        rock = rng.choice(rocks)
+        harness.fire(rng.uniform(0, 360), rock.center.x, rock.center.y)
+
+
+class Scenario():
+    """
+    A scripted benchmark: setup() builds the field, each_tick() feeds input
+    """
+    def __init__(self, name, rocks=0, large_rocks=0, fire=None, shots=0, needs_fire=False):
+        self.name = name
+        self.rocks = rocks
+        self.large_rocks = large_rocks
+        self.fire = fire
+        self.shots = shots
+        self.needs_fire = needs_fire
+
+    def setup(self, harness, rng):
+        add_random_rocks(harness, rng, self.rocks)
+        for i in range(self.large_rocks):
+            harness.add_rock("large", rng.uniform(0, asteroidsFinal.SCREEN_WIDTH),
+                             rng.uniform(0, asteroidsFinal.SCREEN_HEIGHT), rng.uniform(-1, 1), rng.uniform(-1, 1))
+
+    def each_tick(self, harness, rng):
+        if self.fire is not None and harness.can_fire:
+            self.fire(harness, rng, self.shots)
+
+
+SCENARIOS = {
+    "idle": Scenario("idle"),
+    "sustained_fire": Scenario("sustained_fire", fire=fire_from_center, shots=5, needs_fire=True),
+    "split_cascade": Scenario("split_cascade", large_rocks=300, fire=fire_at_rocks, shots=10, needs_fire=True),
+    "rocks_1k": Scenario("rocks_1k", rocks=1000, fire=fire_from_center, shots=2),
+    "rocks_10k": Scenario("rocks_10k", rocks=10000, fire=fire_from_center, shots=2),
+    "rocks_100k": Scenario("rocks_100k", rocks=100000, fire=fire_from_center, shots=2),
+}
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the value at fraction (0 to 1) of an already sorted list
+    """
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def traced_tick(harness):
+    """
+    Runs one tick of harness with tracemalloc tracing only what that tick
+    allocates, so blocks it frees that were allocated earlier do not cancel
+    out the ones it allocates
+    Return: (blocks the tick allocated that are still alive after it,
+             peak bytes the tick had allocated at once, temporaries included)
+    """
+    tracemalloc.start()
+    try:
+        harness.tick()
+        peak = tracemalloc.get_traced_memory()[1]
+        blocks = len(tracemalloc.take_snapshot().traces)
+    finally:
+        tracemalloc.stop()
+    return blocks, peak
+
+
+def run_scenario(harness, scenario, ticks, max_seconds, seed):
+    """
+    Runs up to ticks ticks of scenario on harness, stopping early once
+    max_seconds of tick time have been spent.
+    Every ALLOC_SAMPLE_TICKS-th tick is run by traced_tick instead of timed:
+    alloc_blocks_per_tick and alloc_peak_kb_per_tick average what it reports.
+    net_alloc_blocks_per_tick is the change in sys.getallocatedblocks() over
+    the timed ticks, which frees cancel out, and gc_collections the number of
+    garbage collector runs during all of them.
+    Return: dict of results
+    """
+    rng = random.Random(seed)
+    scenario.setup(harness, rng)
+    rocks, bullets = harness.counts()
+
+    latencies = []
+    net_blocks = 0
+    samples = []
+    collections_before = sum(stats["collections"] for stats in gc.get_stats())
+    spent = 0.0
+    for tick in range(ticks):
+        scenario.each_tick(harness, rng)
+        if tick % ALLOC_SAMPLE_TICKS == ALLOC_SAMPLE_TICKS - 1:
+            samples.append(traced_tick(harness))
+            continue
+        blocks_before = sys.getallocatedblocks()
+        start = time.perf_counter()
+        harness.tick()
+        elapsed = time.perf_counter() - start
+        net_blocks += sys.getallocatedblocks() - blocks_before
+        latencies.append(elapsed)
+        spent += elapsed
+        if spent > max_seconds:
+            break
+    collections = sum(stats["collections"] for stats in gc.get_stats()) - collections_before
+
+    latencies.sort()
+    final_rocks, final_bullets = harness.counts()
+    return {
+        "scenario": scenario.name,
+        "initial_rocks": rocks,
+        "final_rocks": final_rocks,
+        "final_bullets": final_bullets,
+        "ticks": len(latencies),
+        "seconds": spent,
+        "ticks_per_sec": len(latencies) / spent if spent else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "alloc_blocks_per_tick": sum(blocks for blocks, peak in samples) / len(samples) if samples else 0.0,
+        "alloc_peak_kb_per_tick": sum(peak for blocks, peak in samples) / 1024 / len(samples) if samples else 0.0,
+        "net_alloc_blocks_per_tick": net_blocks / len(latencies) if latencies else 0.0,
+        "gc_collections": collections,
+    }
+
+
+def measure_memory(harness, count, seed):
+    """
+    Adds count random rocks to harness and measures the memory they hold on
+    to: the objects themselves plus, for asteroidsFinal, their entity store rows
+    Return: dict of results
+    """
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        add_random_rocks(harness, rng, count)
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return {
+        "scenario": "memory",
+        "entities": count,
+        "bytes": used,
+        "bytes_per_entity": used / count if count else 0.0,
+    }
+
+
+def world_state(world):
+    """
+    Returns everything check_backends compares between two runs of a world
+    Return: tuple
+    """
+    return (world.score, world.ship.alive, len(world.bullets),
+            [(type(rock).__name__, rock.center.x, rock.center.y, rock.alive) for rock in world.asteroids])
+
+
+def check_backends(scenarios, ticks, seeds):
+    """
+    Runs every scenario under each pool policy, with rock pools of
+    CHECK_POOL_CAPACITY so the policy kicks in, on every collision backend,
+    and compares the worlds they end up with
+    Return: list of (policy, scenario, seed) whose backends disagreed
+    """
+    mismatches = []
+    for policy in asteroidsFinal.POOL_POLICIES:
+        for name in scenarios:
+            for seed in seeds:
+                states = []
+                for backend in asteroidsFinal.COLLISION_BACKENDS:
+                    harness = WorldHarness(asteroidsFinal, seed, backend)
+                    store = harness.world.store
+                    for cls in (asteroidsFinal.MediumRock, asteroidsFinal.SmallRock):
+                        store.pools[cls] = asteroidsFinal.ObjectPool(cls, store, CHECK_POOL_CAPACITY, policy)
+                    rng = random.Random(seed)
+                    SCENARIOS[name].setup(harness, rng)
+                    for tick in range(ticks):
+                        SCENARIOS[name].each_tick(harness, rng)
+                        harness.tick()
+                    states.append(world_state(harness.world))
+                same = all(state == states[0] for state in states)
+                if not same:
+                    mismatches.append((policy, name, seed))
+                print("{:8} {:15} seed {:<4} scores {} {}".format(policy, name, seed,
+                      [state[0] for state in states], "ok" if same else "MISMATCH"), file=sys.stderr)
+    return mismatches
+
+
+def make_harness(version, seed, backend):
+    """
+    Builds the harness for one version (and collision backend for asteroidsFinal)
+    """
+    if version == "asteroidsFinal":
+        return WorldHarness(asteroidsFinal, seed, backend)
+    return LegacyHarness(load_legacy(version), seed)
+
+
+def run(versions, scenarios, backends, ticks, max_seconds, seed):
+    """
+    Runs every scenario on every version and backend
+    Return: list of result dicts
+    """
+    results = []
+    for version in versions:
+        for backend in (backends if version == "asteroidsFinal" else (None,)):
+            for name in scenarios:
+                scenario = SCENARIOS[name]
+                harness = make_harness(version, seed, backend)
+                if scenario.needs_fire and not harness.can_fire:
+                    result = {"scenario": name, "skipped": "version cannot fire bullets"}
+                else:
+                    result = run_scenario(harness, scenario, ticks, max_seconds, seed)
+                result["version"] = version
+                result["backend"] = backend
+                results.append(result)
+                print("{:15} {:7} {:15} {}".format(version, backend or "-", name,
+                      "skipped" if "skipped" in result else
+                      "{ticks_per_sec:10.1f} ticks/s  p50 {p50_ms:.3f} ms  p99 {p99_ms:.3f} ms".format(**result)),
+                      file=sys.stderr)
+    return results
+
+
+def run_memory(versions, count, seed):
+    """
+    Measures the memory per rock of every version
+    Return: list of result dicts
+    """
+    results = []
+    for version in versions:
+        result = measure_memory(make_harness(version, seed, "grid"), count, seed)
+        result["version"] = version
+        results.append(result)
+        print("{:15} {:7} {:15} {bytes_per_entity:10.1f} bytes/entity over {entities} rocks".format(
+              version, "-", "memory", **result), file=sys.stderr)
+    return results
+
+
+def over_budget(results, budget_ms):
+    """
+    Returns the results whose p99 tick latency is over budget_ms
+    """
+    return [result for result in results if result.get("p99_ms", 0.0) > budget_ms]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the asteroids simulations headlessly")
+    parser.add_argument("--versions", nargs="+", default=list(VERSIONS), choices=VERSIONS)
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--backends", nargs="+", default=["grid"], choices=asteroidsFinal.COLLISION_BACKENDS,
+                        help="collision backends to run asteroidsFinal with")
+    parser.add_argument("--ticks", type=int, default=600)
+    parser.add_argument("--max-seconds", type=float, default=10.0,
+                        help="stop a scenario once its ticks have taken this long")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory", type=int, default=0, metavar="ROCKS",
+                        help="also measure the bytes per entity of each version holding this many rocks")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    parser.add_argument("--budget-ms", type=float, nargs="?", const=FRAME_BUDGET_MS, default=None,
+                        help="fail when a scenario's p99 tick takes longer than this (default: one 60 FPS frame)")
+    parser.add_argument("--check-backends", type=int, nargs="?", const=4, default=0, metavar="SEEDS",
+                        help="instead of timing, run the scenarios for SEEDS seeds from --seed under every pool "
+                             "policy and fail unless every collision backend ends up in the same state")
+    args = parser.parse_args(argv)
+
+    if args.check_backends:
+        seeds = range(args.seed, args.seed + args.check_backends)
+        if check_backends(args.scenarios, args.ticks, seeds):
+            sys.exit(1)
+        return
+
+    results = run(args.versions, args.scenarios, args.backends, args.ticks, args.max_seconds, args.seed)
+    if args.memory:
+        results += run_memory(args.versions, args.memory, args.seed)
+    report = {"seed": args.seed, "ticks": args.ticks, "python": sys.version.split()[0], "results": results}
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.budget_ms is not None:
+        over = over_budget(results, args.budget_ms)
+        for result in over:
+            print("{version} {backend} {scenario}: p99 {p99_ms:.3f} ms is over the budget".format(**result),
+                  file=sys.stderr)
+        if over:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
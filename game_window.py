@@ -0,0 +1,641 @@
+"""
+File: game_window.py
+The arcade window of the asteroids game: sprite batches, HUD text, layers
+and the Game window itself.
+
+asteroidsFinal.py holds the simulation and imports nothing from arcade or
+pyglet, so headless runs never pay for them. This module is only imported
+once a window is actually wanted, by asteroidsFinal.main().
+"""
+import argparse
+import random
+import sys
+
+import arcade
+import pyglet
+import numpy as np
+
+from asteroidsFinal import (BACKGROUND_IMAGE, BIG_ROCK_IMAGE, BULLET_IMAGE, CONTROL_BRAKE, CONTROL_LEFT,
+                            CONTROL_REVERSE, CONTROL_RIGHT, CONTROL_THRUST, EVENT_HIT, EVENT_SHOOT,
+                            HIT_SOUND, KIND_BIG_ROCK, KIND_BULLET, KIND_MEDIUM_ROCK, KIND_SHIP, KIND_SMALL_ROCK,
+                            MEDIUM_ROCK_IMAGE, SCREEN_HEIGHT, SCREEN_WIDTH, SHIP_IMAGE, SHOOT_SOUND,
+                            SMALL_ROCK_IMAGE, TEXTURES, EntityStore, FixedStepClock, World)
+from assets import AssetManager
+from assets import build_manifest
+from audio import ArcadeAudioBackend
+from audio import Mixer
+from audio import NullAudioBackend
+from profiler import FrameProfiler
+from profiler import NULL_PROFILER
+from profiler import StartupTimer
+from replay import InputLog
+from replay import InputRecorder
+from replay import Replay
+
+LOSE_TEXT = "You hit an asteroid...Better luck next time!"
+WIN_TEXT = "You Win!"
+
+# frames between refreshes of the profiler overlay text
+PROFILER_OVERLAY_REFRESH = 15
+
+# names accepted by Game.set_renderer
+RENDERERS = ("batched", "immediate")
+
+# sound played for each world event
+EVENT_SOUNDS = ((EVENT_HIT, HIT_SOUND), (EVENT_SHOOT, SHOOT_SOUND))
+
+# arcade keys for each ship control, WASD included
+KEY_CONTROLS = {
+    arcade.key.LEFT: CONTROL_LEFT,
+    arcade.key.A: CONTROL_LEFT,
+    arcade.key.RIGHT: CONTROL_RIGHT,
+    arcade.key.D: CONTROL_RIGHT,
+    arcade.key.UP: CONTROL_THRUST,
+    arcade.key.W: CONTROL_THRUST,
+    arcade.key.DOWN: CONTROL_REVERSE,
+    arcade.key.S: CONTROL_REVERSE,
+    arcade.key.LSHIFT: CONTROL_BRAKE,
+}
+
+# sprite of each entity kind, in the order they are drawn: rocks, then the ship, then bullets
+KIND_IMAGES = (
+    (KIND_BIG_ROCK, BIG_ROCK_IMAGE),
+    (KIND_MEDIUM_ROCK, MEDIUM_ROCK_IMAGE),
+    (KIND_SMALL_ROCK, SMALL_ROCK_IMAGE),
+    (KIND_SHIP, SHIP_IMAGE),
+    (KIND_BULLET, BULLET_IMAGE),
+)
+
+# place of each entity kind in KIND_IMAGES, indexed by kind; -1 for kinds that are not drawn
+DRAW_RANK = np.full(max(kind for kind, img in KIND_IMAGES) + 1, -1, dtype=np.int64)
+DRAW_RANK[[kind for kind, img in KIND_IMAGES]] = np.arange(len(KIND_IMAGES))
+
+# arcade.SpriteList internals SpriteRenderer writes positions and angles through
+# (arcade 2.6); without them it moves each sprite through its own attributes
+SPRITE_LIST_INTERNALS = ("sprite_slot", "_sprite_pos_data", "_sprite_angle_data",
+                         "_sprite_pos_changed", "_sprite_angle_changed")
+
+def has_sprite_buffers(sprite_list):
+    """
+    Returns whether sprite_list has the SPRITE_LIST_INTERNALS, with float32 position and angle buffers
+    """
+    return all(hasattr(sprite_list, name) for name in SPRITE_LIST_INTERNALS) and \
+        getattr(sprite_list._sprite_pos_data, "typecode", None) == "f" and \
+        getattr(sprite_list._sprite_angle_data, "typecode", None) == "f"
+
+
+class SpriteRenderer():
+    """
+    Draws every flying object of an entity store in a single batched call.
+    One arcade.SpriteList holds a sprite per object, ordered rocks, ship,
+    bullets; it is grown or trimmed to the number of objects and then moved
+    from the x, y and angle columns of the store. The sprites' textures all
+    come from the sprite atlas, so the whole field is one draw call and one
+    texture bind no matter how many rocks and bullets there are. A sprite
+    whose kind or texture changed (a placeholder replaced by the real
+    texture, or the boundary between two kinds moving) is given its new one.
+
+    Positions and angles are written straight into the sprite list's buffers
+    with NumPy rather than through each Sprite, so the sprites' own position
+    and angle attributes are not kept up to date; only the buffers are. The
+    buffers are arcade internals (SPRITE_LIST_INTERNALS): an arcade without them
+    gets every sprite moved through sprite.position and sprite.angle instead.
+    """
+    def __init__(self):
+        self.sprite_list = arcade.SpriteList()
+        #whether positions and angles are written into the buffers in bulk
+        self.bulk = has_sprite_buffers(self.sprite_list)
+        #NumPy views of the position and angle buffers and the buffers they are
+        #of; dropped while the list resizes them (arcade cannot grow a buffer a
+        #view is open on) and taken again when the list swaps them for new ones
+        self.positions = None
+        self.angles = None
+        self.buffers = None
+        #draw rank of each sprite and the textures of the last sync, to spot retextured sprites
+        self.ranks = np.zeros(0, dtype=np.int64)
+        self.textures = ()
+        #buffer slot of each sprite, in list order
+        self.slots = np.zeros(0, dtype=np.intp)
+        self.draw_calls = 0
+
+    def sync(self, store, alpha=1.0):
+        """
+        Copies the position, angle and texture of every object in store into the sprites
+        :param alpha: how far between the previous and the current tick to draw
+        """
+        ranks = DRAW_RANK[store.kind[:store.count]]
+        rows = np.flatnonzero(ranks >= 0)
+        rows = rows[np.argsort(ranks[rows], kind="stable")]
+        ranks = ranks[rows]
+        textures = tuple(TEXTURES.get(img) for kind, img in KIND_IMAGES)
+        sprite_list = self.sprite_list
+        count = len(rows)
+        kept = min(len(sprite_list), count)
+        if len(sprite_list) != count:
+            self.positions = None
+            self.angles = None
+            while len(sprite_list) < count:
+                sprite_list.append(arcade.Sprite(texture=textures[ranks[len(sprite_list)]]))
+            while len(sprite_list) > count:
+                sprite_list.pop()
+            if self.bulk:
+                #sprites only come and go at the end, so sprite_slot is still in list order
+                self.slots = np.fromiter(sprite_list.sprite_slot.values(), dtype=np.intp, count=count)
+
+        if any(new is not old for new, old in zip(textures, self.textures)) or not self.textures:
+            changed = range(kept)
+        else:
+            changed = np.flatnonzero(self.ranks[:kept] != ranks[:kept]).tolist()
+        for index in changed:
+            sprite_list[index].texture = textures[ranks[index]]
+        self.ranks = ranks
+        self.textures = textures
+        if not count:
+            return
+
+        x, y, angle = store.interpolated(rows, alpha)
+        if not self.bulk:
+            for sprite, sprite_x, sprite_y, sprite_angle in zip(sprite_list, x.tolist(), y.tolist(), angle.tolist()):
+                sprite.position = (sprite_x, sprite_y)
+                sprite.angle = sprite_angle
+            return
+        buffers = (sprite_list._sprite_pos_data, sprite_list._sprite_angle_data)
+        if self.positions is None or any(new is not old for new, old in zip(buffers, self.buffers)):
+            self.positions = np.frombuffer(buffers[0], dtype=np.float32).reshape(-1, 2)
+            self.angles = np.frombuffer(buffers[1], dtype=np.float32)
+            self.buffers = buffers
+        self.positions[self.slots, 0] = x
+        self.positions[self.slots, 1] = y
+        self.angles[self.slots] = angle
+        sprite_list._sprite_pos_changed = True
+        sprite_list._sprite_angle_changed = True
+
+    def draw(self, store, alpha=1.0, profiler=NULL_PROFILER):
+        """
+        Syncs the sprites with store and draws them, rocks first, then the ship, then bullets
+        """
+        with profiler.phase("sync_sprites"):
+            self.sync(store, alpha)
+        with profiler.phase("draw_sprites"):
+            self.draw_calls = 0
+            if len(self.sprite_list):
+                self.sprite_list.draw()
+                self.draw_calls = 1
+
+def rgba(color):
+    """
+    Returns an arcade color as the RGBA tuple pyglet labels expect
+    """
+    return tuple(color) + (255,) if len(color) == 3 else tuple(color)
+
+class HudText():
+    """
+    Prebuilt labels for the score, the end-of-game banners and the profiler
+    overlay, all in one pyglet batch. A label is only laid out again when what
+    it shows changes, and the whole HUD is drawn with a single batch draw.
+    """
+    def __init__(self):
+        self.batch = pyglet.graphics.Batch()
+        white = rgba(arcade.color.WHITE)
+        self.score = 0
+        self.progress = None
+        self.score_label = pyglet.text.Label("Score: 0", font_size=12, color=white,
+                                             x=10, y=SCREEN_HEIGHT - 20, batch=self.batch)
+        self.lose_label = pyglet.text.Label(LOSE_TEXT, font_size=15, color=white,
+                                            x=250, y=300, batch=self.batch)
+        self.win_label = pyglet.text.Label(WIN_TEXT, font_size=25, color=white,
+                                           x=300, y=300, batch=self.batch)
+        self.overlay_label = pyglet.text.Label("", font_name="Courier New", font_size=9,
+                                               color=rgba(arcade.color.LIGHT_GREEN),
+                                               x=10, y=SCREEN_HEIGHT - 30, width=SCREEN_WIDTH - 20,
+                                               anchor_y="top", multiline=True, batch=self.batch)
+        self.progress_label = pyglet.text.Label("", font_size=9, color=white, x=10, y=10, batch=self.batch)
+        self.lose_label.visible = False
+        self.win_label.visible = False
+        self.overlay_label.visible = False
+        self.progress_label.visible = False
+        self.rebuilds = 0
+
+    def update(self, score, lost, won):
+        """
+        Brings the labels up to date with the game, rebuilding only the ones that changed
+        """
+        if score != self.score:
+            self.score = score
+            self.score_label.text = "Score: {}".format(score)
+            self.rebuilds += 1
+        if self.lose_label.visible != lost:
+            self.lose_label.visible = lost
+        if self.win_label.visible != won:
+            self.win_label.visible = won
+
+    def set_progress(self, loaded, total):
+        """
+        Shows how many assets are loaded until they all are
+        """
+        if (loaded, total) == self.progress:
+            return
+        self.progress = (loaded, total)
+        if loaded < total:
+            self.progress_label.text = "Loading assets {}/{}".format(loaded, total)
+            self.rebuilds += 1
+        self.progress_label.visible = loaded < total
+
+    def set_overlay(self, lines):
+        """
+        Shows lines in the overlay label, or hides it when lines is None
+        """
+        if lines is None:
+            if self.overlay_label.visible:
+                self.overlay_label.visible = False
+            return
+        text = "\n".join(lines)
+        if text != self.overlay_label.text:
+            self.overlay_label.text = text
+            self.rebuilds += 1
+        if not self.overlay_label.visible:
+            self.overlay_label.visible = True
+
+    def draw(self, ctx):
+        """
+        Draws every visible label with one batch draw
+        :param ctx: the window's arcade context
+        """
+        with ctx.pyglet_rendering():
+            self.batch.draw()
+
+class StaticLayer():
+    """
+    A layer that does not change from frame to frame, such as the background.
+    Its sprites are built once into a static (GPU resident) sprite list and
+    are only rebuilt after invalidate(), e.g. when the window is resized.
+    """
+    def __init__(self, build, opaque=False):
+        """
+        :param build: function returning the layer's sprites
+        :param opaque: whether the layer covers the whole screen with no transparency
+        """
+        self.build = build
+        self.opaque = opaque
+        self.sprite_list = None
+        self.builds = 0
+
+    def invalidate(self):
+        """
+        Marks the layer to be rebuilt before it is next drawn
+        """
+        self.sprite_list = None
+
+    def draw(self):
+        if self.sprite_list is None:
+            self.sprite_list = arcade.SpriteList(is_static=True)
+            self.sprite_list.extend(self.build())
+            self.builds += 1
+        self.sprite_list.draw()
+
+class Compositor():
+    """
+    Draws the frame as an explicit stack of layers, bottom first. When the
+    bottom layer is opaque it already covers every pixel, so the window is not
+    cleared first and the screen is only filled once per frame.
+    """
+    def __init__(self, window):
+        self.window = window
+        self.layers = []
+
+    def add(self, draw, phase=None, opaque=False):
+        """
+        Puts a layer on top of the stack
+        :param draw: function drawing the layer
+        :param phase: profiler phase to time the layer as, if any
+        :param opaque: whether the layer covers the whole screen
+        """
+        self.layers.append((draw, phase, opaque))
+
+    def draw(self, profiler=NULL_PROFILER):
+        """
+        Draws every layer in order
+        """
+        if not self.layers or not self.layers[0][2]:
+            self.window.clear()
+        for draw, phase, opaque in self.layers:
+            if phase is None:
+                draw()
+            else:
+                with profiler.phase(phase):
+                    draw()
+
+def controls_for(keys):
+    """
+    Turns a set of held arcade keys into a World.controls bitmask
+    Return: int
+    """
+    controls = 0
+    for key in keys:
+        controls |= KEY_CONTROLS.get(key, 0)
+    return controls
+
+class Game(arcade.Window):
+    """
+    This class handles all the game callbacks and interaction.
+    It draws a World, passes it the held keys and plays the sounds for its events.
+    """
+
+    def __init__(self, width, height, seed=None, audio=True, startup=None):
+        """
+        Sets up the initial conditions of the game. No asset is loaded here:
+        an AssetManager decodes every texture and sound on a thread pool while
+        the first frames are drawn with placeholders and without sound.
+        :param width: Screen width
+        :param height: Screen height
+        :param seed: seed passed on to the World, a random one by default
+        :param audio: False to run silently without touching the audio device
+        :param startup: StartupTimer the startup stages are recorded in
+        """
+        self.startup = startup if startup is not None else StartupTimer()
+        with self.startup.stage("open_window"):
+            super().__init__(width, height)
+            arcade.set_background_color(arcade.color.SMOKY_BLACK)
+
+        #world events are played through the mixer, one sound per event name
+        self.mixer = Mixer(ArcadeAudioBackend() if audio else NullAudioBackend())
+
+        with self.startup.stage("start_assets"):
+            self.assets = AssetManager(build_manifest(EVENT_SOUNDS), TEXTURES, self.mixer,
+                                       startup=self.startup).start()
+            self.background = TEXTURES.get(BACKGROUND_IMAGE)
+        self.held_keys = set()
+
+        #F3 shows the per-phase timings, F4 exports them to profile.json/profile.csv
+        self.profiler = FrameProfiler()
+        self.show_profiler = False
+
+        with self.startup.stage("setup"):
+            #score, banners and overlay text, laid out only when they change
+            self.hud = HudText()
+
+            #layers drawn bottom first: background, flying objects, HUD
+            self.background_layer = StaticLayer(self.build_background, opaque=True)
+            self.entity_draw_calls = 0
+            self.compositor = Compositor(self)
+            self.compositor.add(self.background_layer.draw, "draw_background", opaque=True)
+            self.compositor.add(self.draw_entities)
+            self.compositor.add(self.draw_score, "draw_text")
+
+            #a concrete seed, so the session can be recorded and replayed
+            self.seed = seed if seed is not None else random.randrange(1 << 32)
+            self.world = World(self.seed, self.profiler)
+            self.clock = FixedStepClock()
+
+            #draw the field through one sprite list on the sprite atlas
+            self.sprites = SpriteRenderer()
+            self.renderer = "batched"
+
+        #per-tick input log being written, and bullets fired since the last tick
+        self.recorder = None
+        self.fires = 0
+        #a Replay playing instead of the keyboard, if any
+        self.replay = None
+        #a multiplayer server playing instead of the local World, if any
+        self.client = None
+        self.socket = None
+        self.net_store = None
+
+        self.first_frame_drawn = False
+        self.quit_after_startup = False
+        self.assets_resident = False
+
+    def refresh_assets(self):
+        """
+        Swaps in the background once it is loaded and, when every asset is,
+        raises the first error any load hit
+        """
+        if self.assets_resident:
+            return
+        if TEXTURES.resident(BACKGROUND_IMAGE) and self.background is not TEXTURES.get(BACKGROUND_IMAGE):
+            self.background = TEXTURES.get(BACKGROUND_IMAGE)
+            self.background_layer.invalidate()
+        if self.assets.finished():
+            self.assets.wait()
+            self.assets_resident = True
+
+    def draw_score(self):
+        """
+        Puts the current score on the screen, along with the end-of-game banners
+        and, when shown, the per-phase timings under the score
+        """
+        world = self.world
+        if self.client is not None:
+            self.hud.update(self.client.score, self.client.player_id is not None and not self.client.ship_alive,
+                            False)
+        else:
+            self.hud.update(world.score, not world.ship.alive, len(world.asteroids) == 0)
+        self.hud.set_progress(*self.assets.progress())
+        if not self.show_profiler:
+            self.hud.set_overlay(None)
+        elif self.profiler.frame % PROFILER_OVERLAY_REFRESH == 0 or not self.hud.overlay_label.visible:
+            self.hud.set_overlay(self.profiler.overlay_lines())
+        self.hud.draw(self.ctx)
+
+    def on_draw(self):
+        """
+        Called automatically by the arcade framework.
+        Handles the responsibility of drawing all elements.
+        """
+        world = self.world
+        profiler = self.profiler
+        self.refresh_assets()
+        self.compositor.draw(profiler)
+
+        # background, flying objects and one batch for the HUD
+        draw_calls = 1 + self.entity_draw_calls + 1
+        profiler.end_frame({"rocks": len(world.asteroids), "bullets": len(world.bullets),
+                            "entities": world.store.count, "draw_calls": draw_calls})
+
+        if not self.first_frame_drawn:
+            self.first_frame_drawn = True
+            self.startup.mark("first_frame")
+        if self.quit_after_startup and self.assets_resident:
+            arcade.exit()
+
+    def build_background(self):
+        """
+        Returns the sprite that fills the screen with the star background
+        """
+        background = arcade.Sprite(texture=self.background)
+        background.width = SCREEN_WIDTH
+        background.height = SCREEN_HEIGHT
+        background.position = (SCREEN_WIDTH / 2, SCREEN_HEIGHT / 2)
+        return [background]
+
+    def draw_entities(self):
+        """
+        Draws the asteroids, the ship and the bullets
+        """
+        world = self.world
+        profiler = self.profiler
+        if self.client is not None:
+            self.client.fill_store(self.net_store)
+            self.sprites.draw(self.net_store, 1.0, profiler)
+            self.entity_draw_calls = self.sprites.draw_calls
+        elif self.renderer == "batched":
+            self.sprites.draw(world.store, self.clock.alpha, profiler)
+            self.entity_draw_calls = self.sprites.draw_calls
+        else:
+            with profiler.phase("draw_rocks"):
+                for asteroid in world.asteroids:
+                    asteroid.draw()
+
+            with profiler.phase("draw_ship"):
+                world.ship.draw()
+
+            with profiler.phase("draw_bullets"):
+                for bullet in world.bullets:
+                    bullet.draw()
+            self.entity_draw_calls = len(world.asteroids) + 1 + len(world.bullets)
+
+    def on_resize(self, width, height):
+        """
+        Rebuilds the static layers for the new window size
+        """
+        super().on_resize(width, height)
+        # pyglet can call this from inside the Window constructor
+        if hasattr(self, "background_layer"):
+            self.background_layer.invalidate()
+
+    def set_renderer(self, name):
+        """
+        Selects batched sprite list drawing or one immediate draw call per object
+        :param name: one of RENDERERS
+        """
+        if name not in RENDERERS:
+            raise ValueError("unknown renderer {!r}, expected one of {}".format(name, RENDERERS))
+        self.renderer = name
+
+    def update(self, delta_time):
+        """
+        Update each object in the game.
+        :param delta_time: tells us how much time has actually elapsed
+        """
+        for tick in range(self.clock.advance(delta_time)):
+            if self.client is not None:
+                self.exchange()
+                continue
+            if self.replay is not None:
+                self.replay.step()
+                self.world = self.replay.world
+            else:
+                if self.recorder is not None:
+                    self.recorder.record(self.world.controls, self.fires)
+                self.fires = 0
+                self.world.update()
+            self.play_events()
+
+    def connect(self, host, port=None):
+        """
+        Plays on a multiplayer server: the held keys are sent to it every tick
+        and the state it sends back is drawn instead of the local World
+        :param port: the server's UDP port, server.DEFAULT_PORT by default
+        """
+        import server
+        self.client = server.NetClient()
+        self.socket = server.open_client_socket(host, port if port is not None else server.DEFAULT_PORT)
+        self.socket.send(self.client.join_packet())
+        self.net_store = EntityStore()
+
+    def exchange(self):
+        """
+        Takes in every packet the server sent since the last tick and sends it this tick's input
+        """
+        while True:
+            try:
+                data = self.socket.recv(65536)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            self.client.receive(data)
+        if self.client.player_id is None:
+            self.socket.send(self.client.join_packet())
+        else:
+            self.socket.send(self.client.input_packet(controls_for(self.held_keys), self.fires))
+        self.fires = 0
+
+    def play_events(self):
+        """
+        Plays the sound for the events the world reported, merging repeats of the same sound
+        """
+        for event in self.world.drain_events():
+            self.mixer.trigger(event)
+        self.mixer.flush()
+
+    def on_key_press(self, key: int, modifiers: int):
+        """
+        Puts the current key in the set of keys that are being held
+        and fires a bullet on space.
+        """
+        if key == arcade.key.F3:
+            self.show_profiler = not self.show_profiler
+        elif key == arcade.key.F4:
+            self.profiler.export_json("profile.json")
+            self.profiler.export_csv("profile.csv")
+
+        if self.world.ship.alive and self.replay is None:
+            self.held_keys.add(key)
+            self.world.controls = controls_for(self.held_keys)
+
+            if key == arcade.key.SPACE:
+                self.fires += 1
+                if self.client is None:
+                    self.world.fire()
+                    self.play_events()
+
+    def on_key_release(self, key: int, modifiers: int):
+        """
+        Removes the current key from the set of held keys.
+        """
+        if key in self.held_keys and self.replay is None:
+            self.held_keys.remove(key)
+            self.world.controls = controls_for(self.held_keys)
+
+
+def main(argv=None, startup=None):
+    """
+    Creates the game and starts it going
+    :param startup: StartupTimer already holding the import stages, if any
+    """
+    parser = argparse.ArgumentParser(description="Play asteroids")
+    parser.add_argument("--seed", type=int, help="seed for the rock field")
+    parser.add_argument("--mute", action="store_true", help="play without sound")
+    parser.add_argument("--startup-report", action="store_true",
+                        help="print how long each startup stage took to stderr")
+    parser.add_argument("--quit-after-startup", action="store_true",
+                        help="close once the first frame is drawn and every asset is loaded")
+    parser.add_argument("--record", metavar="PATH", help="write the session's input log here")
+    parser.add_argument("--replay", metavar="PATH", help="watch a recorded session instead of playing")
+    parser.add_argument("--seek", type=int, default=0, help="tick to start watching a replay from")
+    parser.add_argument("--connect", metavar="HOST[:PORT]", help="play on a multiplayer server (see server.py)")
+    args = parser.parse_args(argv)
+
+    startup = startup if startup is not None else StartupTimer()
+    if args.startup_report:
+        startup.report_to(sys.stderr)
+    window = Game(SCREEN_WIDTH, SCREEN_HEIGHT, args.seed, audio=not args.mute, startup=startup)
+    window.quit_after_startup = args.quit_after_startup
+    if args.connect:
+        host, sep, port = args.connect.partition(":")
+        window.connect(host, int(port) if sep else None)
+    elif args.replay:
+        window.replay = Replay(InputLog.load(args.replay), keep_events=True)
+        window.replay.seek(args.seek)
+        window.world = window.replay.world
+        window.world.events.clear()
+    elif args.record:
+        window.recorder = InputRecorder(args.record, window.seed)
+    arcade.run()
+    if window.recorder is not None:
+        window.recorder.close()
+    if window.client is not None:
+        window.socket.send(window.client.leave_packet())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,239 @@
+"""
+File: profiler.py
+Per-phase frame timing for the asteroids game.
+
+World.update and Game.on_draw wrap each of their phases in
+profiler.phase(name). A FrameProfiler adds up the time of every phase over a
+frame and keeps a rolling window of frames for the on-screen overlay, plus a
+longer log of frames that can be exported as CSV or JSON.
+
+StartupTimer times the stages of starting the game, up to the first frame
+and the assets streamed in after it.
+"""
+import csv
+import json
+import time
+
+from collections import deque
+from contextlib import contextmanager
+from contextlib import nullcontext
+
+# frames kept for the overlay statistics and for export
+PROFILE_WINDOW = 120
+PROFILE_KEEP = 3600
+
+# upper edges (in ms) of the histogram buckets; the last bucket is open ended
+HISTOGRAM_EDGES_MS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 33)
+
+_NULL_PHASE = nullcontext()
+
+
+class NullProfiler():
+    """
+    Profiler that records nothing, used when profiling is switched off
+    """
+    enabled = False
+
+    def phase(self, name):
+        return _NULL_PHASE
+
+    def end_frame(self, counts=None):
+        pass
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class _Phase():
+    """
+    Context manager that adds the time spent inside it to one phase
+    """
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        current = self.profiler.current
+        current[self.name] = current.get(self.name, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+class FrameProfiler():
+    """
+    Collects per-phase timings and per-frame counts (entities, draw calls)
+    """
+    enabled = True
+
+    def __init__(self, window=PROFILE_WINDOW, keep=PROFILE_KEEP):
+        self.window = window
+        self.frame = 0
+        self.current = {}
+        self.phases = []
+        self.history = {}
+        self.counts = {}
+        self.frames = deque(maxlen=keep)
+        self._contexts = {}
+
+    def phase(self, name):
+        """
+        Returns a context manager timing the code inside it as phase name
+        """
+        context = self._contexts.get(name)
+        if context is None:
+            context = self._contexts[name] = _Phase(self, name)
+            self.phases.append(name)
+            self.history[name] = deque(maxlen=self.window)
+        return context
+
+    def end_frame(self, counts=None):
+        """
+        Closes the current frame, adding its phase times to the rolling window
+        :param counts: dict of numbers to log with the frame, e.g. entity and draw call counts
+        """
+        row = {"frame": self.frame}
+        for name in self.phases:
+            seconds = self.current.get(name, 0.0)
+            self.history[name].append(seconds)
+            row[name + "_ms"] = seconds * 1000
+        if counts:
+            self.counts = dict(counts)
+            row.update(counts)
+        self.frames.append(row)
+        self.current = {}
+        self.frame += 1
+
+    def stats(self, name):
+        """
+        Summarises the rolling window of one phase
+        Return: dict of mean, p50, p99 and max in milliseconds
+        """
+        samples = sorted(self.history.get(name, ()))
+        if not samples:
+            return {"mean_ms": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        last = len(samples) - 1
+        return {
+            "mean_ms": sum(samples) / len(samples) * 1000,
+            "p50_ms": samples[int(last * 0.50)] * 1000,
+            "p99_ms": samples[int(round(last * 0.99))] * 1000,
+            "max_ms": samples[-1] * 1000,
+        }
+
+    def histogram(self, name, edges_ms=HISTOGRAM_EDGES_MS):
+        """
+        Counts the rolling window of one phase into buckets
+        Return: list with one count per edge plus one for anything slower
+        """
+        buckets = [0] * (len(edges_ms) + 1)
+        for seconds in self.history.get(name, ()):
+            ms = seconds * 1000
+            index = 0
+            while index < len(edges_ms) and ms > edges_ms[index]:
+                index += 1
+            buckets[index] += 1
+        return buckets
+
+    def summary(self):
+        """
+        Returns the stats and histogram of every phase plus the last frame's counts
+        Return: dict
+        """
+        return {
+            "frame": self.frame,
+            "phases": {name: dict(self.stats(name), histogram=self.histogram(name)) for name in self.phases},
+            "histogram_edges_ms": list(HISTOGRAM_EDGES_MS),
+            "counts": self.counts,
+        }
+
+    def overlay_lines(self):
+        """
+        Formats one line per phase for the on-screen overlay
+        Return: list of str
+        """
+        lines = []
+        for name in self.phases:
+            stats = self.stats(name)
+            lines.append("{:<22}{:6.2f} ms  p99 {:6.2f}".format(name, stats["mean_ms"], stats["p99_ms"]))
+        for name, value in self.counts.items():
+            lines.append("{:<22}{}".format(name, value))
+        return lines
+
+    def export_json(self, path):
+        """
+        Writes every logged frame plus the summary to path as JSON
+        """
+        with open(path, "w") as output:
+            json.dump({"summary": self.summary(), "frames": list(self.frames)}, output, indent=2)
+
+    def export_csv(self, path):
+        """
+        Writes one row per logged frame to path as CSV
+        """
+        fields = []
+        for row in self.frames:
+            for key in row:
+                if key not in fields:
+                    fields.append(key)
+        with open(path, "w", newline="") as output:
+            writer = csv.DictWriter(output, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.frames)
+
+
+class StartupTimer():
+    """
+    Records how long each stage of starting the game took and when it ended,
+    counted from start. Stages may end on other threads, e.g. asset streaming.
+    """
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.stages = []
+        self.output = None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the code inside the with block as stage name
+        """
+        began = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - began)
+
+    def mark(self, name):
+        """
+        Records that name has just happened, with no duration of its own
+        """
+        self.record(name, None)
+
+    def record(self, name, seconds):
+        entry = (name, seconds, time.perf_counter() - self.start)
+        self.stages.append(entry)
+        if self.output is not None:
+            print(self.format(entry), file=self.output)
+
+    def report_to(self, output):
+        """
+        Writes the stages recorded so far to output, and every later one as it ends
+        """
+        self.output = output
+        for entry in list(self.stages):
+            print(self.format(entry), file=output)
+
+    def format(self, entry):
+        name, seconds, at = entry
+        took = "" if seconds is None else "{:8.1f} ms".format(seconds * 1000)
+        return "startup {:<20}{:>11}  at {:8.1f} ms".format(name, took, at * 1000)
+
+    def report(self):
+        """
+        Returns every stage with its duration and end time in milliseconds
+        Return: dict
+        """
+        return {name: {"ms": None if seconds is None else seconds * 1000, "at_ms": at * 1000}
+                for name, seconds, at in self.stages}
@@ -0,0 +1,226 @@
+"""
+File: replay.py
+Input recording and headless replay for the asteroids game.
+
+A World is deterministic given its seed and, per tick, the held controls and
+the bullets fired before the tick. An input log stores exactly that: a small
+header with the seed, then one byte per tick (the CONTROL_* bits in the low
+five bits, the number of shots in the top three). A Replay re-simulates the
+log headlessly as fast as it can, keeping a snapshot every so many ticks so
+seek() only re-simulates from the nearest one.
+
+    python replay.py session.rec --seek 36000 --frames 100 5000 36000
+"""
+import argparse
+import struct
+import sys
+import time
+
+import snapshot
+
+from asteroidsFinal import World
+
+MAGIC = b"ASTI"
+LOG_VERSION = 1
+
+# magic, version, seed
+HEADER = struct.Struct("<4sHq")
+
+CONTROL_BITS = 0x1F
+FIRE_SHIFT = 5
+MAX_FIRES_PER_TICK = 7
+
+# ticks between snapshots kept for seeking
+SNAPSHOT_INTERVAL = 600
+
+# ticks buffered by an InputRecorder before they are written out
+RECORD_FLUSH_TICKS = 60
+
+
+def pack_tick(controls, fires):
+    """
+    Packs one tick of input into a byte value
+    Return: int
+    """
+    return (controls & CONTROL_BITS) | (min(fires, MAX_FIRES_PER_TICK) << FIRE_SHIFT)
+
+
+def unpack_tick(value):
+    """
+    Splits a tick byte into its controls and number of shots
+    Return: tuple of (controls, fires)
+    """
+    return value & CONTROL_BITS, value >> FIRE_SHIFT
+
+
+class InputRecorder():
+    """
+    Writes an input log as the game plays. Ticks are written out every
+    RECORD_FLUSH_TICKS, so a session that crashes still leaves a log behind.
+    """
+    def __init__(self, output, seed):
+        """
+        :param output: path or binary file to write the log to
+        :param seed: seed of the World being recorded
+        """
+        self.owns_output = isinstance(output, str)
+        self.output = open(output, "wb") if self.owns_output else output
+        self.output.write(HEADER.pack(MAGIC, LOG_VERSION, seed))
+        self.buffer = bytearray()
+        self.ticks = 0
+
+    def record(self, controls, fires=0):
+        """
+        Records one tick
+        :param controls: CONTROL_* bits held during the tick
+        :param fires: bullets fired before the tick
+        """
+        self.buffer.append(pack_tick(controls, fires))
+        self.ticks += 1
+        if len(self.buffer) >= RECORD_FLUSH_TICKS:
+            self.flush()
+
+    def flush(self):
+        self.output.write(self.buffer)
+        self.output.flush()
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+        if self.owns_output:
+            self.output.close()
+
+
+class InputLog():
+    """
+    A recorded session: the seed and one input byte per tick
+    """
+    def __init__(self, seed, ticks=b""):
+        self.seed = seed
+        self.ticks = bytes(ticks)
+
+    @classmethod
+    def decode(cls, data):
+        """
+        Reads a log from the bytes an InputRecorder wrote
+        Return: InputLog
+        """
+        if len(data) < HEADER.size:
+            raise ValueError("input log is too short to hold a header")
+        magic, version, seed = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError("not an asteroids input log")
+        if version != LOG_VERSION:
+            raise ValueError("unsupported input log version {}".format(version))
+        return cls(seed, data[HEADER.size:])
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as source:
+            return cls.decode(source.read())
+
+    def encode(self):
+        return HEADER.pack(MAGIC, LOG_VERSION, self.seed) + self.ticks
+
+    def __len__(self):
+        return len(self.ticks)
+
+    def tick(self, index):
+        """
+        Returns the (controls, fires) recorded for tick index
+        """
+        return unpack_tick(self.ticks[index])
+
+
+class Replay():
+    """
+    Re-simulates an input log headlessly. tick is the number of ticks played
+    so far; world is the state after them.
+    """
+    def __init__(self, log, snapshot_interval=SNAPSHOT_INTERVAL, keep_events=False):
+        """
+        :param keep_events: leave the world's events for the caller to drain
+        instead of dropping them every tick
+        """
+        self.log = log
+        self.keep_events = keep_events
+        self.snapshot_interval = snapshot_interval
+        self.world = World(log.seed)
+        self.tick = 0
+        # tick -> snapshot of the world after that many ticks
+        self.snapshots = {0: snapshot.encode(self.world)}
+
+    def step(self):
+        """
+        Plays the next tick of the log
+        Return: False once the log has run out
+        """
+        if self.tick >= len(self.log):
+            return False
+        controls, fires = unpack_tick(self.log.ticks[self.tick])
+        self.world.step(controls, fires)
+        if not self.keep_events:
+            self.world.events.clear()
+        self.tick += 1
+        if self.tick % self.snapshot_interval == 0 and self.tick not in self.snapshots:
+            self.snapshots[self.tick] = snapshot.encode(self.world)
+        return True
+
+    def run_to(self, tick):
+        """
+        Plays forward until tick ticks have been played or the log runs out
+        """
+        while self.tick < tick and self.step():
+            pass
+
+    def seek(self, tick):
+        """
+        Moves to tick, going back to the nearest snapshot before it when that
+        is closer than playing on from here
+        """
+        tick = max(0, min(tick, len(self.log)))
+        start = max(known for known in self.snapshots if known <= tick)
+        if tick < self.tick or start > self.tick:
+            snapshot.decode_into(self.world, self.snapshots[start])
+            self.tick = start
+        self.run_to(tick)
+
+    def frames(self, ticks):
+        """
+        Seeks to each of ticks in turn, for looking at (or drawing) only those frames
+        Return: generator of (tick, world)
+        """
+        for tick in ticks:
+            self.seek(tick)
+            yield self.tick, self.world
+
+
+def describe(tick, world):
+    """
+    Returns a one-line summary of the world at a tick
+    """
+    return "tick {:7}  score {:4}  ship {} at ({:.1f}, {:.1f})  rocks {:3}  bullets {:3}".format(
+        tick, world.score, "alive" if world.ship.alive else "dead ", world.ship.center.x, world.ship.center.y,
+        len(world.asteroids), len(world.bullets))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded asteroids session headlessly")
+    parser.add_argument("log", help="input log written with --record")
+    parser.add_argument("--seek", type=int, help="tick to seek to (the end of the log by default)")
+    parser.add_argument("--frames", type=int, nargs="+", default=[], help="ticks to print the state at")
+    args = parser.parse_args(argv)
+
+    log = InputLog.load(args.log)
+    replay = Replay(log)
+    start = time.perf_counter()
+    for tick, world in replay.frames(sorted(args.frames)):
+        print(describe(tick, world))
+    replay.seek(len(log) if args.seek is None else args.seek)
+    elapsed = time.perf_counter() - start
+    print(describe(replay.tick, replay.world))
+    print("seed {}  {} ticks logged  replayed in {:.2f} s".format(log.seed, len(log), elapsed), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,521 @@
+"""
+File: rollback.py
+Peer-to-peer rollback netcode for two player asteroids.
+
+Both peers run the same SharedWorld from the same seed, with players 1 and 2
+joined at tick 0, so the game depends only on the two input streams. Each
+tick a RollbackSession plays its own input straight away. If the other
+peer's input for that tick has not arrived yet, the session predicts it: the
+held controls are repeated and no shots are fired. The session keeps the
+state from before each of the last ROLLBACK_WINDOW ticks. When a real input
+differs from what was predicted, the session loads the state from before
+that tick and plays forward to the present again, all within one frame. A
+peer never runs more than ROLLBACK_WINDOW ticks past the other's inputs; it
+waits instead.
+
+Inputs are bytes packed with replay.pack_tick. They travel over UDP in INPUTS
+packets, each carrying every local input the other peer has not acknowledged
+yet, so a lost packet is covered by the next one.
+
+    python rollback.py --seconds 10 --latency 60 --jitter 20 --loss 0.05   # two process test
+    python rollback.py --measure                                            # cost of a full rollback
+"""
+import argparse
+import hashlib
+import heapq
+import multiprocessing
+import queue
+import random
+import socket
+import struct
+import sys
+import time
+
+import snapshot
+
+from asteroidsFinal import CONTROL_BRAKE, CONTROL_LEFT, CONTROL_RIGHT, CONTROL_THRUST, TICK_TIME, TICKS_PER_SECOND
+from profiler import NULL_PROFILER, FrameProfiler
+from replay import pack_tick, unpack_tick
+from server import SharedWorld
+
+# ticks a session may play ahead of the other peer's inputs, and so the
+# deepest rollback it ever has to do
+ROLLBACK_WINDOW = 10
+
+# the two players, joined in this order on both peers
+PEER_IDS = (1, 2)
+
+# first tick carried, other peer's inputs received for every tick before this, input count
+INPUTS = struct.Struct("<IIB")
+MAX_INPUTS_PER_PACKET = 255
+
+# snapshot size, waves, player count, shooter count
+STATE_HEADER = struct.Struct("<IIBI")
+# id, ship row, score, deaths, respawn tick, controls, view x, view y
+PLAYER = struct.Struct("<HiIIqBdd")
+# bullet row, id of the player who fired it
+SHOOTER = struct.Struct("<iH")
+NO_RESPAWN = -1
+
+# controls the test bots hold
+BOT_CONTROLS = (0, CONTROL_LEFT, CONTROL_RIGHT, CONTROL_THRUST, CONTROL_THRUST | CONTROL_LEFT, CONTROL_BRAKE)
+
+DEFAULT_LATENCY_MS = 50.0
+DEFAULT_JITTER_MS = 10.0
+
+# seconds a finished peer keeps sending, so the other one can finish too
+LINGER = 0.5
+# seconds a test peer waits for the other past the planned end of the game
+PEER_TIMEOUT = 10.0
+
+
+def save_state(world):
+    """
+    Packs a SharedWorld: a snapshot of the world followed by its players and
+    who fired each bullet
+    Return: bytes
+    """
+    data = snapshot.encode(world)
+    shooters = [(bullet.row, player.id) for bullet, player in world.shooters.items()]
+    parts = [STATE_HEADER.pack(len(data), world.waves, len(world.players), len(shooters)), data]
+    for player in world.players.values():
+        respawn_tick = NO_RESPAWN if player.respawn_tick is None else player.respawn_tick
+        parts.append(PLAYER.pack(player.id, player.ship.row, player.score, player.deaths, respawn_tick,
+                                 player.controls, *player.view))
+    for row, player_id in shooters:
+        parts.append(SHOOTER.pack(row, player_id))
+    return b"".join(parts)
+
+
+def load_state(world, data):
+    """
+    Puts a SharedWorld back into a state from save_state. The world must
+    have the same players as the one that was saved.
+    """
+    size, waves, player_count, shooter_count = STATE_HEADER.unpack_from(data)
+    offset = STATE_HEADER.size
+    view = memoryview(data)
+    snapshot.decode_into(world, view[offset:offset + size])
+    offset += size
+
+    #the ships were handed out again by row, so every player looks theirs up
+    owners = world.store.owners
+    world.idle_ship = world.ship
+    end = offset + player_count * PLAYER.size
+    for player_id, row, score, deaths, respawn_tick, controls, view_x, view_y in \
+            PLAYER.iter_unpack(view[offset:end]):
+        player = world.players.get(player_id)
+        if player is None:
+            raise ValueError("state holds player {} who is not in this world".format(player_id))
+        player.ship = owners[row]
+        player.score = score
+        player.deaths = deaths
+        player.respawn_tick = None if respawn_tick == NO_RESPAWN else respawn_tick
+        player.controls = controls
+        player.fires = 0
+        player.view = (view_x, view_y)
+    offset = end
+    world.shooters = {owners[row]: world.players[player_id]
+                      for row, player_id in SHOOTER.iter_unpack(view[offset:offset + shooter_count * SHOOTER.size])}
+    world.waves = waves
+
+
+def checksum(world):
+    """
+    Returns a short hash of the whole state of a SharedWorld
+    Return: str
+    """
+    return hashlib.blake2b(save_state(world), digest_size=8).hexdigest()
+
+
+def new_world(seed):
+    """
+    Makes the world both peers start from
+    Return: SharedWorld
+    """
+    world = SharedWorld(seed)
+    for player_id in PEER_IDS:
+        world.join(player_id)
+    return world
+
+
+class RollbackSession():
+    """
+    One peer's side of a two player game. world is the present as far as this
+    peer knows it. Ticks before confirmed used the other peer's real inputs
+    and never change again; ticks from there on may be played again.
+    """
+    def __init__(self, seed, local_id, window=ROLLBACK_WINDOW, profiler=None):
+        """
+        :param local_id: which of PEER_IDS this peer controls
+        :param profiler: FrameProfiler timing the advance and rollback phases, none by default
+        """
+        if local_id not in PEER_IDS:
+            raise ValueError("unknown player {!r}, expected one of {}".format(local_id, PEER_IDS))
+        self.world = new_world(seed)
+        self.local = self.world.players[local_id]
+        self.remote = next(player for player_id, player in self.world.players.items() if player_id != local_id)
+        self.window = window
+        self.profiler = profiler if profiler is not None else NULL_PROFILER
+
+        #packed inputs by tick
+        self.local_inputs = {}
+        self.remote_inputs = {}
+        #remote input each tick was last played with, real or predicted
+        self.played = {}
+        #the other peer's inputs are known for every tick before this one
+        self.confirmed = 0
+        #the other peer has every local input before this tick
+        self.acked = 0
+        #inputs before this tick have been forgotten
+        self.forgotten = 0
+        #state from before tick t is kept in states[t % window]
+        self.states = [None] * window
+        #earliest tick played with a wrong prediction, None while they all hold
+        self.mispredicted = None
+
+        self.rollbacks = 0
+        self.replayed = 0
+        self.deepest = 0
+        self.stalls = 0
+
+    def can_advance(self):
+        """
+        Returns whether another tick may be played without getting more than
+        window ticks ahead of the other peer
+        """
+        return self.world.ticks - self.confirmed < self.window
+
+    def advance(self, controls, fires=0):
+        """
+        Plays the next tick with the local input, after any rollback still due
+        :param controls: CONTROL_* bits held during the tick
+        :param fires: bullets fired before the tick
+        Return: False when the session is too far ahead and has to wait for the other peer
+        """
+        self.rollback()
+        if not self.can_advance():
+            self.stalls += 1
+            return False
+        tick = self.world.ticks
+        self.local_inputs[tick] = pack_tick(controls, fires)
+        with self.profiler.phase("advance"):
+            self.play(tick)
+        return True
+
+    def predict(self, tick):
+        """
+        Returns the remote input for tick: the real one when it has arrived,
+        otherwise the last known controls held with no shots
+        Return: packed input
+        """
+        value = self.remote_inputs.get(tick)
+        if value is not None:
+            return value
+        controls, fires = unpack_tick(self.remote_inputs.get(self.confirmed - 1, 0))
+        return pack_tick(controls, 0)
+
+    def play(self, tick):
+        """
+        Saves the state and plays tick, which must be the world's next one
+        """
+        world = self.world
+        self.states[tick % self.window] = save_state(world)
+        remote = self.predict(tick)
+        self.played[tick] = remote
+        self.local.controls, self.local.fires = unpack_tick(self.local_inputs[tick])
+        self.remote.controls, self.remote.fires = unpack_tick(remote)
+        world.update()
+
+    def receive(self, data):
+        """
+        Takes in an INPUTS packet from the other peer, noting the earliest
+        tick that was played with a wrong prediction
+        """
+        first, ack, count = INPUTS.unpack_from(data)
+        values = data[INPUTS.size:INPUTS.size + count]
+        if len(values) != count:
+            return
+        self.acked = min(max(self.acked, ack), self.world.ticks)
+        for tick in range(max(first, self.confirmed), first + count):
+            if tick in self.remote_inputs:
+                continue
+            value = values[tick - first]
+            self.remote_inputs[tick] = value
+            played = self.played.get(tick)
+            if played is not None and played != value and (self.mispredicted is None or tick < self.mispredicted):
+                self.mispredicted = tick
+        while self.confirmed in self.remote_inputs:
+            self.confirmed += 1
+        self.forget()
+
+    def forget(self):
+        """
+        Drops the inputs no rollback or packet will need again
+        """
+        keep = min(self.confirmed - 1, self.acked)
+        if self.mispredicted is not None:
+            keep = min(keep, self.mispredicted)
+        while self.forgotten < keep:
+            self.local_inputs.pop(self.forgotten, None)
+            self.remote_inputs.pop(self.forgotten, None)
+            self.played.pop(self.forgotten, None)
+            self.forgotten += 1
+
+    def rollback(self):
+        """
+        Goes back to the earliest mispredicted tick, if there is one, and plays
+        forward to the present with the inputs known now
+        Return: number of ticks played again
+        """
+        tick = self.mispredicted
+        if tick is None:
+            return 0
+        self.mispredicted = None
+        present = self.world.ticks
+        with self.profiler.phase("rollback"):
+            load_state(self.world, self.states[tick % self.window])
+            for replayed in range(tick, present):
+                self.play(replayed)
+            #the sounds of these ticks were played the first time round
+            self.world.events.clear()
+        depth = present - tick
+        self.rollbacks += 1
+        self.replayed += depth
+        self.deepest = max(self.deepest, depth)
+        return depth
+
+    def outgoing(self):
+        """
+        Builds an INPUTS packet with the local inputs the other peer has not acknowledged
+        Return: bytes
+        """
+        first = self.acked
+        last = min(self.world.ticks, first + MAX_INPUTS_PER_PACKET)
+        values = bytes(self.local_inputs[tick] for tick in range(first, last))
+        return INPUTS.pack(first, self.confirmed, len(values)) + values
+
+    def stats(self):
+        """
+        Returns the rollback counters
+        Return: dict
+        """
+        return {"ticks": self.world.ticks, "confirmed": self.confirmed, "rollbacks": self.rollbacks,
+                "replayed": self.replayed, "deepest": self.deepest, "stalls": self.stalls}
+
+
+def bot_input(rng, controls):
+    """
+    Picks a test bot's input for a tick: it holds controls for a while and fires now and then
+    Return: (controls, fires)
+    """
+    if rng.random() < 0.1:
+        controls = rng.choice(BOT_CONTROLS)
+    return controls, 1 if rng.random() < 0.1 else 0
+
+
+def play_inputs(seed, inputs):
+    """
+    Plays both peers' inputs straight through, without any prediction
+    :param inputs: packed inputs per player, in the order of PEER_IDS
+    Return: checksum of the final state
+    """
+    world = new_world(seed)
+    players = [world.players[player_id] for player_id in PEER_IDS]
+    for values in zip(*inputs):
+        for player, value in zip(players, values):
+            player.controls, player.fires = unpack_tick(value)
+        world.update()
+    return checksum(world)
+
+
+class DelayLine():
+    """
+    Holds outgoing datagrams back to fake a slow network. Each one is sent
+    after latency plus up to jitter seconds, so they can arrive out of order,
+    and loss drops that fraction of them outright.
+    """
+    def __init__(self, sock, address, latency, jitter, loss, rng):
+        self.sock = sock
+        self.address = address
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng
+        self.queue = []
+        self.sequence = 0
+        self.dropped = 0
+
+    def send(self, data, now):
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        due = now + self.latency + self.rng.uniform(0, self.jitter)
+        heapq.heappush(self.queue, (due, self.sequence, data))
+        self.sequence += 1
+
+    def flush(self, now):
+        """
+        Sends every datagram whose delay is over
+        """
+        while self.queue and self.queue[0][0] <= now:
+            self.sock.sendto(heapq.heappop(self.queue)[2], self.address)
+
+
+def run_peer(local_id, sock, address, seed, ticks, window, latency, jitter, loss, results):
+    """
+    Process entry point: plays one side of a ticks long game against the peer
+    at address, with a bot at the controls, and puts its report on results
+    """
+    rng = random.Random(seed * 1000 + local_id)
+    sock.setblocking(False)
+    line = DelayLine(sock, address, latency, jitter, loss, rng)
+    profiler = FrameProfiler(window=int(ticks + PEER_TIMEOUT * TICKS_PER_SECOND))
+    session = RollbackSession(seed, local_id, window, profiler)
+    controls = 0
+    inputs = bytearray()
+
+    start = time.perf_counter()
+    next_frame = start
+    finished = None
+    while True:
+        now = time.perf_counter()
+        if now - start > ticks * TICK_TIME + PEER_TIMEOUT:
+            break
+        while True:
+            try:
+                data = sock.recv(2048)
+            except BlockingIOError:
+                break
+            session.receive(data)
+        session.rollback()
+        if session.world.ticks < ticks:
+            controls, fires = bot_input(rng, controls)
+            if session.advance(controls, fires):
+                inputs.append(pack_tick(controls, fires))
+            session.world.events.clear()
+        profiler.end_frame()
+        line.send(session.outgoing(), now)
+        line.flush(now)
+
+        if finished is None and session.world.ticks == ticks and session.confirmed >= ticks:
+            finished = now
+        if finished is not None and now - finished > LINGER:
+            break
+        next_frame += TICK_TIME
+        time.sleep(max(0.0, next_frame - time.perf_counter()))
+
+    session.rollback()
+    report = session.stats()
+    report.update(peer=local_id, checksum=checksum(session.world), inputs=bytes(inputs), dropped=line.dropped,
+                  rollback=profiler.stats("rollback"), advance=profiler.stats("advance"))
+    results.put(report)
+
+
+def run_pair(seed, ticks, window=ROLLBACK_WINDOW, latency=DEFAULT_LATENCY_MS / 1000, jitter=DEFAULT_JITTER_MS / 1000,
+             loss=0.0):
+    """
+    Plays a game between two peer processes on loopback, each sending through
+    a DelayLine with the given latency, jitter and loss
+    Return: (reports of both peers in the order of PEER_IDS, checksum of playing their inputs straight through)
+    """
+    sockets = []
+    for player_id in PEER_IDS:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("127.0.0.1", 0))
+        sockets.append(sock)
+    addresses = [sock.getsockname() for sock in sockets]
+    results = multiprocessing.Queue()
+    processes = []
+    for index, player_id in enumerate(PEER_IDS):
+        process = multiprocessing.Process(target=run_peer, args=(
+            player_id, sockets[index], addresses[1 - index], seed, ticks, window, latency, jitter, loss, results))
+        process.start()
+        processes.append(process)
+
+    reports = []
+    try:
+        for process in processes:
+            reports.append(results.get(timeout=ticks * TICK_TIME + 2 * PEER_TIMEOUT))
+    except queue.Empty:
+        pass
+    for process in processes:
+        process.join()
+    for sock in sockets:
+        sock.close()
+    if len(reports) < len(PEER_IDS):
+        raise RuntimeError("a peer process did not report back")
+    reports.sort(key=lambda report: report["peer"])
+    return reports, play_inputs(seed, [report["inputs"] for report in reports])
+
+
+def measure_rollback(seed, ticks, window=ROLLBACK_WINDOW):
+    """
+    Plays a bot game in this process with every input known in time, but
+    after every tick rolls back the full window as though its oldest
+    prediction had been wrong. Replaying the same inputs must land on the same
+    state, so each rollback is also checked against the state before it.
+    Return: dict of the rollback times and the number of rollbacks that changed the state
+    """
+    profiler = FrameProfiler(window=ticks)
+    session = RollbackSession(seed, PEER_IDS[0], window, profiler)
+    rng = random.Random(seed)
+    local = remote = 0
+    diverged = 0
+    for tick in range(ticks):
+        local, local_fires = bot_input(rng, local)
+        remote, remote_fires = bot_input(rng, remote)
+        session.receive(INPUTS.pack(tick, 0, 1) + bytes([pack_tick(remote, remote_fires)]))
+        session.advance(local, local_fires)
+        session.world.events.clear()
+        if session.world.ticks >= window:
+            before = checksum(session.world)
+            session.mispredicted = session.world.ticks - window
+            session.rollback()
+            diverged += checksum(session.world) != before
+        profiler.end_frame()
+    return {"ticks": ticks, "window": window, "entities": session.world.store.count,
+            "rollback": profiler.stats("rollback"), "advance": profiler.stats("advance"), "diverged": diverged}
+
+
+def format_peer(report):
+    return ("peer {peer}: {ticks} ticks  rollbacks {rollbacks}  ticks replayed {replayed} (deepest {deepest})  "
+            "stalls {stalls}  packets dropped {dropped}  rollback frame p99 {p99:.2f} ms max {max:.2f} ms  "
+            "state {checksum}").format(p99=report["rollback"]["p99_ms"], max=report["rollback"]["max_ms"], **report)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Test rollback netcode between two local peer processes")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the game")
+    parser.add_argument("--window", type=int, default=ROLLBACK_WINDOW, help="deepest rollback in ticks")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY_MS, help="one way delay in ms")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER_MS, help="extra random delay in ms")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets each peer drops")
+    parser.add_argument("--measure", action="store_true",
+                        help="time a full window rollback every tick in this process instead")
+    args = parser.parse_args(argv)
+
+    ticks = int(args.seconds * TICKS_PER_SECOND)
+    if args.measure:
+        result = measure_rollback(args.seed, ticks, args.window)
+        print("{ticks} ticks, {entities} entities at the end: {window} tick rollback p50 {p50:.2f} ms  "
+              "p99 {p99:.2f} ms  max {max:.2f} ms  (one tick p50 {tick:.2f} ms)  {diverged} diverged".format(
+                  p50=result["rollback"]["p50_ms"], p99=result["rollback"]["p99_ms"],
+                  max=result["rollback"]["max_ms"], tick=result["advance"]["p50_ms"], **result), file=sys.stderr)
+        if result["diverged"]:
+            sys.exit(1)
+        return
+
+    reports, expected = run_pair(args.seed, ticks, args.window, args.latency / 1000, args.jitter / 1000, args.loss)
+    for report in reports:
+        print(format_peer(report), file=sys.stderr)
+    synced = all(report["checksum"] == expected and report["ticks"] == ticks for report in reports)
+    print("peers {} the straight replay of their inputs ({})".format("match" if synced else "DO NOT match", expected),
+          file=sys.stderr)
+    if not synced:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,513 @@
+"""
+File: rooms.py
+Hosts many independent asteroids matches on a pool of worker processes.
+
+A Room is one match: a headless World played by one of the batch.py bot
+policies. Each worker process steps every room it hosts once per tick, timing
+each one, and reports back the time a tick took and what each room cost. The
+RoomScheduler in the main process places new rooms on the worker with the
+most headroom. When a worker keeps going over its tick budget, the scheduler
+migrates some of its rooms to workers with room to spare: the source sends
+out a snapshot of the room and the target carries on from it, so the match
+plays out exactly as if it had never moved.
+
+    python rooms.py --workers 4 --rooms 400 --seconds 20
+    python rooms.py --workers 2 --rooms 100 --skew 0.8   # start lopsided to watch rooms migrate
+"""
+import argparse
+import hashlib
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+from collections import deque
+from multiprocessing.connection import wait
+
+import snapshot
+
+from asteroidsFinal import TICK_TIME, FixedStepClock, World
+from batch import DEFAULT_TICKS, OUTCOMES, POLICIES
+
+# share of a tick a worker may spend stepping its rooms
+TICK_BUDGET = 0.8 * TICK_TIME
+
+# placement fills a worker up to this share of the budget, and migration
+# moves rooms off a worker until it is back under it
+PLACEMENT_HEADROOM = 0.75
+
+# cost of a room nobody has measured yet, in seconds per tick
+DEFAULT_ROOM_COST = 0.0002
+
+# weight of the newest tick in a room's smoothed cost
+COST_SMOOTHING = 0.05
+
+# ticks between worker reports
+REPORT_TICKS = 30
+
+# reports in a row over budget before a worker sheds rooms
+HOT_REPORTS = 2
+
+# seconds between scheduler passes, and rooms opened per pass at most
+SCHEDULER_INTERVAL = 0.05
+OPENS_PER_PASS = 20
+
+# seconds between the progress lines main() prints
+REPORT_INTERVAL = 2.0
+
+
+class Room():
+    """
+    A match hosted by a worker: a World and the bot policy playing it. cost
+    is the smoothed time a tick of this room takes, in seconds.
+    """
+    def __init__(self, room_id, seed, policy="aim", max_ticks=DEFAULT_TICKS):
+        if policy not in POLICIES:
+            raise ValueError("unknown policy {!r}, expected one of {}".format(policy, tuple(POLICIES)))
+        self.id = room_id
+        self.seed = seed
+        self.policy = policy
+        self.max_ticks = max_ticks
+        self.world = World(seed)
+        self.rng = random.Random(seed)
+        self.cost = DEFAULT_ROOM_COST
+        self.moves = 0
+
+    def step(self):
+        """
+        Plays one tick with the policy's input
+        """
+        controls, fire = POLICIES[self.policy](self.world, self.rng)
+        self.world.step(controls, fire)
+        self.world.events.clear()
+
+    def outcome(self):
+        """
+        Returns the index into OUTCOMES of how the match ended, or None while it is still going
+        """
+        if not self.world.ship.alive:
+            return 1
+        if not self.world.asteroids:
+            return 2
+        if self.world.ticks >= self.max_ticks:
+            return 0
+        return None
+
+    def export(self):
+        """
+        Packs everything needed to carry on the match elsewhere
+        Return: dict
+        """
+        return {"id": self.id, "seed": self.seed, "policy": self.policy, "max_ticks": self.max_ticks,
+                "world": snapshot.encode(self.world), "rng": self.rng.getstate(), "cost": self.cost,
+                "moves": self.moves}
+
+    @classmethod
+    def restore(cls, state):
+        """
+        Rebuilds a room from export()
+        Return: Room
+        """
+        room = cls.__new__(cls)
+        room.id = state["id"]
+        room.seed = state["seed"]
+        room.policy = state["policy"]
+        room.max_ticks = state["max_ticks"]
+        room.world = snapshot.decode(state["world"])
+        room.rng = random.Random()
+        room.rng.setstate(state["rng"])
+        room.cost = state["cost"]
+        room.moves = state["moves"] + 1
+        return room
+
+    def result(self, outcome=None):
+        """
+        Returns how far the match got and a checksum of its state
+        Return: dict
+        """
+        return {"room": self.id, "seed": self.seed, "policy": self.policy, "max_ticks": self.max_ticks,
+                "ticks": self.world.ticks, "score": self.world.score, "moves": self.moves,
+                "outcome": "stopped" if outcome is None else OUTCOMES[outcome],
+                "checksum": hashlib.blake2b(snapshot.encode(self.world), digest_size=8).hexdigest()}
+
+
+def run_worker(worker_id, connection, tick_time=TICK_TIME, budget=TICK_BUDGET):
+    """
+    Worker process entry point: steps its rooms every tick and answers the
+    scheduler's messages until told to stop
+    """
+    rooms = {}
+    clock = FixedStepClock(tick_time)
+    busy = deque(maxlen=REPORT_TICKS)
+    overruns = 0
+    late = 0
+    ticks = 0
+    last = time.perf_counter()
+    while True:
+        while connection.poll():
+            message = connection.recv()
+            kind = message[0]
+            if kind == "open":
+                room = Room(*message[1:])
+                rooms[room.id] = room
+            elif kind == "import":
+                room = Room.restore(message[1])
+                rooms[room.id] = room
+            elif kind == "export":
+                room = rooms.pop(message[1], None)
+                if room is not None:
+                    connection.send(("exported", worker_id, room.export()))
+            elif kind == "close":
+                room = rooms.pop(message[1], None)
+                if room is not None:
+                    connection.send(("closed", worker_id, room.result()))
+            elif kind == "stop":
+                connection.send(("stopped", worker_id, [room.result() for room in rooms.values()]))
+                return
+
+        now = time.perf_counter()
+        due = clock.advance(now - last)
+        last = now
+        if due > 1:
+            late += due - 1
+        for tick in range(due):
+            start = time.perf_counter()
+            finished = []
+            for room in rooms.values():
+                before = time.perf_counter()
+                room.step()
+                room.cost += (time.perf_counter() - before - room.cost) * COST_SMOOTHING
+                outcome = room.outcome()
+                if outcome is not None:
+                    finished.append((room, outcome))
+            for room, outcome in finished:
+                del rooms[room.id]
+                connection.send(("closed", worker_id, room.result(outcome)))
+            elapsed = time.perf_counter() - start
+            busy.append(elapsed)
+            if elapsed > budget:
+                overruns += 1
+            ticks += 1
+            if ticks % REPORT_TICKS == 0:
+                samples = sorted(busy)
+                connection.send(("report", worker_id, {
+                    "ticks": ticks, "rooms": len(rooms),
+                    "entities": sum(room.world.store.count for room in rooms.values()),
+                    "busy_p50": samples[len(samples) // 2], "busy_max": samples[-1],
+                    "overruns": overruns, "late": late,
+                    "costs": {room.id: room.cost for room in rooms.values()}}))
+                overruns = 0
+                late = 0
+        time.sleep(max(0.0, tick_time - clock.accumulator))
+
+
+class WorkerHandle():
+    """
+    The scheduler's view of one worker: its rooms with their last known cost
+    and its last report
+    """
+    def __init__(self, worker_id, process, connection):
+        self.id = worker_id
+        self.process = process
+        self.connection = connection
+        self.rooms = {}
+        self.report = None
+        self.hot = 0
+
+    def load(self):
+        """
+        Returns the time a tick of this worker's rooms should take, in seconds
+        """
+        return sum(self.rooms.values())
+
+
+class RoomScheduler():
+    """
+    Places rooms on worker processes by load, watches each worker's tick
+    time against the budget and migrates rooms off workers that keep going
+    over it
+    """
+    def __init__(self, workers=None, budget=TICK_BUDGET, tick_time=TICK_TIME):
+        self.budget = budget
+        self.workers = []
+        for worker_id in range(workers or os.cpu_count()):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=run_worker, args=(worker_id, child, tick_time, budget),
+                                              daemon=True)
+            process.start()
+            self.workers.append(WorkerHandle(worker_id, process, parent))
+        #room id -> worker hosting it
+        self.placement = {}
+        #room id -> worker it is on its way to
+        self.moving = {}
+        self.results = []
+        self.next_id = 0
+        self.migrations = 0
+        self.rejected = 0
+
+    def room_cost(self):
+        """
+        Returns the cost to expect of a new room: the mean of the measured ones
+        """
+        costs = [cost for worker in self.workers for cost in worker.rooms.values()]
+        return sum(costs) / len(costs) if costs else DEFAULT_ROOM_COST
+
+    def roomiest(self, cost, exclude=None):
+        """
+        Returns the least loaded worker that can take a room of cost within its headroom
+        Return: WorkerHandle or None
+        """
+        limit = self.budget * PLACEMENT_HEADROOM
+        best = None
+        for worker in self.workers:
+            if worker is exclude or worker.load() + cost > limit:
+                continue
+            if best is None or worker.load() < best.load():
+                best = worker
+        return best
+
+    def open_room(self, seed, policy="aim", max_ticks=DEFAULT_TICKS, worker=None):
+        """
+        Starts a match on the worker with the most headroom, or on worker when given
+        Return: the room id, or None when every worker is full
+        """
+        cost = self.room_cost()
+        if worker is None:
+            worker = self.roomiest(cost)
+            if worker is None:
+                self.rejected += 1
+                return None
+        room_id = self.next_id
+        self.next_id += 1
+        worker.connection.send(("open", room_id, seed, policy, max_ticks))
+        worker.rooms[room_id] = cost
+        self.placement[room_id] = worker
+        return room_id
+
+    def close_room(self, room_id):
+        """
+        Ends a match early; its result arrives with the next poll()
+        """
+        worker = self.placement.get(room_id)
+        if worker is not None:
+            worker.connection.send(("close", room_id))
+
+    def poll(self, timeout=0.0):
+        """
+        Handles every message the workers have sent
+        """
+        connections = {worker.connection: worker for worker in self.workers}
+        for connection in wait(list(connections), timeout):
+            while connection.poll():
+                kind, worker_id, body = connection.recv()
+                worker = connections[connection]
+                if kind == "report":
+                    self.take_report(worker, body)
+                elif kind == "exported":
+                    self.arrive(body)
+                elif kind == "closed":
+                    self.finish(body)
+
+    def take_report(self, worker, report):
+        worker.report = report
+        for room_id, cost in report["costs"].items():
+            if room_id in worker.rooms:
+                worker.rooms[room_id] = cost
+        worker.hot = worker.hot + 1 if report["busy_p50"] > self.budget or report["overruns"] else 0
+
+    def arrive(self, state):
+        """
+        Hands a room that left its old worker to the one it is moving to
+        """
+        room_id = state["id"]
+        target = self.moving.pop(room_id)
+        target.connection.send(("import", state))
+        target.rooms[room_id] = state["cost"]
+        self.placement[room_id] = target
+        self.migrations += 1
+
+    def finish(self, result):
+        room_id = result["room"]
+        worker = self.placement.pop(room_id, None)
+        if worker is not None:
+            worker.rooms.pop(room_id, None)
+        target = self.moving.pop(room_id, None)
+        if target is not None:
+            #it ended before its export, so the target never gets it
+            target.rooms.pop(room_id, None)
+        self.results.append(result)
+
+    def rebalance(self):
+        """
+        Moves rooms off every worker that has been over budget for HOT_REPORTS
+        reports, most expensive first, until its load is back under the headroom
+        Return: number of migrations started
+        """
+        started = 0
+        limit = self.budget * PLACEMENT_HEADROOM
+        for worker in self.workers:
+            if worker.hot < HOT_REPORTS:
+                continue
+            worker.hot = 0
+            #a worker can be slower than its measured rooms add up to, so aim under what it really took
+            excess = worker.load() - limit * min(1.0, self.budget / max(worker.report["busy_p50"], 1e-9))
+            for room_id, cost in sorted(worker.rooms.items(), key=lambda item: -item[1]):
+                if excess <= 0:
+                    break
+                if room_id in self.moving:
+                    continue
+                target = self.roomiest(cost, exclude=worker)
+                if target is None:
+                    break
+                worker.connection.send(("export", room_id))
+                del worker.rooms[room_id]
+                #count the room against the target now so later moves see it
+                target.rooms[room_id] = cost
+                self.moving[room_id] = target
+                excess -= cost
+                started += 1
+        return started
+
+    def stop(self):
+        """
+        Stops every worker, collecting the state of the rooms still running
+        Return: list of result dicts of every room, finished or stopped
+        """
+        for worker in self.workers:
+            worker.connection.send(("stop",))
+        for worker in self.workers:
+            while True:
+                kind, worker_id, body = worker.connection.recv()
+                if kind == "stopped":
+                    self.results.extend(body)
+                    break
+                if kind == "exported":
+                    #it was moving to a worker that is stopping too
+                    self.moving.pop(body["id"], None)
+                    self.results.append(Room.restore(body).result())
+                elif kind == "closed":
+                    self.finish(body)
+            worker.process.join()
+        return self.results
+
+    def summary(self):
+        """
+        Returns the rooms, load and last tick times of every worker
+        Return: list of dicts
+        """
+        rows = []
+        for worker in self.workers:
+            report = worker.report or {}
+            rows.append({"worker": worker.id, "rooms": len(worker.rooms), "load_ms": worker.load() * 1000,
+                         "busy_p50_ms": report.get("busy_p50", 0.0) * 1000,
+                         "busy_max_ms": report.get("busy_max", 0.0) * 1000,
+                         "overruns": report.get("overruns", 0), "late": report.get("late", 0)})
+        return rows
+
+
+def check_finish_while_moving(budget=TICK_BUDGET, timeout=10.0):
+    """
+    Lets a room finish on its worker, then has the scheduler start moving it
+    before it hears of that, and checks the finished room is then forgotten
+    by both workers instead of still loading the one it was moving to
+    Return: True when it is
+    """
+    scheduler = RoomScheduler(2, budget)
+    source, target = scheduler.workers
+    room_id = scheduler.open_room(0, max_ticks=1, worker=source)
+    #the room ends after a tick, while the scheduler is not polling
+    time.sleep(0.5)
+    source.rooms[room_id] = budget * PLACEMENT_HEADROOM
+    source.report = {"busy_p50": budget * 2}
+    source.hot = HOT_REPORTS
+    started = scheduler.rebalance()
+    deadline = time.perf_counter() + timeout
+    while not scheduler.results and time.perf_counter() < deadline:
+        scheduler.poll(SCHEDULER_INTERVAL)
+    scheduler.stop()
+    return started == 1 and len(scheduler.results) == 1 and not scheduler.moving and \
+        room_id not in source.rooms and room_id not in target.rooms
+
+
+def replay_room(result):
+    """
+    Plays a room's match again in this process, for as many ticks as it got,
+    without ever moving it
+    Return: checksum of the final state
+    """
+    room = Room(result["room"], result["seed"], result["policy"], result["max_ticks"])
+    while room.world.ticks < result["ticks"]:
+        room.step()
+    return room.result()["checksum"]
+
+
+def run_node(workers, rooms, seconds, seed=0, policy="aim", max_ticks=DEFAULT_TICKS, budget=TICK_BUDGET, skew=0.0,
+             output=sys.stderr):
+    """
+    Keeps rooms matches going across workers for seconds, opening a new one
+    whenever one ends. skew is the share of rooms opened straight on worker 0
+    whatever its load, to give the scheduler something to rebalance.
+    Return: (scheduler, list of room results)
+    """
+    scheduler = RoomScheduler(workers, budget)
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    next_report = start + REPORT_INTERVAL
+    while time.perf_counter() - start < seconds:
+        scheduler.poll(SCHEDULER_INTERVAL)
+        for i in range(min(OPENS_PER_PASS, rooms - len(scheduler.placement))):
+            worker = scheduler.workers[0] if rng.random() < skew else None
+            if scheduler.open_room(seed + scheduler.next_id, policy, max_ticks, worker) is None:
+                break
+        scheduler.rebalance()
+        if time.perf_counter() >= next_report:
+            next_report += REPORT_INTERVAL
+            print(format_summary(scheduler), file=output)
+    return scheduler, scheduler.stop()
+
+
+def format_summary(scheduler):
+    workers = "  ".join("w{worker}: {rooms} rooms busy {busy_p50_ms:.1f}/{busy_max_ms:.1f} ms".format(**row)
+                        for row in scheduler.summary())
+    return "{}  | {} done  {} migrations  {} rejected".format(workers, len(scheduler.results),
+                                                              scheduler.migrations, scheduler.rejected)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Host many headless asteroids matches across worker processes")
+    parser.add_argument("--workers", type=int, help="worker processes, one per core by default")
+    parser.add_argument("--rooms", type=int, default=200, help="matches to keep going at once")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first room")
+    parser.add_argument("--policy", default="aim", choices=list(POLICIES))
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS, help="longest a match may run")
+    parser.add_argument("--budget", type=float, default=TICK_BUDGET * 1000, help="tick budget per worker in ms")
+    parser.add_argument("--skew", type=float, default=0.0,
+                        help="share of rooms opened on worker 0 regardless of its load")
+    parser.add_argument("--verify", type=int, default=20,
+                        help="migrated rooms to play again in this process and compare")
+    args = parser.parse_args(argv)
+
+    scheduler, results = run_node(args.workers, args.rooms, args.seconds, args.seed, args.policy, args.ticks,
+                                  args.budget / 1000, args.skew)
+    print(format_summary(scheduler), file=sys.stderr)
+    costs = [row["load_ms"] / row["rooms"] for row in scheduler.summary() if row["rooms"]]
+    if costs:
+        per_room = sum(costs) / len(costs)
+        print("mean room tick {:.3f} ms: about {:.0f} rooms per worker within a {:.1f} ms budget".format(
+            per_room, args.budget * PLACEMENT_HEADROOM / per_room, args.budget), file=sys.stderr)
+
+    migrated = [result for result in results if result["moves"]]
+    mismatched = sum(replay_room(result) != result["checksum"] for result in migrated[:args.verify])
+    print("{} rooms played, {} migrated; {} of {} migrated rooms checked differ from an unmoved replay".format(
+        len(results), len(migrated), mismatched, min(len(migrated), args.verify)), file=sys.stderr)
+    if mismatched:
+        sys.exit(1)
+    if args.verify and not check_finish_while_moving(args.budget / 1000):
+        print("a room that ended while moving is still counted on a worker", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
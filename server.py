@@ -0,0 +1,849 @@
+"""
+File: server.py
+Authoritative multiplayer asteroids server over UDP, run on asyncio.
+
+Every player flies a ship in one shared field, a SharedWorld. Each tick a
+client sends an INPUT packet with its held CONTROL_* bits, the shots fired
+since its last packet and the newest server tick it has received. The
+server steps the world at TICKS_PER_SECOND and sends each client a STATE
+packet. A STATE packet holds only the entities in the regions around that
+client's ship, and it is delta compressed against the last state the client
+acknowledged:
+- positions and angles are quantized to 16 bits;
+- entities the client has not seen are sent in full;
+- entities that moved send only the fields that changed, as signed bytes
+  when the change is small enough;
+- entities that are gone or out of view are listed by id.
+
+NetClient is the client half. It knows nothing about sockets, so Game
+(python asteroidsFinal.py --connect HOST:PORT) and the LoopbackClient bots
+used for load testing share it.
+
+    python server.py --port 7777                        # serve real players
+    python server.py --clients 32 --seconds 10 --loss 0.05  # loopback load test
+"""
+import argparse
+import asyncio
+import math
+import random
+import socket
+import struct
+import sys
+import time
+
+import numpy as np
+
+from asteroidsFinal import (CONTROL_BRAKE, CONTROL_LEFT, CONTROL_RIGHT, CONTROL_THRUST, INITIAL_ROCK_COUNT,
+                            SCREEN_HEIGHT, SCREEN_WIDTH, TICK_TIME, TICKS_PER_SECOND, LargeRock,
+                            Ship, World)
+from profiler import FrameProfiler
+
+DEFAULT_PORT = 7777
+PROTOCOL_VERSION = 1
+
+PACKET_JOIN = 1
+PACKET_INPUT = 2
+PACKET_LEAVE = 3
+PACKET_WELCOME = 4
+PACKET_STATE = 5
+
+# type, protocol version
+JOIN = struct.Struct("<BH")
+# type, input sequence, newest server tick received, controls, shots fired
+INPUT = struct.Struct("<BIIBB")
+# type
+LEAVE = struct.Struct("<B")
+# type, protocol version, player id, ticks per second
+WELCOME = struct.Struct("<BHIH")
+# type, tick, baseline tick, own ship id, own score, removed entities, new entities
+STATE_HEADER = struct.Struct("<BIIIIII")
+
+# baseline tick of a full state, and ship id of a player waiting to respawn
+NO_TICK = 0xFFFFFFFF
+
+# bits of the mask byte sent for a changed entity, one per column of a
+# state's values; FIELD_SMALL sends the changed ones as signed byte deltas
+FIELD_X = 1
+FIELD_Y = 2
+FIELD_ANGLE = 4
+FIELD_DX = 8
+FIELD_DY = 16
+FIELD_SPIN = 32
+FIELD_SMALL = 128
+FIELD_BITS = (FIELD_X, FIELD_Y, FIELD_ANGLE, FIELD_DX, FIELD_DY, FIELD_SPIN)
+
+# quantization: positions and velocities to 1/16 pixel, angles and spin to 65536 steps per turn
+POSITION_SCALE = 16
+ANGLE_SCALE = 65536 / 360
+ANGLE_STEPS = 65536
+VELOCITY_LIMIT = 32767
+
+# every field is sent in full as 16 bits; x, y and angle wrap around these
+# ranges and dx, dy and spin (the next three columns) are how far they move per tick
+WRAP_SIZES = np.array([SCREEN_WIDTH * POSITION_SCALE, SCREEN_HEIGHT * POSITION_SCALE, ANGLE_STEPS])
+WRAPPED_FIELDS = len(WRAP_SIZES)
+FIELD_WEIGHTS = np.array(FIELD_BITS)
+
+# bytes per entity of a STATE packet sent without deltas (id, kind and every field)
+FULL_ENTITY_BYTES = 4 + 1 + 2 * len(FIELD_BITS)
+
+# interest management: the field is cut into square regions and a client
+# hears about every region within INTEREST_RADIUS of its ship
+INTEREST_REGION = 100
+INTEREST_RADIUS = 250
+
+# ticks of sent state kept per client as delta baselines
+STATE_HISTORY = TICKS_PER_SECOND
+
+# seconds without a packet before a client is dropped
+CLIENT_TIMEOUT = 5.0
+
+RESPAWN_TICKS = 2 * TICKS_PER_SECOND
+
+# seconds between load reports
+REPORT_INTERVAL = 5.0
+
+
+def interest_table(width=SCREEN_WIDTH, height=SCREEN_HEIGHT, region=INTEREST_REGION, radius=INTEREST_RADIUS):
+    """
+    Works out which regions can see which, across the screen edges too
+    Return: (columns, boolean array where [a, b] says region a sees region b)
+    """
+    columns = math.ceil(width / region)
+    rows = math.ceil(height / region)
+    column, row = np.divmod(np.arange(columns * rows), columns)[::-1]
+    gap_x = np.abs(column[:, None] - column[None, :])
+    gap_y = np.abs(row[:, None] - row[None, :])
+    gap_x = np.maximum(np.minimum(gap_x, columns - gap_x) - 1, 0) * region
+    gap_y = np.maximum(np.minimum(gap_y, rows - gap_y) - 1, 0) * region
+    return columns, gap_x * gap_x + gap_y * gap_y <= radius * radius
+
+
+REGION_COLUMNS, VISIBLE_REGIONS = interest_table()
+
+
+def region_of(x, y):
+    """
+    Returns the interest region index of a position, or an array of them
+    """
+    column = np.floor_divide(np.mod(x, SCREEN_WIDTH), INTEREST_REGION).astype(np.intp)
+    row = np.floor_divide(np.mod(y, SCREEN_HEIGHT), INTEREST_REGION).astype(np.intp)
+    return row * REGION_COLUMNS + column
+
+
+class Player():
+    """
+    A ship in a SharedWorld and the input its client last sent
+    """
+    def __init__(self, player_id, ship):
+        self.id = player_id
+        self.ship = ship
+        self.controls = 0
+        self.fires = 0
+        self.score = 0
+        self.deaths = 0
+        self.respawn_tick = None
+        #where the player looks from, kept while the ship is waiting to respawn
+        self.view = (ship.x, ship.y)
+
+
+class SharedWorld(World):
+    """
+    A World where any number of players fly their own ship. Each player is
+    steered with the same check_keys and fire as the single player ship, a
+    shot scores for the player who fired it, and dead ships come back after
+    RESPAWN_TICKS. A new wave of large rocks arrives once the field is clear.
+    The shared field always uses the grid collision backend.
+    """
+    def __init__(self, seed=None, profiler=None):
+        super().__init__(seed, profiler)
+        #World's own ship stays dead; every player gets a ship of their own
+        self.ship.alive = False
+        self.idle_ship = self.ship
+        self.players = {}
+        #bullet -> player who fired it
+        self.shooters = {}
+        self.waves = 1
+
+    def join(self, player_id):
+        """
+        Adds a player with a new ship somewhere on the field
+        Return: Player
+        """
+        ship = Ship(self.store)
+        self.place(ship)
+        player = Player(player_id, ship)
+        self.players[player_id] = player
+        return player
+
+    def leave(self, player_id):
+        """
+        Removes a player and their ship
+        """
+        player = self.players.pop(player_id)
+        self.store.discard(player.ship)
+
+    def place(self, ship):
+        """
+        Puts a ship at a random spot on the field
+        """
+        ship.x = self.rng.uniform(0, SCREEN_WIDTH)
+        ship.y = self.rng.uniform(0, SCREEN_HEIGHT)
+
+    def update(self):
+        """
+        Advances the world by one tick, steering every player's ship
+        """
+        profiler = self.profiler
+        self.store.save_previous()
+        self.ticks += 1
+        with profiler.phase("check_keys"):
+            for player in self.players.values():
+                self.steer(player)
+            self.ship = self.idle_ship
+
+        with profiler.phase("advance"):
+            self.store.step()
+
+        with profiler.phase("remove_notAliveObject"):
+            self.remove_notAliveObject()
+            shooters = self.shooters
+            self.shooters = {bullet: shooters[bullet] for bullet in self.bullets if bullet in shooters}
+        with profiler.phase("check_collisions"):
+            self.check_collisions()
+
+        with profiler.phase("ship_advance"):
+            for player in self.players.values():
+                if player.ship.alive:
+                    player.ship.advance()
+                    player.view = (player.ship.x, player.ship.y)
+            self.respawn()
+
+    def steer(self, player):
+        """
+        Fires the player's shots and applies their held controls to their ship
+        """
+        fires = player.fires
+        player.fires = 0
+        if not player.ship.alive:
+            return
+        self.ship = player.ship
+        self.controls = player.controls
+        for shot in range(fires):
+            bullet = self.fire()
+            if bullet is not None:
+                self.shooters[bullet] = player
+        self.check_keys()
+
+    def hit_asteroid(self, bullet, asteroid):
+        """
+        Breaks apart an asteroid and scores it for whoever fired the bullet
+        """
+        super().hit_asteroid(bullet, asteroid)
+        player = self.shooters.pop(bullet, None)
+        if player is not None:
+            player.score += 1
+
+    def check_collisions(self):
+        """
+        Checks bullets against asteroids, then every live ship against the
+        asteroids near it
+        """
+        self.check_collisions_grid()
+        for player in self.players.values():
+            ship = player.ship
+            if ship.alive and self.ship_hit(ship):
+                ship.alive = False
+                player.deaths += 1
+                player.respawn_tick = self.ticks + RESPAWN_TICKS
+
+    def collision_probes(self):
+        """
+        Returns where every live player ship is, so the grid gathers the rocks near each
+        Return: list of (x, y)
+        """
+        return [(player.ship.x, player.ship.y) for player in self.players.values() if player.ship.alive]
+
+    def ship_hit(self, ship):
+        """
+        Returns whether ship overlaps a live asteroid among the ones the
+        bullet checks just found near a probe
+        """
+        return self.ship_overlaps(ship, self.nearby)
+
+    def respawn(self):
+        """
+        Brings back ships whose wait is over and sends a new wave once every rock is gone
+        """
+        for player in self.players.values():
+            if player.respawn_tick is not None and self.ticks >= player.respawn_tick:
+                player.respawn_tick = None
+                player.ship.reset()
+                self.place(player.ship)
+        if not self.asteroids:
+            self.waves += 1
+            for i in range(INITIAL_ROCK_COUNT + len(self.players) // 2):
+                self.asteroids.append(LargeRock(self.store, self.rng))
+
+
+def capture(world):
+    """
+    Quantizes every live entity of a world, sorted by id (its spawn order)
+    Return: tuple of (ids, kinds, values, regions); values holds x, y, angle, dx, dy and spin per row
+    """
+    store = world.store
+    n = store.count
+    rows = np.flatnonzero(store.alive[:n])
+    ids = store.order[rows].astype(np.uint32)
+    by_id = np.argsort(ids, kind="stable")
+    ids = ids[by_id]
+    rows = rows[by_id]
+    x = np.mod(store.x[rows], SCREEN_WIDTH)
+    y = np.mod(store.y[rows], SCREEN_HEIGHT)
+    values = np.empty((len(rows), len(FIELD_BITS)), dtype=np.int32)
+    values[:, 0] = np.mod(np.rint(x * POSITION_SCALE), WRAP_SIZES[0])
+    values[:, 1] = np.mod(np.rint(y * POSITION_SCALE), WRAP_SIZES[1])
+    values[:, 2] = np.mod(np.rint(store.angle[rows] * ANGLE_SCALE), ANGLE_STEPS)
+    values[:, 3] = np.clip(np.rint(store.dx[rows] * POSITION_SCALE), -VELOCITY_LIMIT, VELOCITY_LIMIT)
+    values[:, 4] = np.clip(np.rint(store.dy[rows] * POSITION_SCALE), -VELOCITY_LIMIT, VELOCITY_LIMIT)
+    values[:, 5] = np.clip(np.rint(store.spin[rows] * ANGLE_SCALE), -VELOCITY_LIMIT, VELOCITY_LIMIT)
+    return ids, store.kind[rows].astype(np.uint8), values, region_of(x, y)
+
+
+EMPTY_STATE = (np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint8),
+               np.zeros((0, len(FIELD_BITS)), dtype=np.int32))
+
+
+def predict(values, ticks):
+    """
+    Moves quantized positions and angles on by their velocity and spin, the
+    way both ends guess where an entity is now from a baseline ticks old
+    Return: new values array
+    """
+    predicted = values.copy()
+    predicted[:, :WRAPPED_FIELDS] += values[:, WRAPPED_FIELDS:] * ticks
+    predicted[:, :WRAPPED_FIELDS] %= WRAP_SIZES
+    return predicted
+
+
+def encode_state(tick, baseline_tick, ship_id, score, state, baseline=EMPTY_STATE):
+    """
+    Packs a STATE packet carrying state as a delta from baseline, both
+    (ids, kinds, values) sorted by id. Known entities are compared with where
+    the baseline predicts them to be, so one moving in a straight line costs
+    nothing. The packet holds, in order: the ids removed since the baseline, a
+    bitmap over the baseline of the entities that changed, a mask byte per
+    changed entity, the changed fields of the small changes as signed bytes and
+    of the others as 16 bits, then the new entities in full.
+    Return: bytes
+    """
+    ids, kinds, values = state
+    base_ids, base_kinds, base_values = baseline
+    if len(base_ids):
+        position = np.minimum(np.searchsorted(base_ids, ids), len(base_ids) - 1)
+        known = (base_ids[position] == ids) & (base_kinds[position] == kinds)
+        kept = np.zeros(len(base_ids), dtype=bool)
+        kept[position[known]] = True
+        removed = base_ids[~kept]
+        deltas = values - predict(base_values[position], tick - baseline_tick)
+        #the shortest way round for the wrapping fields
+        deltas[:, :WRAPPED_FIELDS] += WRAP_SIZES // 2
+        deltas[:, :WRAPPED_FIELDS] %= WRAP_SIZES
+        deltas[:, :WRAPPED_FIELDS] -= WRAP_SIZES // 2
+    else:
+        position = np.zeros(len(ids), dtype=np.intp)
+        known = np.zeros(len(ids), dtype=bool)
+        removed = base_ids
+        deltas = np.zeros_like(values)
+
+    present = deltas != 0
+    changed = np.flatnonzero(known & present.any(axis=1))
+    present = present[changed]
+    deltas = deltas[changed]
+    small = np.abs(deltas).max(axis=1, initial=0) <= 127
+    masks = (present @ FIELD_WEIGHTS) | small * FIELD_SMALL
+    in_baseline = np.zeros(len(base_ids), dtype=bool)
+    in_baseline[position[changed]] = True
+    new = np.flatnonzero(~known)
+
+    return b"".join((
+        STATE_HEADER.pack(PACKET_STATE, tick, baseline_tick, ship_id, score, len(removed), len(new)),
+        removed.astype("<u4").tobytes(),
+        np.packbits(in_baseline).tobytes(),
+        masks.astype(np.uint8).tobytes(),
+        deltas[small][present[small]].astype(np.int8).tobytes(),
+        values[changed[~small]][present[~small]].astype("<u2").tobytes(),
+        ids[new].astype("<u4").tobytes(),
+        kinds[new].tobytes(),
+        values[new].astype("<u2").tobytes(),
+    ))
+
+
+def widen_fields(raw, columns):
+    """
+    Widens 16 bit fields read from a packet, treating those of the dx, dy
+    and spin columns as signed
+    Return: int32 array
+    """
+    values = raw.astype(np.int32)
+    values -= ((columns >= WRAPPED_FIELDS) & (values >= 32768)) * 65536
+    return values
+
+
+def decode_state(data, baseline=EMPTY_STATE):
+    """
+    Unpacks a STATE packet on top of the baseline it was encoded against
+    Return: tuple of (tick, ship id, score, state)
+    """
+    kind, tick, baseline_tick, ship_id, score, removed_count, new_count = STATE_HEADER.unpack_from(data)
+    offset = STATE_HEADER.size
+    removed = np.frombuffer(data, dtype="<u4", count=removed_count, offset=offset)
+    offset += removed.nbytes
+
+    ids, kinds, values = baseline
+    values = predict(values, tick - baseline_tick if baseline_tick != NO_TICK else 0)
+    bitmap = np.frombuffer(data, dtype=np.uint8, count=(len(ids) + 7) // 8, offset=offset)
+    offset += bitmap.nbytes
+    position = np.flatnonzero(np.unpackbits(bitmap, count=len(ids)))
+    masks = np.frombuffer(data, dtype=np.uint8, count=len(position), offset=offset)
+    offset += masks.nbytes
+    present = np.unpackbits(masks[:, None], axis=1, count=len(FIELD_BITS), bitorder="little").astype(bool)
+    small = (masks & FIELD_SMALL) != 0
+    small_present = present & small[:, None]
+    wide_present = present & ~small[:, None]
+
+    changed = values[position]
+    count = int(small_present.sum())
+    changed[small_present] += np.frombuffer(data, dtype=np.int8, count=count, offset=offset)
+    offset += count
+    count = int(wide_present.sum())
+    raw = np.frombuffer(data, dtype="<u2", count=count, offset=offset)
+    offset += raw.nbytes
+    changed[wide_present] = widen_fields(raw, np.nonzero(wide_present)[1])
+    values[position] = changed
+    values[:, :WRAPPED_FIELDS] %= WRAP_SIZES
+
+    if removed_count:
+        keep = ~np.isin(ids, removed, assume_unique=True)
+        ids, kinds, values = ids[keep], kinds[keep], values[keep]
+    if new_count:
+        new_ids = np.frombuffer(data, dtype="<u4", count=new_count, offset=offset)
+        offset += new_ids.nbytes
+        new_kinds = np.frombuffer(data, dtype=np.uint8, count=new_count, offset=offset)
+        offset += new_kinds.nbytes
+        raw = np.frombuffer(data, dtype="<u2", count=new_count * len(FIELD_BITS), offset=offset)
+        new_values = widen_fields(raw.reshape(new_count, len(FIELD_BITS)), np.arange(len(FIELD_BITS)))
+        ids = np.concatenate((ids, new_ids))
+        kinds = np.concatenate((kinds, new_kinds))
+        values = np.concatenate((values, new_values))
+        by_id = np.argsort(ids, kind="stable")
+        ids, kinds, values = ids[by_id], kinds[by_id], values[by_id]
+    return tick, ship_id, score, (ids, kinds, values)
+
+
+class Connection():
+    """
+    The server side of one client: its player, what it has acknowledged and
+    what it has been sent
+    """
+    def __init__(self, address, player, now):
+        self.address = address
+        self.player = player
+        self.sequence = 0
+        self.acked = NO_TICK
+        #tick -> (ids, kinds, values) sent that tick
+        self.sent = {}
+        self.joined = now
+        self.last_heard = now
+        self.bytes_sent = 0
+        self.full_bytes = 0
+        self.bytes_received = 0
+
+    def baseline(self):
+        """
+        Returns the acknowledged state to send deltas against
+        Return: (baseline tick, state), NO_TICK and EMPTY_STATE when there is none
+        """
+        state = self.sent.get(self.acked)
+        if state is None:
+            return NO_TICK, EMPTY_STATE
+        return self.acked, state
+
+    def remember(self, tick, state):
+        """
+        Keeps a sent state as a possible baseline, forgetting what can no longer be acknowledged
+        """
+        self.sent[tick] = state
+        for old in [old for old in self.sent if old < tick - STATE_HISTORY or
+                    (self.acked != NO_TICK and old < self.acked)]:
+            del self.sent[old]
+
+
+class GameServer(asyncio.DatagramProtocol):
+    """
+    Runs a SharedWorld at TICKS_PER_SECOND and keeps every connected client
+    in sync with the part of it near their ship
+    """
+    def __init__(self, seed=None):
+        self.profiler = FrameProfiler(window=int(REPORT_INTERVAL * TICKS_PER_SECOND))
+        self.world = SharedWorld(seed, self.profiler)
+        #address -> Connection
+        self.connections = {}
+        self.next_player = 1
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if not data:
+            return
+        now = time.perf_counter()
+        connection = self.connections.get(address)
+        if data[0] == PACKET_INPUT and connection is not None and len(data) >= INPUT.size:
+            kind, sequence, ack, controls, fires = INPUT.unpack_from(data)
+            connection.last_heard = now
+            connection.bytes_received += len(data)
+            if sequence > connection.sequence:
+                connection.sequence = sequence
+                connection.player.controls = controls
+                if ack != NO_TICK and (connection.acked == NO_TICK or ack > connection.acked):
+                    connection.acked = ack
+            #shots are never dropped, even from a late packet
+            connection.player.fires += fires
+        elif data[0] == PACKET_JOIN and len(data) >= JOIN.size:
+            kind, version = JOIN.unpack_from(data)
+            if version != PROTOCOL_VERSION:
+                return
+            if connection is None:
+                connection = Connection(address, self.world.join(self.next_player), now)
+                self.connections[address] = connection
+                self.next_player += 1
+            self.transport.sendto(WELCOME.pack(PACKET_WELCOME, PROTOCOL_VERSION, connection.player.id,
+                                               TICKS_PER_SECOND), address)
+        elif data[0] == PACKET_LEAVE and connection is not None:
+            self.drop(connection)
+
+    def drop(self, connection):
+        """
+        Forgets a client and removes its ship from the field
+        """
+        del self.connections[connection.address]
+        self.world.leave(connection.player.id)
+
+    def tick(self):
+        """
+        Steps the world once and sends every client its state
+        """
+        profiler = self.profiler
+        now = time.perf_counter()
+        with profiler.phase("tick"):
+            for connection in [connection for connection in self.connections.values()
+                               if now - connection.last_heard > CLIENT_TIMEOUT]:
+                self.drop(connection)
+            with profiler.phase("simulate"):
+                self.world.update()
+                self.world.events.clear()
+            with profiler.phase("broadcast"):
+                sent = self.broadcast()
+        profiler.end_frame({"players": len(self.connections), "entities": self.world.store.count,
+                            "bytes_sent": sent})
+
+    def broadcast(self):
+        """
+        Sends each client the entities in view of its ship, as a delta from
+        the last state it acknowledged
+        Return: bytes sent
+        """
+        tick = self.world.ticks
+        ids, kinds, values, regions = capture(self.world)
+        total = 0
+        for connection in self.connections.values():
+            player = connection.player
+            visible = VISIBLE_REGIONS[region_of(*player.view)][regions]
+            state = (ids[visible], kinds[visible], values[visible])
+            baseline_tick, baseline = connection.baseline()
+            ship = player.ship
+            data = encode_state(tick, baseline_tick, ship.store.order.item(ship.row) if ship.alive else NO_TICK,
+                                player.score, state, baseline)
+            connection.remember(tick, state)
+            connection.bytes_sent += len(data)
+            connection.full_bytes += STATE_HEADER.size + len(state[0]) * FULL_ENTITY_BYTES
+            self.transport.sendto(data, connection.address)
+            total += len(data)
+        return total
+
+    async def run(self, seconds=None, report=None):
+        """
+        Ticks at TICKS_PER_SECOND, for seconds or forever
+        :param report: file to print a load report to every REPORT_INTERVAL, if any
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = None if seconds is None else started + seconds
+        next_tick = started
+        next_report = started + REPORT_INTERVAL
+        while deadline is None or next_tick < deadline:
+            self.tick()
+            next_tick += TICK_TIME
+            now = loop.time()
+            if report is not None and now >= next_report:
+                next_report += REPORT_INTERVAL
+                print(format_report(self.report()), file=report)
+            if next_tick < now - TICK_TIME * TICKS_PER_SECOND:
+                #more than a second behind: skip ahead rather than run a burst of ticks
+                next_tick = now
+            await asyncio.sleep(max(0.0, next_tick - now))
+
+    def report(self):
+        """
+        Returns the server tick time and the bandwidth per client
+        Return: dict
+        """
+        now = time.perf_counter()
+        connections = list(self.connections.values())
+        sent = [connection.bytes_sent / max(now - connection.joined, 1e-9) for connection in connections]
+        received = [connection.bytes_received / max(now - connection.joined, 1e-9) for connection in connections]
+        full = sum(connection.full_bytes for connection in connections)
+        return {
+            "ticks": self.world.ticks,
+            "players": len(connections),
+            "entities": self.world.store.count,
+            "tick": self.profiler.stats("tick"),
+            "simulate": self.profiler.stats("simulate"),
+            "broadcast": self.profiler.stats("broadcast"),
+            "down_bytes_per_sec": sum(sent) / len(sent) if sent else 0.0,
+            "max_down_bytes_per_sec": max(sent, default=0.0),
+            "up_bytes_per_sec": sum(received) / len(received) if received else 0.0,
+            "delta_ratio": sum(connection.bytes_sent for connection in connections) / full if full else 0.0,
+        }
+
+
+def format_report(report):
+    return ("tick {ticks}  players {players}  entities {entities}  server tick p50 {p50:.2f} ms "
+            "p99 {p99:.2f} ms (simulate {simulate:.2f}, broadcast {broadcast:.2f})  per client down "
+            "{down:.0f} B/s (max {max_down:.0f}), up {up:.0f} B/s  delta {ratio:.0%} of full").format(
+        ticks=report["ticks"], players=report["players"], entities=report["entities"],
+        p50=report["tick"]["p50_ms"], p99=report["tick"]["p99_ms"], simulate=report["simulate"]["mean_ms"],
+        broadcast=report["broadcast"]["mean_ms"], down=report["down_bytes_per_sec"],
+        max_down=report["max_down_bytes_per_sec"], up=report["up_bytes_per_sec"], ratio=report["delta_ratio"])
+
+
+class NetClient():
+    """
+    The client half of the protocol, without any networking of its own: it
+    builds the packets to send and takes in the ones received. state is the
+    newest (ids, kinds, values) received, sorted by id.
+    """
+    def __init__(self):
+        self.player_id = None
+        self.tick = NO_TICK
+        self.ship_id = NO_TICK
+        self.score = 0
+        self.state = EMPTY_STATE
+        #tick -> state, kept while the server may still send deltas against it
+        self.received = {}
+        self.sequence = 0
+        self.bytes_received = 0
+        self.undecodable = 0
+
+    def join_packet(self):
+        return JOIN.pack(PACKET_JOIN, PROTOCOL_VERSION)
+
+    def leave_packet(self):
+        return LEAVE.pack(PACKET_LEAVE)
+
+    def input_packet(self, controls, fires=0):
+        """
+        Packs this tick's input, acknowledging the newest state received
+        Return: bytes
+        """
+        self.sequence += 1
+        return INPUT.pack(PACKET_INPUT, self.sequence, self.tick, controls, min(int(fires), 255))
+
+    def receive(self, data):
+        """
+        Takes in a packet from the server
+        Return: True when it brought a newer state
+        """
+        self.bytes_received += len(data)
+        if not data:
+            return False
+        if data[0] == PACKET_WELCOME and len(data) >= WELCOME.size:
+            self.player_id = WELCOME.unpack_from(data)[2]
+            return False
+        if data[0] != PACKET_STATE or len(data) < STATE_HEADER.size:
+            return False
+        tick, baseline_tick = STATE_HEADER.unpack_from(data)[1:3]
+        if self.tick != NO_TICK and tick <= self.tick:
+            return False
+        if baseline_tick == NO_TICK:
+            baseline = EMPTY_STATE
+        elif baseline_tick in self.received:
+            baseline = self.received[baseline_tick]
+        else:
+            self.undecodable += 1
+            return False
+        tick, self.ship_id, self.score, self.state = decode_state(data, baseline)
+        self.tick = tick
+        self.received[tick] = self.state
+        #the server only ever moves its baseline forward
+        if baseline_tick != NO_TICK:
+            for old in [old for old in self.received if old < baseline_tick]:
+                del self.received[old]
+        return True
+
+    @property
+    def ship_alive(self):
+        return self.ship_id != NO_TICK
+
+    def fill_store(self, store):
+        """
+        Copies the newest state into an EntityStore, so it can be drawn like a local World
+        """
+        ids, kinds, values = self.state
+        n = len(ids)
+        capacity = store.capacity
+        while capacity < n:
+            capacity *= 2
+        if capacity != store.capacity:
+            store._allocate_columns(capacity)
+        store.count = n
+        store.kind[:n] = kinds
+        store.x[:n] = values[:, 0] / POSITION_SCALE
+        store.y[:n] = values[:, 1] / POSITION_SCALE
+        store.angle[:n] = values[:, 2] / ANGLE_SCALE
+        store.alive[:n] = True
+        store.prev_x[:n] = store.x[:n]
+        store.prev_y[:n] = store.y[:n]
+        store.prev_angle[:n] = store.angle[:n]
+
+
+class LoopbackClient(asyncio.DatagramProtocol):
+    """
+    A simulated player for load tests: mashes random controls and fires now
+    and then, sending one INPUT packet per tick. loss drops that fraction of
+    incoming packets to exercise the delta baselines.
+    """
+    def __init__(self, seed, loss=0.0):
+        self.client = NetClient()
+        self.rng = random.Random(seed)
+        self.loss = loss
+        self.transport = None
+        self.controls = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.sendto(self.client.join_packet())
+
+    def datagram_received(self, data, address):
+        if self.loss and self.rng.random() < self.loss:
+            self.dropped += 1
+            return
+        self.client.receive(data)
+
+    def send_input(self):
+        if self.client.player_id is None:
+            self.transport.sendto(self.client.join_packet())
+            return
+        if self.rng.random() < 0.1:
+            self.controls = self.rng.choice((0, CONTROL_LEFT, CONTROL_RIGHT, CONTROL_THRUST,
+                                             CONTROL_THRUST | CONTROL_LEFT, CONTROL_BRAKE))
+        fires = 1 if self.rng.random() < 0.1 else 0
+        self.transport.sendto(self.client.input_packet(self.controls, fires))
+
+    async def run(self, seconds):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + seconds
+        while loop.time() < deadline:
+            self.send_input()
+            await asyncio.sleep(TICK_TIME)
+
+
+async def load_test(clients, seconds, seed, loss, port=0):
+    """
+    Runs a server and clients simulated players on loopback and checks that
+    every client rebuilt exactly the state the server last sent it
+    Return: (report dict, clients whose state did not match)
+    """
+    loop = asyncio.get_running_loop()
+    transport, server = await loop.create_datagram_endpoint(lambda: GameServer(seed), local_addr=("127.0.0.1", port))
+    address = transport.get_extra_info("sockname")
+    bots = []
+    for index in range(clients):
+        bot_transport, bot = await loop.create_datagram_endpoint(
+            lambda index=index: LoopbackClient(seed * 1000 + index, loss), remote_addr=address)
+        bots.append(bot)
+
+    server_task = asyncio.ensure_future(server.run(seconds + 1.0, report=sys.stderr))
+    await asyncio.gather(*(bot.run(seconds) for bot in bots))
+    report = server.report()
+    mismatched = 0
+    for bot in bots:
+        connection = server.connections.get(bot.transport.get_extra_info("sockname"))
+        sent = connection.sent.get(bot.client.tick) if connection is not None else None
+        if sent is None or not all(np.array_equal(a, b) for a, b in zip(sent, bot.client.state)):
+            mismatched += 1
+    for bot in bots:
+        bot.transport.sendto(bot.client.leave_packet())
+    await server_task
+    for bot in bots:
+        bot.transport.close()
+    transport.close()
+    return report, mismatched
+
+
+def serve(host, port, seed):
+    """
+    Serves players until interrupted
+    """
+    async def run():
+        loop = asyncio.get_running_loop()
+        transport, server = await loop.create_datagram_endpoint(lambda: GameServer(seed),
+                                                                local_addr=(host, port))
+        print("serving asteroids on {}:{}".format(*transport.get_extra_info("sockname")[:2]), file=sys.stderr)
+        try:
+            await server.run(report=sys.stderr)
+        finally:
+            transport.close()
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+def open_client_socket(host, port):
+    """
+    Opens a non-blocking UDP socket to a server, for clients that poll it from their own loop
+    Return: socket.socket
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.connect((host, port))
+    sock.setblocking(False)
+    return sock
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the multiplayer asteroids server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--clients", type=int, default=0,
+                        help="run a loopback load test with this many simulated players instead of serving")
+    parser.add_argument("--seconds", type=float, default=10.0, help="length of the load test")
+    parser.add_argument("--loss", type=float, default=0.0, help="fraction of packets the simulated players drop")
+    args = parser.parse_args(argv)
+
+    if not args.clients:
+        serve(args.host, args.port, args.seed)
+        return
+    report, mismatched = asyncio.run(load_test(args.clients, args.seconds, args.seed, args.loss))
+    print(format_report(report), file=sys.stderr)
+    print("{} of {} clients out of sync with the server".format(mismatched, args.clients), file=sys.stderr)
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,471 @@
+"""
+File: snapshot.py
+Compact binary snapshots of an asteroids World.
+
+A snapshot is a fixed header (the world's counters and the layout of what
+follows), the state of the world's random generator, a type code for each
+column, then the WIRE_COLUMNS of the EntityStore packed as raw arrays of
+their first count rows. Each column travels as the narrowest WIRE_TYPES
+type that holds all of its values bit for bit, so a restored world replays
+exactly. The Python objects are not pickled: the kind column says which
+class owns each row and the order column gives the order of the asteroid
+and bullet lists, so decode_into() rebuilds the objects and lists from the
+columns, reusing the world's own objects where it can, and only copies the
+columns when the world's rows already belong to the same objects. Last come
+the rows of the live objects of each "recycle" pool, oldest first, as that
+order decides which object the pool reuses next.
+
+    python snapshot.py --entities 10000
+"""
+import argparse
+import gc
+import struct
+import sys
+import time
+
+import numpy as np
+
+from asteroidsFinal import (COLLISION_BACKENDS, KIND_BIG_ROCK, KIND_BULLET, KIND_MEDIUM_ROCK, KIND_SHIP,
+                            KIND_SMALL_ROCK, SCREEN_HEIGHT, SCREEN_WIDTH, Bullet, LargeRock, MediumRock, Ship,
+                            SmallRock, World)
+
+MAGIC = b"ASTS"
+SNAPSHOT_VERSION = 2
+
+# magic, version, flags, collision backend, seed, ticks, score, next spawn order,
+# controls, ship row, entity count
+HEADER = struct.Struct("<4sHBBqqqqiiI")
+
+# random.Random state: version and the gauss value, then 625 words
+RNG_HEADER = struct.Struct("<Id")
+RNG_WORDS = 625
+
+# number of "recycle" pools whose live order follows the columns; then for
+# each, its kind and live object count followed by their rows, oldest first
+RECYCLE_POOLS = struct.Struct("<B")
+RECYCLE_POOL = struct.Struct("<bI")
+
+FLAG_NO_SEED = 1
+FLAG_GAUSS = 2
+
+# EntityStore columns a snapshot holds, in order. prev_x, prev_y and
+# prev_angle only steer the renderer's interpolation, so a restored world
+# gets copies of x, y and angle there instead
+WIRE_COLUMNS = ("x", "y", "dx", "dy", "angle", "spin", "radius", "life", "alive", "kind", "order")
+
+# types a column may travel as, narrowest first; a snapshot names one per column by index
+WIRE_TYPES = tuple(np.dtype(dtype) for dtype in (np.bool_, np.int8, np.int16, np.int32, np.float32,
+                                                  np.int64, np.float64))
+# below this many rows columns travel as they are, as picking narrower types costs more than it saves
+NARROW_MIN_ROWS = 256
+
+# the integer ones with the range each holds
+WIRE_INT_RANGES = tuple((dtype, np.iinfo(dtype).min, np.iinfo(dtype).max) for dtype in WIRE_TYPES
+                        if dtype.kind == "i")
+
+# class of the object owning a row of each kind
+KIND_TYPES = {
+    KIND_SHIP: Ship,
+    KIND_BULLET: Bullet,
+    KIND_BIG_ROCK: LargeRock,
+    KIND_MEDIUM_ROCK: MediumRock,
+    KIND_SMALL_ROCK: SmallRock,
+}
+
+# whether each int8 kind, as a uint8, has a class in KIND_TYPES
+KNOWN_KINDS = np.zeros(256, dtype=bool)
+KNOWN_KINDS[np.array(list(KIND_TYPES), dtype=np.int8).view(np.uint8)] = True
+
+# snapshots kept by a SnapshotRing
+SNAPSHOT_RING_SIZE = 64
+
+
+def wire_type(values):
+    """
+    Picks the narrowest of WIRE_TYPES that holds every value bit for bit
+    Return: index into WIRE_TYPES
+    """
+    candidates = []
+    if values.dtype.kind != "b" and len(values):
+        #the one integer type the range fits, then for floats float32
+        low = values.min()
+        high = values.max()
+        candidates = [dtype for dtype, smallest, largest in WIRE_INT_RANGES
+                      if smallest <= low and high <= largest][:1]
+        if values.dtype.kind == "f":
+            candidates.append(np.dtype(np.float32))
+    bits = values.view("u{}".format(values.itemsize))
+    for dtype in candidates:
+        if dtype.itemsize >= values.itemsize:
+            break
+        with np.errstate(over="ignore", invalid="ignore"):
+            packed = values.astype(dtype)
+        if np.array_equal(packed.astype(values.dtype).view(bits.dtype), bits):
+            return WIRE_TYPES.index(dtype)
+    return WIRE_TYPES.index(values.dtype)
+
+
+def encode(world):
+    """
+    Packs the whole state of world into bytes
+    Return: bytes
+    """
+    store = world.store
+    count = store.count
+    columns = [getattr(store, name)[:count] for name in WIRE_COLUMNS]
+    if count >= NARROW_MIN_ROWS:
+        codes = [wire_type(column) for column in columns]
+    else:
+        codes = [WIRE_TYPES.index(column.dtype) for column in columns]
+    version, words, gauss = world.rng.getstate()
+    flags = (FLAG_NO_SEED if world.seed is None else 0) | (FLAG_GAUSS if gauss is not None else 0)
+    parts = [
+        HEADER.pack(MAGIC, SNAPSHOT_VERSION, flags, COLLISION_BACKENDS.index(world.collision_backend),
+                    world.seed or 0, world.ticks, world.score, store.next_order, world.controls,
+                    world.ship.row, count),
+        RNG_HEADER.pack(version, gauss or 0.0),
+        np.array(words, dtype=np.uint32).tobytes(),
+        bytes(codes),
+    ]
+    for column, code in zip(columns, codes):
+        parts.append(column.astype(WIRE_TYPES[code], copy=False).tobytes())
+    #which object a full "recycle" pool reuses next is not in the columns
+    recycling = [pool for pool in store.pools.values() if pool.policy == "recycle"]
+    parts.append(RECYCLE_POOLS.pack(len(recycling)))
+    for pool in recycling:
+        parts.append(RECYCLE_POOL.pack(pool.cls.kind, len(pool.live)))
+        parts.append(np.fromiter((obj.row for obj in pool.live), dtype=np.int32, count=len(pool.live)).tobytes())
+    return b"".join(parts)
+
+
+def decode(data, profiler=None):
+    """
+    Builds a new World from a snapshot
+    Return: World
+    """
+    world = World(profiler=profiler)
+    decode_into(world, data)
+    return world
+
+
+def decode_into(world, data):
+    """
+    Puts world into the state saved in a snapshot. When every row of the
+    world already holds an object of the saved kind and spawn order, only the
+    columns are copied. Otherwise the world's ship, rocks, bullets and pooled
+    objects are reused for the restored rows before any new object is made.
+    """
+    magic, version, flags, backend, seed, ticks, score, next_order, controls, ship_row, count = \
+        HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("not an asteroids world snapshot")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError("unsupported snapshot version {}".format(version))
+    offset = HEADER.size
+    rng_version, gauss = RNG_HEADER.unpack_from(data, offset)
+    offset += RNG_HEADER.size
+    words = np.frombuffer(data, dtype=np.uint32, count=RNG_WORDS, offset=offset)
+    offset += words.nbytes
+    codes = np.frombuffer(data, dtype=np.uint8, count=len(WIRE_COLUMNS), offset=offset).tolist()
+    offset += len(WIRE_COLUMNS)
+    wire = {}
+    for name, code in zip(WIRE_COLUMNS, codes):
+        if code >= len(WIRE_TYPES):
+            raise ValueError("snapshot column {} has an unknown type".format(name))
+        wire[name] = np.frombuffer(data, dtype=WIRE_TYPES[code], count=count, offset=offset)
+        offset += wire[name].nbytes
+    live_rows = {}
+    pools, = RECYCLE_POOLS.unpack_from(data, offset)
+    offset += RECYCLE_POOLS.size
+    for pool in range(pools):
+        kind, live = RECYCLE_POOL.unpack_from(data, offset)
+        offset += RECYCLE_POOL.size
+        live_rows[kind] = np.frombuffer(data, dtype=np.int32, count=live, offset=offset)
+        offset += live_rows[kind].nbytes
+        if live and not (0 <= live_rows[kind].min() and live_rows[kind].max() < count):
+            raise ValueError("snapshot pool order names rows it does not hold")
+
+    store = world.store
+    if count == store.count and np.array_equal(store.kind[:count], wire["kind"]) and \
+            np.array_equal(store.order[:count], wire["order"]):
+        copy_columns(store, wire, count)
+        owners = store.owners
+        for cls, pool in store.pools.items():
+            #only the "recycle" policy cares which live object is oldest
+            if pool.policy == "recycle" and cls.kind not in live_rows:
+                rows = np.flatnonzero(wire["kind"] == cls.kind)
+                rows = rows[np.argsort(wire["order"][rows], kind="stable")]
+                pool.live = dict.fromkeys(owners[row] for row in rows.tolist())
+        world.ship = owners[ship_row]
+    else:
+        #the rebuild makes and rebinds thousands of objects in one go; collecting in between finds nothing
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            rebuild_objects(world, wire, count, ship_row)
+        finally:
+            if collecting:
+                gc.enable()
+    for kind, rows in live_rows.items():
+        pool = store.pools.get(KIND_TYPES.get(kind))
+        if pool is not None:
+            pool.live = dict.fromkeys(store.owners[row] for row in rows.tolist())
+    store.next_order = next_order
+
+    world.seed = None if flags & FLAG_NO_SEED else seed
+    world.ticks = ticks
+    world.score = score
+    world.controls = controls
+    world.collision_backend = COLLISION_BACKENDS[backend]
+    world.rng.setstate((rng_version, tuple(words.tolist()), gauss if flags & FLAG_GAUSS else None))
+    world.events = []
+    world.reclaimed = (0, 0)
+
+
+def copy_columns(store, wire, count):
+    """
+    Writes the snapshot columns over the first count rows of store. The
+    previous tick's state is taken to be the current one, so the first frame
+    after a restore draws it without interpolating.
+    """
+    for name, values in wire.items():
+        getattr(store, name)[:count] = values
+    store.prev_x[:count] = store.x[:count]
+    store.prev_y[:count] = store.y[:count]
+    store.prev_angle[:count] = store.angle[:count]
+
+
+def rebuild_objects(world, wire, count, ship_row):
+    """
+    Hands the snapshot rows to objects of their classes and rebuilds the game
+    lists and the pools from them. An object the world has now that the
+    snapshot also holds (same kind and spawn order, as after a rewind) keeps
+    its place and only moves row if it has to; the other rows go to the
+    world's remaining objects of their class, then to new objects made in
+    one go per class.
+    """
+    store = world.store
+    #fromiter, as assigning a list to an object array probes every object for array interfaces
+    current = np.fromiter(store.owners, dtype=object, count=store.count)
+    current_kinds = store.kind[:store.count].copy()
+    current_order = store.order[:store.count].copy()
+
+    store.count = 0
+    capacity = store.capacity
+    while capacity < count:
+        capacity *= 2
+    if capacity != store.capacity:
+        store._allocate_columns(capacity)
+    copy_columns(store, wire, count)
+    store.count = count
+
+    kinds = store.kind[:count]
+    order = store.order[:count]
+    if not KNOWN_KINDS[kinds.view(np.uint8)].all():
+        raise ValueError("snapshot holds rows of unknown kinds")
+
+    # every row in spawn order, which is the order of the game lists
+    by_order = np.argsort(order, kind="stable")
+    kinds_by_order = kinds[by_order]
+
+    # objects in both the world and the snapshot, found by spawn order (unique per live object)
+    current_by_order = np.argsort(current_order, kind="stable")
+    current_sorted = current_order[current_by_order]
+    at = np.minimum(np.searchsorted(current_sorted, order[by_order]), len(current_sorted) - 1)
+    found = current_sorted[at] == order[by_order]
+    then = by_order[found]
+    now = current_by_order[at[found]]
+    same = current_kinds[now] == kinds[then]
+    now = now[same]
+    then = then[same]
+    owners = np.empty(count, dtype=object)
+    owners[then] = current[now]
+    moved = now != then
+    for obj, row in zip(current[now[moved]].tolist(), then[moved].tolist()):
+        obj.row = row
+    gone = np.ones(len(current), dtype=bool)
+    gone[now] = False
+    unowned = np.ones(count, dtype=bool)
+    unowned[then] = False
+
+    # the unowned rows of each kind go, in spawn order, to the objects of its
+    # class that are gone from the game, then to new ones
+    unowned_by_order = unowned[by_order]
+    spare = {}
+    added = {}
+    for kind, cls in KIND_TYPES.items():
+        rows = by_order[unowned_by_order & (kinds_by_order == kind)]
+        row_list = rows.tolist()
+        free = current[gone & (current_kinds == kind)].tolist()
+        pool = store.pools.get(cls)
+        if pool is not None:
+            free.extend(pool.free)
+        reused = min(len(free), len(row_list))
+        objects = free[len(free) - reused:]
+        del free[len(free) - reused:]
+        for obj, row in zip(objects, row_list):
+            obj.row = row
+        objects += cls.adopt_rows(store, row_list[reused:])
+        owners[rows] = np.fromiter(objects, dtype=object, count=len(objects))
+        spare[cls] = free
+        added[cls] = objects
+    store.owners = owners.tolist()
+
+    objects_by_order = owners[by_order]
+    world.asteroids[:] = objects_by_order[kinds_by_order >= KIND_BIG_ROCK].tolist()
+    world.bullets[:] = objects_by_order[kinds_by_order == KIND_BULLET].tolist()
+    world.ship = owners[ship_row]
+
+    for cls, pool in store.pools.items():
+        if pool.policy == "recycle":
+            #its oldest live object is the next one it reuses
+            pool.live = dict.fromkeys(objects_by_order[kinds_by_order == cls.kind].tolist())
+        else:
+            #the other policies only look at how many objects are live
+            live = pool.live
+            for obj in current[gone & (current_kinds == cls.kind)].tolist():
+                live.pop(obj, None)
+            live.update(dict.fromkeys(added[cls]))
+        pool.free = spare[cls][:pool.capacity]
+        for obj in pool.free:
+            obj.row = -1
+        pool.high_water = max(pool.high_water, len(pool.live))
+
+
+class SnapshotRing():
+    """
+    The most recent snapshots of a world, oldest overwritten first, for
+    rewinding a few seconds of play
+    """
+    def __init__(self, capacity=SNAPSHOT_RING_SIZE):
+        self.capacity = capacity
+        self.ticks = [None] * capacity
+        self.snapshots = [None] * capacity
+        self.next = 0
+
+    def push(self, world):
+        """
+        Saves a snapshot of world under its current tick
+        """
+        self.ticks[self.next] = world.ticks
+        self.snapshots[self.next] = encode(world)
+        self.next = (self.next + 1) % self.capacity
+
+    def latest(self, tick):
+        """
+        Finds the newest snapshot taken at or before tick
+        Return: tuple of (tick, snapshot bytes), or None
+        """
+        best = None
+        for slot, saved in enumerate(self.ticks):
+            if saved is not None and saved <= tick and (best is None or saved > self.ticks[best]):
+                best = slot
+        if best is None:
+            return None
+        return self.ticks[best], self.snapshots[best]
+
+    def discard_after(self, tick):
+        """
+        Forgets every snapshot taken after tick
+        """
+        for slot, saved in enumerate(self.ticks):
+            if saved is not None and saved > tick:
+                self.ticks[slot] = None
+                self.snapshots[slot] = None
+
+    def rewind(self, world, ticks):
+        """
+        Puts world back to the newest snapshot at least ticks ticks old and
+        forgets the snapshots after it
+        Return: the tick rewound to, or None when no snapshot is old enough
+        """
+        found = self.latest(world.ticks - ticks)
+        if found is None:
+            return None
+        tick, data = found
+        decode_into(world, data)
+        self.discard_after(tick)
+        return tick
+
+
+def build_world(entities, seed):
+    """
+    Makes a world holding about entities rocks and bullets, advanced a few
+    ticks so every column is filled in
+    Return: World
+    """
+    world = World(seed)
+    rng = world.rng
+    for i in range(entities - len(world.asteroids) - 1):
+        if i % 10 == 0:
+            world.store.spawn(Bullet, world.bullets, rng.uniform(0, 360), rng.uniform(0, SCREEN_WIDTH),
+                              rng.uniform(0, SCREEN_HEIGHT)).fire()
+            continue
+        rock = world.store.spawn(rng.choice((MediumRock, SmallRock)), world.asteroids)
+        rock.center.x = rng.uniform(0, SCREEN_WIDTH)
+        rock.center.y = rng.uniform(0, SCREEN_HEIGHT)
+        rock.velocity.dx = rng.uniform(-2, 2)
+        rock.velocity.dy = rng.uniform(-2, 2)
+    for tick in range(3):
+        world.update()
+    world.events.clear()
+    return world
+
+
+def best_time(function, repeats, setup=None):
+    """
+    Returns the fastest of repeats calls of function, in seconds
+    :param setup: called untimed before each call, when given
+    """
+    best = None
+    for repeat in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark world snapshot encoding and decoding")
+    parser.add_argument("--entities", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    for entities in args.entities:
+        world = build_world(entities, args.seed)
+        data = encode(world)
+        target = World(args.seed)
+        decode_into(target, data)
+        assert encode(target) == data, "snapshot did not round trip"
+        for tick in range(10):
+            world.update()
+            target.update()
+        assert encode(target) == encode(world), "restored world did not replay exactly"
+        data = encode(world)
+        count = world.store.count
+        #ten more ticks of shots, so the rows no longer match the snapshot
+        rng = world.rng
+        for tick in range(10):
+            world.store.spawn(Bullet, world.bullets, rng.uniform(0, 360), rng.uniform(0, SCREEN_WIDTH),
+                              rng.uniform(0, SCREEN_HEIGHT)).fire()
+            world.update()
+        later = encode(world)
+        encode_time = best_time(lambda: encode(world), args.repeats)
+        #into a world whose rows already match, into one that moved on since, and into a fresh one
+        decode_time = best_time(lambda: decode_into(target, data), args.repeats)
+        rewind_time = best_time(lambda: decode_into(target, data), args.repeats,
+                                setup=lambda: decode_into(target, later))
+        rebuild_time = best_time(lambda: decode(data), args.repeats)
+        print("{:7} entities  {:9} bytes ({:.0f} per entity)  encode {:.3f} ms  decode {:.3f} ms  "
+              "rewind {:.3f} ms  rebuild {:.3f} ms".format(
+                  count, len(data), len(data) / count, encode_time * 1000,
+                  decode_time * 1000, rewind_time * 1000, rebuild_time * 1000),
+              file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+File: test_benchmark.py
+Tests of the benchmark harness driving an asteroidsFinal.World.
+"""
+import asteroidsFinal
+import benchmark
+
+
+def test_fire_into_a_full_drop_pool():
+    harness = benchmark.WorldHarness(asteroidsFinal, 0, "grid")
+    store = harness.world.store
+    store.pools[asteroidsFinal.Bullet] = asteroidsFinal.ObjectPool(asteroidsFinal.Bullet, store, 4, "drop")
+    for shot in range(10):
+        harness.fire(0, asteroidsFinal.SCREEN_WIDTH / 2, asteroidsFinal.SCREEN_HEIGHT / 2)
+    assert harness.counts()[1] == 4
+    assert store.pools[asteroidsFinal.Bullet].dropped == 6
+    harness.tick()
@@ -0,0 +1,67 @@
+"""
+File: test_collisions.py
+Checks that the grid, numpy and scalar collision backends play out the same
+world, under every pool policy, both in a sparse field (where the grid
+backend falls back to numpy_overlaps) and in one of more than
+GRID_MIN_ROCKS rocks.
+"""
+import math
+import random
+
+import pytest
+
+import asteroidsFinal
+import benchmark
+
+from asteroidsFinal import COLLISION_BACKENDS
+from asteroidsFinal import GRID_MIN_ROCKS
+from asteroidsFinal import POOL_POLICIES
+
+# small enough that every policy kicks in within a few ticks
+POOL_CAPACITY = 24
+
+
+def play(backend, policy, seed, rocks, ticks=150):
+    """
+    Plays a seeded world with random controls and shots on one backend
+    :param rocks: how many large rocks to add to the field first
+    Return: the world's state after the last tick
+    """
+    world = asteroidsFinal.World(seed)
+    world.set_collision_backend(backend)
+    store = world.store
+    for cls in (asteroidsFinal.Bullet, asteroidsFinal.MediumRock, asteroidsFinal.SmallRock):
+        store.pools[cls] = asteroidsFinal.ObjectPool(cls, store, POOL_CAPACITY, policy)
+    rng = random.Random(seed)
+    for i in range(rocks):
+        rock = asteroidsFinal.LargeRock(store, world.rng)
+        rock.x = rng.uniform(0, asteroidsFinal.SCREEN_WIDTH)
+        rock.y = rng.uniform(0, asteroidsFinal.SCREEN_HEIGHT)
+        world.asteroids.append(rock)
+    for tick in range(ticks):
+        if tick % 30 == 0:
+            world.ship.alive = True
+        world.step(rng.randrange(32), rng.random() < 0.3)
+        #shots from the middle of the field keep rocks breaking after the ship is gone
+        if rng.random() < 0.3:
+            bullet = store.spawn(asteroidsFinal.Bullet, world.bullets, rng.uniform(0, 360),
+                                 asteroidsFinal.SCREEN_WIDTH / 2, asteroidsFinal.SCREEN_HEIGHT / 2)
+            if bullet is not None:
+                bullet.fire()
+    return (world.score, world.ship.alive,
+            [(type(rock).__name__, rock.x, rock.y, rock.alive) for rock in world.asteroids],
+            [(bullet.x, bullet.y, bullet.alive) for bullet in world.bullets])
+
+
+@pytest.mark.parametrize("rocks", [0, GRID_MIN_ROCKS + 44])
+@pytest.mark.parametrize("policy", POOL_POLICIES)
+@pytest.mark.parametrize("seed", [0, 1])
+def test_backends_agree(seed, policy, rocks):
+    states = [play(backend, policy, seed, rocks) for backend in COLLISION_BACKENDS]
+    assert states[0][0] > 0
+    for state in states[1:]:
+        assert state == states[0]
+
+
+def test_benchmark_scenarios_agree():
+    assert benchmark.check_backends(["split_cascade", "sustained_fire"], 60, [0, 1]) == []
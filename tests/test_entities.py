@@ -0,0 +1,177 @@
+"""
+File: test_entities.py
+Tests of EntityStore.release, remap_lists and the EntityList row buffer.
+
+Every check compares EntityList.rows() against the rows gathered from the
+objects themselves, which is what the list would return if it never kept a
+buffer at all.
+"""
+import random
+
+import numpy as np
+import pytest
+
+from asteroidsFinal import EntityList
+from asteroidsFinal import EntityStore
+from asteroidsFinal import LIST_DELETE_LIMIT
+from asteroidsFinal import SmallRock
+
+
+def make_list(count, capacity=8):
+    """
+    Builds a store (small, so it grows on the way) and an EntityList of count rocks in it
+    Return: tuple of (store, list)
+    """
+    store = EntityStore(capacity)
+    objects = EntityList(store)
+    for i in range(count):
+        objects.append(SmallRock(store))
+    return store, objects
+
+
+def assert_rows(store, *lists):
+    """
+    Checks that each list's rows() are its objects' rows and that the store agrees
+    """
+    for objects in lists:
+        assert objects.rows().tolist() == [obj.row for obj in objects]
+        for obj in objects:
+            assert store.owners[obj.row] is obj
+    assert len(store.owners) == store.count
+
+
+def remove_dead(store, objects):
+    """
+    Frees the dead objects the way World.remove_dead does
+    """
+    flags = store.alive[objects.rows()]
+    for index in np.flatnonzero(~flags).tolist():
+        store.release(objects[index])
+    objects.keep(flags)
+
+
+def test_release_last_row():
+    store, objects = make_list(5)
+    objects.rows()
+    objects[-1].alive = False
+    remove_dead(store, objects)
+    assert store.count == 4
+    assert not store.moved
+    assert_rows(store, objects)
+
+
+def test_release_last_row_after_it_was_moved_into():
+    store, objects = make_list(5)
+    objects.rows()
+    moved = store.owners[4]
+    store.release(store.owners[1])
+    assert moved.row == 1 and store.moved == {1: 4}
+    #free rows 3 and 2 so the moved rock sits in the last row, then free it
+    for row in (3, 2, 1):
+        store.release(store.owners[row])
+    assert not store.moved
+    objects.keep(np.array([obj.row >= 0 for obj in objects]))
+    assert_rows(store, objects)
+
+
+def test_chained_moves_in_one_tick():
+    store, objects = make_list(6)
+    objects.rows()
+    first = objects[5]
+    #row 5 moves into 4, then on to 0: one entry maps 0 back to 5
+    store.release(objects[4])
+    store.release(objects[0])
+    assert first.row == 0
+    assert store.moved == {0: 5}
+    flags = np.ones(len(objects), dtype=bool)
+    flags[[0, 4]] = False
+    objects.keep(flags)
+    assert_rows(store, objects)
+
+
+def test_chained_moves_over_a_moved_row():
+    store, objects = make_list(6)
+    objects.rows()
+    #5 moves into 1, then once the rock from 5 is freed too, 4 moves into 1 over it
+    store.release(objects[1])
+    store.release(objects[5])
+    assert objects[4].row == 1
+    assert store.moved == {1: 4}
+    flags = np.ones(len(objects), dtype=bool)
+    flags[[1, 5]] = False
+    objects.keep(flags)
+    store.release(objects[0])
+    flags = np.ones(len(objects), dtype=bool)
+    flags[0] = False
+    objects.keep(flags)
+    assert_rows(store, objects)
+
+
+def test_moves_shared_by_two_lists():
+    store, rocks = make_list(6)
+    bullets = EntityList(store)
+    for i in range(6):
+        bullets.append(SmallRock(store))
+    rocks.rows()
+    bullets.rows()
+    for row in (0, 3, 7):
+        store.owners[row].alive = False
+    remove_dead(store, rocks)
+    remove_dead(store, bullets)
+    assert_rows(store, rocks, bullets)
+
+
+@pytest.mark.parametrize("dropped", [1, LIST_DELETE_LIMIT, LIST_DELETE_LIMIT + 1, 90])
+@pytest.mark.parametrize("stale", [False, True])
+def test_keep(dropped, stale):
+    store, objects = make_list(100)
+    if not stale:
+        objects.rows()
+    rng = random.Random(dropped)
+    flags = np.ones(len(objects), dtype=bool)
+    flags[rng.sample(range(len(objects)), dropped)] = False
+    kept = [obj for obj, flag in zip(objects, flags) if flag]
+    objects.keep(flags)
+    assert list(objects) == kept
+    assert objects.stale == stale
+    assert_rows(store, objects)
+
+
+def test_append_after_releases():
+    store, objects = make_list(5)
+    objects.rows()
+    #row 4 moves into 1, and the new rock is then given row 4
+    objects[1].alive = False
+    remove_dead(store, objects)
+    fresh = SmallRock(store)
+    assert fresh.row == 4
+    objects.append(fresh)
+    assert not objects.stale
+    assert_rows(store, objects)
+
+
+def test_stale_after_list_change():
+    store, objects = make_list(5)
+    objects.rows()
+    objects.reverse()
+    assert objects.stale
+    assert_rows(store, objects)
+    objects[1:3] = []
+    assert_rows(store, objects)
+
+
+def test_random_ticks():
+    store, rocks = make_list(40)
+    bullets = EntityList(store)
+    rng = random.Random(7)
+    for tick in range(300):
+        for i in range(rng.randrange(4)):
+            (rocks if rng.random() < 0.5 else bullets).append(SmallRock(store))
+        for objects in (rocks, bullets):
+            for obj in objects:
+                if rng.random() < 0.08:
+                    obj.alive = False
+        remove_dead(store, bullets)
+        if rng.random() < 0.5:
+            remove_dead(store, rocks)
+        assert_rows(store, rocks, bullets)
@@ -0,0 +1,155 @@
+"""
+File: test_snapshot.py
+Round trips of the world snapshot: a world restored from a snapshot must
+encode back to the very same bytes, and keep playing as the world it was
+taken from.
+"""
+import random
+
+import numpy as np
+import pytest
+
+import asteroidsFinal
+import snapshot
+
+from snapshot import NARROW_MIN_ROWS
+
+# small enough that a "recycle" pool is full after a few shots
+POOL_CAPACITY = 8
+
+
+def recycling_world(seed):
+    """
+    Builds a world whose bullets come from a small "recycle" pool
+    Return: World
+    """
+    world = asteroidsFinal.World(seed)
+    world.store.pools[asteroidsFinal.Bullet] = asteroidsFinal.ObjectPool(
+        asteroidsFinal.Bullet, world.store, POOL_CAPACITY, "recycle")
+    return world
+
+
+def play(world, rng, ticks):
+    """
+    Steps world with random controls and shots, bringing the ship back now and then
+    """
+    for tick in range(ticks):
+        if tick % 30 == 0:
+            world.ship.alive = True
+        world.step(rng.randrange(32), rng.random() < 0.5)
+
+
+def state(world):
+    """
+    Returns what the game lists hold, object by object
+    Return: tuple of lists
+    """
+    return ([(type(rock).__name__, rock.x, rock.y, rock.alive) for rock in world.asteroids],
+            [(bullet.x, bullet.y, bullet.alive) for bullet in world.bullets],
+            world.ship.row, world.score)
+
+
+def wire_codes(data):
+    """
+    Reads which of WIRE_TYPES each column of a snapshot was written as
+    Return: dict of column name to type code
+    """
+    offset = snapshot.HEADER.size + snapshot.RNG_HEADER.size + 4 * snapshot.RNG_WORDS
+    return dict(zip(snapshot.WIRE_COLUMNS, data[offset:offset + len(snapshot.WIRE_COLUMNS)]))
+
+
+@pytest.mark.parametrize("entities", [20, 1000, 5000])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_round_trip(entities, seed):
+    world = snapshot.build_world(entities, seed)
+    data = snapshot.encode(world)
+    restored = asteroidsFinal.World()
+    snapshot.decode_into(restored, data)
+    assert snapshot.encode(restored) == data
+    assert state(restored) == state(world)
+
+
+def test_narrowed_columns():
+    world = snapshot.build_world(1000, 0)
+    assert world.store.count >= NARROW_MIN_ROWS
+    codes = wire_codes(snapshot.encode(world))
+    #spawn orders fit in far fewer bits than the store keeps them in
+    assert snapshot.WIRE_TYPES[codes["order"]].itemsize < world.store.order.itemsize
+    small = snapshot.build_world(20, 0)
+    codes = wire_codes(snapshot.encode(small))
+    assert snapshot.WIRE_TYPES[codes["order"]] == small.store.order.dtype
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_recycle_pool_order(seed):
+    world = recycling_world(seed)
+    rng = random.Random(seed)
+    play(world, rng, 60)
+    pool = world.store.pools[asteroidsFinal.Bullet]
+    assert pool.recycled > 0
+    data = snapshot.encode(world)
+    restored = recycling_world(None)
+    snapshot.decode_into(restored, data)
+    assert snapshot.encode(restored) == data
+    assert [obj.row for obj in restored.store.pools[asteroidsFinal.Bullet].live] == \
+        [obj.row for obj in pool.live]
+    #the next recycled bullet has to be the same one in both worlds
+    controls = random.Random(seed + 100)
+    for tick in range(60):
+        move = controls.randrange(32)
+        world.step(move, True)
+        restored.step(move, True)
+        assert snapshot.encode(restored) == snapshot.encode(world)
+
+
+@pytest.mark.parametrize("policy", asteroidsFinal.POOL_POLICIES)
+def test_rewind_after_spawns(policy):
+    world = asteroidsFinal.World(3)
+    store = world.store
+    for cls in (asteroidsFinal.Bullet, asteroidsFinal.MediumRock, asteroidsFinal.SmallRock):
+        store.pools[cls] = asteroidsFinal.ObjectPool(cls, store, POOL_CAPACITY, policy)
+    #enough rocks that the snapshot narrows its columns
+    rng = random.Random(3)
+    for i in range(NARROW_MIN_ROWS):
+        rock = store.spawn(asteroidsFinal.LargeRock, world.asteroids)
+        rock.x = rng.uniform(0, asteroidsFinal.SCREEN_WIDTH)
+        rock.y = rng.uniform(0, asteroidsFinal.SCREEN_HEIGHT)
+    play(world, rng, 5)
+    data = snapshot.encode(world)
+    assert store.count >= NARROW_MIN_ROWS
+    kept = state(world)
+    before = {rock: store.order[rock.row] for rock in world.asteroids}
+    play(world, rng, 40)
+    survivors = [rock for rock in world.asteroids if before.get(rock) == store.order[rock.row]]
+    assert survivors
+    #spawns and frees have changed which object owns which row
+    assert not np.array_equal(store.order[:store.count], snapshot.decode(data).store.order[:store.count])
+    snapshot.decode_into(world, data)
+    assert snapshot.encode(world) == data
+    assert state(world) == kept
+    #rocks that lived through the ticks since are the very objects restored to their rows
+    for rock in survivors:
+        assert store.owners[rock.row] is rock and store.order[rock.row] == before[rock]
+    for rock in world.asteroids:
+        assert store.owners[rock.row] is rock
+
+
+def test_ring_rewind():
+    world = snapshot.build_world(1000, 4)
+    ring = snapshot.SnapshotRing(8)
+    rng = random.Random(4)
+    saved = {}
+    for tick in range(30):
+        ring.push(world)
+        saved[world.ticks] = snapshot.encode(world)
+        play(world, rng, 1)
+    tick = ring.rewind(world, 5)
+    assert tick == world.ticks
+    assert snapshot.encode(world) == saved[tick]
+    #the rewound world plays on like the one that was saved
+    replay = snapshot.decode(saved[tick])
+    for step in range(20):
+        move = rng.randrange(32)
+        world.step(move, step % 3 == 0)
+        replay.step(move, step % 3 == 0)
+    assert snapshot.encode(world) == snapshot.encode(replay)
@@ -0,0 +1,54 @@
+"""
+File: test_sprites.py
+Tests that SpriteRenderer leaves every sprite where its object is, through
+the arcade sprite list buffers and through the public sprite attributes.
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip("arcade")
+
+import asteroidsFinal
+import game_window
+
+
+def drawn(sprite_list):
+    """
+    Returns the x, y and angle the sprite list's buffers hold for each sprite, in list order
+    Return: NumPy array of shape (sprites, 3)
+    """
+    slots = [sprite_list.sprite_slot[sprite] for sprite in sprite_list]
+    position = np.frombuffer(sprite_list._sprite_pos_data, dtype=np.float32).reshape(-1, 2)[slots]
+    angle = np.frombuffer(sprite_list._sprite_angle_data, dtype=np.float32)[slots]
+    return np.column_stack((position, angle))
+
+
+def expected(world):
+    """
+    Returns the x, y and angle of every drawn object in draw order, as float32 like the buffers
+    Return: NumPy array of shape (objects, 3)
+    """
+    store = world.store
+    ranks = game_window.DRAW_RANK[store.kind[:store.count]]
+    rows = np.flatnonzero(ranks >= 0)
+    rows = rows[np.argsort(ranks[rows], kind="stable")]
+    return np.column_stack((store.x[rows], store.y[rows], store.angle[rows])).astype(np.float32)
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_sync_through_growth(bulk):
+    world = asteroidsFinal.World(3)
+    renderer = game_window.SpriteRenderer()
+    assert renderer.bulk
+    renderer.bulk = bulk
+    for count in (10, 400, 3000, 50, 2000):
+        for i in range(count):
+            world.store.spawn(asteroidsFinal.SmallRock, world.asteroids)
+        world.step(asteroidsFinal.CONTROL_THRUST, True)
+        renderer.sync(world.store)
+        assert np.array_equal(drawn(renderer.sprite_list), expected(world))
+        for rock in world.asteroids[:len(world.asteroids) // 2]:
+            rock.alive = False
+        world.remove_notAliveObject()
+        renderer.sync(world.store)
+        assert np.array_equal(drawn(renderer.sprite_list), expected(world))
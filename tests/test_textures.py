@@ -0,0 +1,82 @@
+"""
+File: test_textures.py
+Tests of TextureCache handing out placeholders while loader threads add
+the real textures.
+"""
+import sys
+import threading
+
+from asteroidsFinal import TextureCache
+
+
+class FakeTexture():
+    """
+    Stands in for an arcade.Texture, which needs a window to load
+    """
+    def __init__(self, name, width=8, height=8):
+        self.name = name
+        self.width = width
+        self.height = height
+
+
+class RecordingCache(TextureCache):
+    """
+    A TextureCache whose blocking loads are recorded instead of done
+    """
+    def __init__(self):
+        super().__init__()
+        self.loaded = []
+
+    def _load_texture(self, path):
+        self.loaded.append(path)
+        return FakeTexture("loaded:" + path)
+
+
+def test_lookup_never_loads_an_expected_path():
+    cache = RecordingCache()
+    paths = ["sprite{}".format(i) for i in range(2000)]
+    for path in paths:
+        cache.expect(path, FakeTexture("placeholder:" + path))
+    atlas = {path: FakeTexture("atlas:" + path) for path in paths}
+
+    def loader():
+        for path in paths:
+            cache.add(path, atlas[path])
+
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        thread = threading.Thread(target=loader)
+        thread.start()
+        while thread.is_alive():
+            for path in paths:
+                assert cache.lookup(path)[0].name in ("placeholder:" + path, "atlas:" + path)
+        thread.join()
+    finally:
+        sys.setswitchinterval(interval)
+    assert cache.loaded == []
+    assert all(cache.get(path) is atlas[path] for path in paths)
+
+
+def test_load_keeps_an_entry_added_meanwhile():
+    cache = RecordingCache()
+    atlas = FakeTexture("atlas:rock")
+
+    def load_while_the_atlas_arrives(path):
+        cache.add(path, atlas)
+        return FakeTexture("loaded:" + path)
+    cache._load_texture = load_while_the_atlas_arrives
+
+    assert cache.get("rock") is atlas
+    assert cache.get("rock") is atlas
+    assert cache.stats()["misses"] == 1
+
+
+def test_counters():
+    cache = RecordingCache()
+    cache.expect("ship", FakeTexture("placeholder:ship"))
+    cache.lookup("ship")
+    cache.add("ship", FakeTexture("ship"))
+    cache.lookup("ship")
+    cache.lookup("rock")
+    assert cache.stats() == {"textures": 2, "hits": 1, "misses": 1, "placeholder_hits": 1}
@@ -0,0 +1,497 @@
+"""
+File: vector_env.py
+A gym-style vectorized asteroids environment for training agents.
+
+VectorEnv steps K asteroids worlds in lockstep. Instead of a World of
+Python objects per game, every field is one NumPy array with a row per world
+(ship_x has shape (K,), rock_x shape (K, rock_capacity), ...) and each tick
+applies the World.update rules to every world at once. The rules are the
+same as World.step, so a world reset with seed s and given the same actions
+plays out the same game as World(s).
+
+    env = VectorEnv(256, seed=0)
+    observations = env.reset()
+    observations, rewards, terminated, truncated = env.step(actions)
+
+An action is a CONTROL_* bitmask, plus ACTION_FIRE to fire before the tick.
+Finished worlds are reset with the next seed at the end of step().
+"""
+import argparse
+import math
+import random
+import sys
+import time
+
+import numpy as np
+
+from asteroidsFinal import (BIG_ROCK_RADIUS, BIG_ROCK_SPEED, BIG_ROCK_SPIN, BULLET_LIFE, BULLET_RADIUS,
+                            BULLET_SPEED, CONTROL_BRAKE, CONTROL_LEFT, CONTROL_REVERSE, CONTROL_RIGHT,
+                            CONTROL_THRUST, INITIAL_ROCK_COUNT, KIND_BIG_ROCK, KIND_MEDIUM_ROCK,
+                            KIND_SMALL_ROCK, MEDIUM_ROCK_RADIUS, MEDIUM_ROCK_SPIN, SCREEN_HEIGHT, SCREEN_WIDTH,
+                            SHIP_RADIUS, SHIP_THRUST_AMOUNT, SHIP_TURN_AMOUNT, SMALL_ROCK_RADIUS,
+                            SMALL_ROCK_SPIN)
+
+# action bit asking for a bullet, next to the CONTROL_* bits
+ACTION_FIRE = 32
+
+# every combination of the five controls and fire
+NUM_ACTIONS = 64
+
+# an observation row is the ship fields, then each rock field for every rock
+# slot, then each bullet field for every bullet slot
+SHIP_FIELDS = ("x", "y", "angle", "dx", "dy", "alive")
+ROCK_FIELDS = ("x", "y", "dx", "dy", "radius", "alive")
+BULLET_FIELDS = ("x", "y", "dx", "dy", "life")
+
+# a large rock and everything that can break off it: 2 medium and 1 + 4 small
+ROCKS_PER_LARGE_ROCK = 8
+
+DEFAULT_MAX_TICKS = 3600
+
+# bullet/rock reach used by the float32 broadphase: a little over the real
+# one so rounding can only let extra pairs through to the exact float64 test
+REACH = BULLET_RADIUS + 0.01
+
+
+class VectorEnv():
+    """
+    K asteroids worlds stepped together on NumPy arrays. Rocks and bullets
+    are kept in list order at the front of their rows, like World.asteroids
+    and World.bullets, so collisions resolve in the same order. A world holds
+    at most rock_capacity rocks and bullet_capacity bullets, which is every
+    rock a game can produce and every bullet that can live at once.
+    """
+    def __init__(self, num_envs, seed=0, max_ticks=DEFAULT_MAX_TICKS):
+        """
+        :param num_envs: number of worlds K
+        :param seed: seed of the first world; each reset takes the next one
+        :param max_ticks: ticks after which a game is truncated
+        """
+        self.num_envs = num_envs
+        self.max_ticks = max_ticks
+        self.next_seed = seed
+        self.rock_capacity = INITIAL_ROCK_COUNT * ROCKS_PER_LARGE_ROCK
+        self.bullet_capacity = BULLET_LIFE
+
+        shape = (num_envs,)
+        self.seeds = np.zeros(shape, dtype=np.int64)
+        self.ticks = np.zeros(shape, dtype=np.int64)
+        self.score = np.zeros(shape, dtype=np.int64)
+        self.ship_x = np.zeros(shape)
+        self.ship_y = np.zeros(shape)
+        self.ship_angle = np.zeros(shape)
+        self.ship_dx = np.zeros(shape)
+        self.ship_dy = np.zeros(shape)
+        self.ship_alive = np.zeros(shape, dtype=bool)
+
+        rocks = (num_envs, self.rock_capacity)
+        self.rock_count = np.zeros(shape, dtype=np.intp)
+        self.rock_x = np.zeros(rocks)
+        self.rock_y = np.zeros(rocks)
+        self.rock_dx = np.zeros(rocks)
+        self.rock_dy = np.zeros(rocks)
+        self.rock_angle = np.zeros(rocks)
+        self.rock_spin = np.zeros(rocks)
+        self.rock_radius = np.zeros(rocks)
+        self.rock_kind = np.zeros(rocks, dtype=np.int8)
+        self.rock_alive = np.zeros(rocks, dtype=bool)
+        self.rock_columns = (self.rock_x, self.rock_y, self.rock_dx, self.rock_dy, self.rock_angle,
+                             self.rock_spin, self.rock_radius, self.rock_kind, self.rock_alive)
+
+        bullets = (num_envs, self.bullet_capacity)
+        self.bullet_count = np.zeros(shape, dtype=np.intp)
+        self.bullet_x = np.zeros(bullets)
+        self.bullet_y = np.zeros(bullets)
+        self.bullet_dx = np.zeros(bullets)
+        self.bullet_dy = np.zeros(bullets)
+        self.bullet_life = np.zeros(bullets)
+        self.bullet_alive = np.zeros(bullets, dtype=bool)
+        self.bullet_columns = (self.bullet_x, self.bullet_y, self.bullet_dx, self.bullet_dy,
+                               self.bullet_life, self.bullet_alive)
+
+        #step() results, filled in place and returned every time
+        size = len(SHIP_FIELDS) + self.rock_capacity * len(ROCK_FIELDS) + self.bullet_capacity * len(BULLET_FIELDS)
+        self.observations = np.zeros((num_envs, size), dtype=np.float32)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.terminated = np.zeros(shape, dtype=bool)
+        self.truncated = np.zeros(shape, dtype=bool)
+        self.score_before = np.zeros(shape, dtype=np.int64)
+
+        #score and length of the last finished game of each world
+        self.final_score = np.zeros(shape, dtype=np.int64)
+        self.final_ticks = np.zeros(shape, dtype=np.int64)
+
+        start = len(SHIP_FIELDS)
+        end = start + self.rock_capacity * len(ROCK_FIELDS)
+        self.ship_view = self.observations[:, :start]
+        self.rock_view = self.observations[:, start:end].reshape(num_envs, len(ROCK_FIELDS), self.rock_capacity)
+        self.bullet_view = self.observations[:, end:].reshape(num_envs, len(BULLET_FIELDS), self.bullet_capacity)
+
+    def reset(self, seed=None):
+        """
+        Starts a new game in every world
+        :param seed: seed of the first world, or None to carry on from the last one used
+        Return: the observations array
+        """
+        if seed is not None:
+            self.next_seed = seed
+        for env in range(self.num_envs):
+            self.reset_world(env)
+        self.observe()
+        return self.observations
+
+    def reset_world(self, env):
+        """
+        Starts a new game in one world with the next seed, setting it up the
+        way World.__init__ does
+        """
+        seed = self.next_seed
+        self.next_seed += 1
+        rng = random.Random(seed)
+        self.seeds[env] = seed
+        self.ticks[env] = 0
+        self.score[env] = 0
+
+        self.ship_x[env] = SCREEN_WIDTH / 2
+        self.ship_y[env] = SCREEN_HEIGHT / 2
+        self.ship_angle[env] = 1
+        self.ship_dx[env] = 0
+        self.ship_dy[env] = 0
+        self.ship_alive[env] = True
+
+        for column in self.rock_columns:
+            column[env] = 0
+        for rock in range(INITIAL_ROCK_COUNT):
+            self.rock_x[env, rock] = rng.randint(1, 50)
+            self.rock_y[env, rock] = rng.randint(1, 150)
+            direction = rng.randint(1, 50)
+            self.rock_dx[env, rock] = math.cos(math.radians(direction)) * BIG_ROCK_SPEED
+            self.rock_dy[env, rock] = math.sin(math.radians(direction)) * BIG_ROCK_SPEED
+        self.rock_spin[env, :INITIAL_ROCK_COUNT] = BIG_ROCK_SPIN
+        self.rock_radius[env, :INITIAL_ROCK_COUNT] = BIG_ROCK_RADIUS
+        self.rock_kind[env, :INITIAL_ROCK_COUNT] = KIND_BIG_ROCK
+        self.rock_alive[env, :INITIAL_ROCK_COUNT] = True
+        self.rock_count[env] = INITIAL_ROCK_COUNT
+
+        for column in self.bullet_columns:
+            column[env] = 0
+        self.bullet_count[env] = 0
+
+    def step(self, actions):
+        """
+        Applies one action per world and advances every world by one tick.
+        The returned arrays are reused by the next step; copy them to keep them.
+        :param actions: int array of shape (K,), CONTROL_* bits plus ACTION_FIRE
+        Return: tuple of (observations, rewards, terminated, truncated)
+        """
+        actions = np.asarray(actions)
+        self.score_before[:] = self.score
+        self.fire((actions & ACTION_FIRE) != 0)
+        self.ticks += 1
+        self.check_keys(actions)
+        self.advance()
+        self.remove_dead()
+        self.check_collisions()
+        self.ship_advance()
+
+        np.subtract(self.score, self.score_before, out=self.rewards, casting="unsafe")
+        alive_rocks = self.rock_alive[:, :self.rock_count.max()].any(axis=1)
+        np.logical_not(self.ship_alive & alive_rocks, out=self.terminated)
+        np.greater_equal(self.ticks, self.max_ticks, out=self.truncated)
+        self.truncated &= ~self.terminated
+        for env in np.flatnonzero(self.terminated | self.truncated):
+            self.final_score[env] = self.score[env]
+            self.final_ticks[env] = self.ticks[env]
+            self.reset_world(env)
+        self.observe()
+        return self.observations, self.rewards, self.terminated, self.truncated
+
+    def fire(self, firing):
+        """
+        Fires a bullet from the ship of every world in firing, as World.fire.
+        A world already holding bullet_capacity bullets does not fire.
+        """
+        envs = np.flatnonzero(firing & (self.bullet_count < self.bullet_capacity))
+        if not envs.size:
+            return
+        slots = self.bullet_count[envs]
+        radians = np.radians(self.ship_angle[envs])
+        self.bullet_x[envs, slots] = self.ship_x[envs]
+        self.bullet_y[envs, slots] = self.ship_y[envs]
+        self.bullet_dx[envs, slots] = -np.sin(radians) * BULLET_SPEED
+        self.bullet_dy[envs, slots] = np.cos(radians) * BULLET_SPEED
+        self.bullet_life[envs, slots] = BULLET_LIFE
+        self.bullet_alive[envs, slots] = True
+        self.bullet_count[envs] += 1
+
+    def check_keys(self, actions):
+        """
+        Applies the held controls to every ship, in the order World.check_keys does
+        """
+        left = (actions & CONTROL_LEFT) != 0
+        self.ship_angle[left] += SHIP_TURN_AMOUNT
+        right = (actions & CONTROL_RIGHT) != 0
+        self.ship_angle[right] -= SHIP_TURN_AMOUNT
+
+        thrust = (actions & CONTROL_THRUST) != 0
+        if thrust.any():
+            radians = np.radians(self.ship_angle[thrust])
+            self.ship_dx[thrust] -= np.sin(radians) * SHIP_THRUST_AMOUNT
+            self.ship_dy[thrust] += np.cos(radians) * SHIP_THRUST_AMOUNT
+        reverse = (actions & CONTROL_REVERSE) != 0
+        if reverse.any():
+            radians = np.radians(self.ship_angle[reverse])
+            self.ship_dx[reverse] += np.sin(radians) * SHIP_THRUST_AMOUNT
+            self.ship_dy[reverse] -= np.cos(radians) * SHIP_THRUST_AMOUNT
+
+        brake = (actions & CONTROL_BRAKE) != 0
+        self.ship_dx[brake] = 0
+        self.ship_dy[brake] = 0
+
+    def advance(self):
+        """
+        Wraps, moves and spins every rock and bullet and ages the bullets, as EntityStore.step
+        """
+        rocks = self.rock_count.max()
+        x = self.rock_x[:, :rocks]
+        y = self.rock_y[:, :rocks]
+        wrap(x, y)
+        x += self.rock_dx[:, :rocks]
+        y += self.rock_dy[:, :rocks]
+        self.rock_angle[:, :rocks] += self.rock_spin[:, :rocks]
+
+        bullets = self.bullet_count.max()
+        x = self.bullet_x[:, :bullets]
+        y = self.bullet_y[:, :bullets]
+        wrap(x, y)
+        x += self.bullet_dx[:, :bullets]
+        y += self.bullet_dy[:, :bullets]
+        life = self.bullet_life[:, :bullets]
+        alive = self.bullet_alive[:, :bullets]
+        life -= alive
+        alive &= life > 0
+
+    def remove_dead(self):
+        """
+        Drops dead rocks and bullets, keeping the rest in order, as World.remove_notAliveObject
+        """
+        compact(self.rock_columns, self.rock_alive, self.rock_count)
+        compact(self.bullet_columns, self.bullet_alive, self.bullet_count)
+
+    def overlaps(self, envs, bullets, rocks):
+        """
+        Tests bullet slot bullets[i] of world envs[i] against its first rocks rocks
+        Return: boolean array of shape (len(envs), rocks)
+        """
+        max_dist = self.rock_radius[envs, :rocks] + BULLET_RADIUS
+        return ((np.abs(self.rock_x[envs, :rocks] - self.bullet_x[envs, bullets, None]) < max_dist) &
+                (np.abs(self.rock_y[envs, :rocks] - self.bullet_y[envs, bullets, None]) < max_dist) &
+                self.rock_alive[envs, :rocks])
+
+    def pending_hits(self, envs, bullets, first=0):
+        """
+        Finds which of the first bullets bullets of each world in envs overlap a
+        live rock. This is the broadphase: it tests in float32, one rock slot at
+        a time into reused buffers, and may let through a bullet that only
+        nearly overlaps; overlaps() makes the exact test.
+        :param envs: index array of worlds, or slice(None) for all of them
+        :param first: only test rocks from this slot on (an int, or one per world)
+        Return: boolean array of shape (number of worlds, bullets)
+        """
+        rocks = self.rock_count[envs].max()
+        start = np.min(first)
+        bullet_x = self.bullet_x[envs, :bullets].astype(np.float32)
+        bullet_y = self.bullet_y[envs, :bullets].astype(np.float32)
+        rock_x = self.rock_x[envs, start:rocks].T.astype(np.float32)
+        rock_y = self.rock_y[envs, start:rocks].T.astype(np.float32)
+        # dead rocks, and rocks before first, get a reach nothing is inside of
+        reach = np.where(self.rock_alive[envs, start:rocks], self.rock_radius[envs, start:rocks] + REACH, -1.0)
+        if np.ndim(first):
+            reach[np.arange(start, rocks) < first[:, None]] = -1.0
+        reach = reach.T.astype(np.float32)
+
+        pending = np.zeros(bullet_x.shape, dtype=bool)
+        distance = np.empty_like(bullet_x)
+        distance_y = np.empty_like(bullet_x)
+        near = np.empty_like(pending)
+        for rock in range(rocks - start):
+            np.subtract(bullet_x, rock_x[rock, :, None], out=distance)
+            np.abs(distance, out=distance)
+            np.subtract(bullet_y, rock_y[rock, :, None], out=distance_y)
+            np.abs(distance_y, out=distance_y)
+            np.maximum(distance, distance_y, out=distance)
+            np.less(distance, reach[rock, :, None], out=near)
+            pending |= near
+        pending &= self.bullet_alive[envs, :bullets]
+        return pending
+
+    def check_collisions(self):
+        """
+        Resolves bullet hits in bullet order within each world, all worlds at
+        once: every round takes the next bullet of each world that overlaps a
+        rock, so each bullet hits the first live rock it overlaps and fragments
+        can be hit by later bullets in the same tick, as World.check_collisions.
+        Then kills ships touching a live rock.
+        """
+        bullets = self.bullet_count.max()
+        if bullets and self.rock_count.max():
+            pending = self.pending_hits(slice(None), bullets)
+            slots = np.arange(bullets)
+            done = np.full(self.num_envs, -1)
+            while True:
+                waiting = pending & (slots > done[:, None])
+                envs = np.flatnonzero(waiting.any(axis=1))
+                if not envs.size:
+                    break
+                bullet = waiting[envs].argmax(axis=1)
+                done[envs] = bullet
+                candidates = self.overlaps(envs, bullet, self.rock_count[envs].max())
+                hit = candidates.any(axis=1)
+                if not hit.any():
+                    continue
+                split, first = self.hit(envs[hit], bullet[hit], candidates[hit].argmax(axis=1))
+                if split.size:
+                    # the fragments may be in the way of later bullets
+                    pending[split] |= self.pending_hits(split, bullets, first)
+
+        rocks = self.rock_count.max()
+        max_dist = self.rock_radius[:, :rocks] + SHIP_RADIUS
+        touching = ((np.abs(self.rock_x[:, :rocks] - self.ship_x[:, None]) < max_dist) &
+                    (np.abs(self.rock_y[:, :rocks] - self.ship_y[:, None]) < max_dist) &
+                    self.rock_alive[:, :rocks])
+        self.ship_alive &= ~touching.any(axis=1)
+
+    def hit(self, envs, bullets, rocks):
+        """
+        Breaks apart rock rocks[i] of world envs[i], hit by bullet slot bullets[i],
+        the way World.hit_asteroid and the break_apart methods do
+        Return: tuple of the worlds that got fragments and their first fragment slot
+        """
+        self.bullet_alive[envs, bullets] = False
+        self.rock_alive[envs, rocks] = False
+        self.score[envs] += 1
+
+        kinds = self.rock_kind[envs, rocks]
+        big = kinds == KIND_BIG_ROCK
+        split = envs[big | (kinds == KIND_MEDIUM_ROCK)]
+        first = self.rock_count[split]
+        if big.any():
+            where = (envs[big], rocks[big])
+            x = self.rock_x[where]
+            y = self.rock_y[where]
+            dy = self.rock_dy[where]
+            self.spawn(where[0], KIND_MEDIUM_ROCK, x, y, BIG_ROCK_SPEED, dy + 2)
+            self.spawn(where[0], KIND_MEDIUM_ROCK, x, y, BIG_ROCK_SPEED, dy - 2)
+            self.spawn(where[0], KIND_SMALL_ROCK, x, y, 0.0, dy + 5)
+        medium = kinds == KIND_MEDIUM_ROCK
+        if medium.any():
+            where = (envs[medium], rocks[medium])
+            x = self.rock_x[where]
+            y = self.rock_y[where]
+            dx = self.rock_dx[where]
+            dy = self.rock_dy[where]
+            self.spawn(where[0], KIND_SMALL_ROCK, x, y, dx + 1.5, dy + 1.5)
+            self.spawn(where[0], KIND_SMALL_ROCK, x, y, dx - 1.5, dy - 1.5)
+        return split, first
+
+    def spawn(self, envs, kind, x, y, dx, dy):
+        """
+        Appends a rock of kind to the rocks of every world in envs
+        """
+        slots = self.rock_count[envs]
+        room = slots < self.rock_capacity
+        envs = envs[room]
+        slots = slots[room]
+        if kind == KIND_MEDIUM_ROCK:
+            radius, spin = MEDIUM_ROCK_RADIUS, MEDIUM_ROCK_SPIN
+        else:
+            radius, spin = SMALL_ROCK_RADIUS, SMALL_ROCK_SPIN
+        self.rock_x[envs, slots] = x[room]
+        self.rock_y[envs, slots] = y[room]
+        self.rock_dx[envs, slots] = dx[room] if np.ndim(dx) else dx
+        self.rock_dy[envs, slots] = dy[room]
+        self.rock_angle[envs, slots] = 0
+        self.rock_spin[envs, slots] = spin
+        self.rock_radius[envs, slots] = radius
+        self.rock_kind[envs, slots] = kind
+        self.rock_alive[envs, slots] = True
+        self.rock_count[envs] += 1
+
+    def ship_advance(self):
+        """
+        Wraps and moves every ship, as Ship.advance
+        """
+        wrap(self.ship_x, self.ship_y)
+        self.ship_x += self.ship_dx
+        self.ship_y += self.ship_dy
+
+    def observe(self):
+        """
+        Copies the state of every world into the observations array
+        """
+        ship = self.ship_view
+        for field, column in enumerate((self.ship_x, self.ship_y, self.ship_angle, self.ship_dx, self.ship_dy,
+                                        self.ship_alive)):
+            ship[:, field] = column
+        rocks = self.rock_view
+        for field, column in enumerate((self.rock_x, self.rock_y, self.rock_dx, self.rock_dy, self.rock_radius,
+                                        self.rock_alive)):
+            rocks[:, field] = column
+        bullets = self.bullet_view
+        for field, column in enumerate((self.bullet_x, self.bullet_y, self.bullet_dx, self.bullet_dy,
+                                        self.bullet_life)):
+            bullets[:, field] = column
+
+
+def wrap(x, y):
+    """
+    Wraps positions that left the screen to the opposite edge, as FlyingObject.wrap
+    """
+    x[x > SCREEN_WIDTH] -= SCREEN_WIDTH
+    x[x < 0] += SCREEN_WIDTH
+    y[y > SCREEN_HEIGHT] -= SCREEN_HEIGHT
+    y[y < 0] += SCREEN_HEIGHT
+
+
+def compact(columns, alive, count):
+    """
+    Moves the live entries of every row to the front in their original order
+    and zeroes the rest, for columns sharing the alive flags and count. Only
+    rows that lost an entry are touched.
+    """
+    width = count.max()
+    kept = alive[:, :width].sum(axis=1)
+    rows = np.flatnonzero(kept != count)
+    if not rows.size:
+        return
+    live = alive[rows, :width]
+    order = np.argsort(~live, axis=1, kind="stable")
+    keep = np.take_along_axis(live, order, axis=1)
+    order += (rows * alive.shape[1])[:, None]
+    for column in columns:
+        gathered = column.ravel()[order]
+        gathered *= keep
+        column[rows, :width] = gathered
+    count[rows] = kept[rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure VectorEnv steps per second with random actions")
+    parser.add_argument("--envs", type=int, default=1024)
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    env = VectorEnv(args.envs, args.seed)
+    env.reset()
+    actions = np.random.default_rng(args.seed).integers(0, NUM_ACTIONS, size=(args.ticks, args.envs))
+    start = time.perf_counter()
+    for tick in range(args.ticks):
+        env.step(actions[tick])
+    elapsed = time.perf_counter() - start
+    print("{} envs x {} ticks: {:.0f} env-steps/s".format(args.envs, args.ticks, args.envs * args.ticks / elapsed),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()